@@ -6,37 +6,415 @@
 功能描述:
     本脚本用于自动清理指定目录下的过期日志文件。基于文件的最后修改时间，
     删除超过保留期限的日志文件，有效管理磁盘空间，防止日志文件无限增长
-    导致的存储空间耗尽问题。
+    导致的存储空间耗尽问题。支持递归清理多个目录、按通配符筛选文件、
+    预演(dry-run)删除计划，并汇总释放的空间。
+    除了按保留天数清理，还支持按磁盘预算清理：从最旧的文件开始删除，
+    直到日志总大小低于 --max-size，或所在分区使用率低于 --max-usage。
+    预算模式不会删除每个目录中最新的 --keep-newest 个文件和修改时间在 --min-age 小时以内的文件，
+    正在写入的日志一般就在其中，删掉它们释放不了空间；剩下的文件删完仍达不到预算时给出警告并停止。
+    还可以先压缩、后删除：修改时间早于 --compress-after 天的文件被压缩成 .gz / .xz，
+    只有超过 --days 的文件才会被删除，同样的磁盘可以保留多得多的历史日志。
+    删除超大文件时可以限速(--throttle-above)：先分步截断再删除，避免文件系统一次性释放
+    大量数据块造成的 I/O 卡顿影响同一块磁盘上的 nginx 等服务。
 
 技术实现:
-    - 使用 os.listdir() 遍历日志目录中的所有文件
-    - 使用 os.path.getmtime() 获取文件最后修改时间
-    - 使用 time.time() 获取当前时间戳
-    - 使用 os.remove() 安全删除过期文件
-    - 时间计算基于 Unix 时间戳和秒数转换
+    - 使用 os.scandir() 递归遍历日志目录，DirEntry 自带文件类型，
+      每个文件只需要一次 entry.stat() 就能拿到大小和修改时间
+      （原来 os.path.isfile + os.path.getmtime 每个文件要多次系统调用）
+    - 多个目录在线程池中并发遍历和删除，文件系统调用期间会释放 GIL
+    - 使用 fnmatch 按文件名或相对路径匹配 --include / --exclude 规则，
+      --exclude 匹配到目录时整个子目录都会跳过
+    - 使用 time.time() 获取当前时间戳，时间计算基于 Unix 时间戳和秒数转换
+    - 使用 os.remove() 删除过期文件，--dry-run 时只输出删除计划
+    - 预算模式复用遍历时拿到的大小和修改时间，把所有候选文件放进按修改时间排序的
+      最小堆(heapq)，跨目录从最旧的开始弹出删除，每个文件在一次运行中只 stat 一次；
+      分区使用率通过 shutil.disk_usage() 按文件系统(st_dev)分别计算
+    - 压缩在进程池(ProcessPoolExecutor)中并行执行，--compress-workers 控制进程数；
+      先写临时文件再重命名，压缩后的文件保留原文件的修改时间和权限，
+      因此按天数和按预算的清理在后续运行中仍然按原始时间计算
+    - 限速删除: 大于阈值的文件每次用 os.truncate() 截掉 --throttle-step 字节，
+      按 --throttle-rate（字节/秒）控制截断速度，截断到 0 后再 os.remove()；
+      多个目录并发清理时共用一个限速器，总速率不会超过设定值；
+      有多个硬链接的文件直接删除（截断会影响其它链接）
+
+用法:
+    python3 clear-old-logs.py /var/log/nginx /var/log/app --days 30 --include '*.log*' --exclude '*.pid'
+    python3 clear-old-logs.py /data/logs --days 7 --dry-run
+    python3 clear-old-logs.py /data/logs /var/log/nginx --max-size 200G       # 日志总量不超过 200GiB
+    python3 clear-old-logs.py /data/logs --max-usage 80 --days 90              # 分区使用率不超过 80%，且最多保留 90 天
+    python3 clear-old-logs.py /data/logs --compress-after 2 --days 30 --compress-workers 8
+                                                                               # 2-30 天的日志压缩，30 天以上删除
+    python3 clear-old-logs.py /data/logs --days 30 --throttle-above 1G --throttle-rate 200M
+                                                                               # 大于 1GiB 的文件以 200MiB/s 限速删除
 
 """
 
-import os, time
+import os, sys, gzip, lzma, time, heapq, shutil, fnmatch, argparse, threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
 log_dir = 'path/to/logs'
 
 retention_days = 30
-current_time = time.time()
-cutoff = current_time - (retention_days * 86400)
 
-for file in os.listdir(log_dir):
-    # 获取绝对路径
-    file_path = os.path.join(log_dir, file)
+# 压缩格式: (打开函数, 扩展名)
+COMPRESSORS = {
+    'gz': (gzip.open, '.gz'),
+    'xz': (lzma.open, '.xz'),
+}
+
+# 已经压缩过的文件不再压缩
+COMPRESSED_EXTS = ('.gz', '.bz2', '.xz', '.zst', '.zip', '.tgz')
+
+
+def matches_any(name, rel_path, patterns):
+    return any(fnmatch.fnmatch(name, p) or fnmatch.fnmatch(rel_path, p) for p in patterns)
+
+
+# 与 log-rotate.py、log-parser-benchmark.py 中的 parse_size 相同，脚本保持单文件可独立运行，
+# 由 tests/test_shared_copies.py 检查几份一致
+def parse_size(value):
+    """解析 '200G'、'512M'、'1048576' 这样的大小参数（按 1024 进制）"""
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+    value = value.strip().upper().rstrip('IB')
+    if value and value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
+
+
+def scan_files(root, include=('*',), exclude=()):
+    """递归遍历目录，产出 (路径, 大小, 修改时间, 设备号)，符号链接不跟随"""
+    # 默认规则下不需要做任何通配符匹配
+    match_all = list(include) == ['*']
+    prefix_len = len(os.path.join(root, ''))
+    stack = [root]
+    while stack:
+        current = stack.pop()
+        try:
+            with os.scandir(current) as it:
+                for entry in it:
+                    rel_path = entry.path[prefix_len:]
+                    if exclude and matches_any(entry.name, rel_path, exclude):
+                        continue
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        elif entry.is_file(follow_symlinks=False):
+                            if not match_all and not matches_any(entry.name, rel_path, include):
+                                continue
+                            st = entry.stat(follow_symlinks=False)
+                            yield entry.path, st.st_size, st.st_mtime, st.st_dev
+                    except OSError as e:
+                        print(f"Error reading {entry.path}: {e}", file=sys.stderr)
+        except OSError as e:
+            print(f"Error scanning {current}: {e}", file=sys.stderr)
+
+
+def new_summary(root):
+    # freed: 按设备号记录释放（或 dry-run 下应释放）的字节数
+    return {'root': root, 'scanned': 0, 'matched': 0, 'deleted': 0, 'compressed': 0, 'bytes': 0, 'errors': 0,
+            'freed': {}}
+
 
-    # 检查是否是文件
-    if os.path.isfile(file_path):
-        file_mtime = os.path.getmtime(file_path)
+class DeleteThrottle:
+    """大文件限速删除：分步截断，按每秒字节数限速，最后再删除"""
 
+    def __init__(self, threshold, rate, step=64 * 1024 * 1024):
+        self.threshold = threshold
+        self.rate = rate
+        self.step = step
+        self.lock = threading.Lock()
+        self.next_time = time.monotonic()
+
+    def wait(self, nbytes):
+        # 按速率为本次释放预约一个时间片，多个线程共用同一个速率
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_time)
+            self.next_time = start + nbytes / self.rate
+        if start > now:
+            time.sleep(start - now)
+
+    def remove(self, path):
+        st = os.stat(path)
+        if st.st_size < self.threshold or st.st_nlink > 1:
+            os.remove(path)
+            return
+        remaining = st.st_size
+        while remaining > 0:
+            step = min(self.step, remaining)
+            self.wait(step)
+            remaining -= step
+            os.truncate(path, remaining)
+        os.remove(path)
+
+
+def delete_file(path, throttle=None):
+    if throttle is None:
+        os.remove(path)
+    else:
+        throttle.remove(path)
+
+
+def remove_file(file_path, size, summary, dry_run=False, verbose=True, throttle=None):
+    """删除单个文件并记入统计信息，返回是否删除成功"""
+    summary['matched'] += 1
+    if dry_run:
+        summary['bytes'] += size
+        if verbose:
+            print(f"Would delete: {file_path} ({size} bytes)")
+        return True
+    try:
+        delete_file(file_path, throttle)
+        summary['deleted'] += 1
+        summary['bytes'] += size
+        if verbose:
+            print(f"Deleted: {file_path}")
+        return True
+    except Exception as e:
+        summary['errors'] += 1
+        print(f"Error deleting {file_path}: {e}", file=sys.stderr)
+        return False
+
+
+def clean_root(root, cutoff, include=('*',), exclude=(), dry_run=False, verbose=True, keep=None,
+               compress_cutoff=None, compress=None, throttle=None):
+    """清理单个目录中修改时间早于 cutoff 的文件，返回统计信息
+
+    cutoff 为 None 时不按时间删除；keep 不为 None 时，未删除的文件以
+    (修改时间, 大小, 路径, 设备号) 的形式追加到 keep 中，供预算模式使用。
+    compress_cutoff 不为 None 时，比它旧但还没到删除时间的未压缩文件追加到 compress 中。
+    """
+    summary = new_summary(root)
+    for file_path, size, mtime, dev in scan_files(root, include, exclude):
+        summary['scanned'] += 1
         # 如果文件的修改时间早于保留截止时间，则删除
-        if file_mtime < cutoff:
-            try:
-                os.remove(file_path)
-                print(f"Deleted: {file_path}")
-            except Exception as e:
-                print(f"Error deleting {file_path}: {e}")
\ No newline at end of file
+        if cutoff is not None and mtime < cutoff:
+            if remove_file(file_path, size, summary, dry_run, verbose, throttle):
+                summary['freed'][dev] = summary['freed'].get(dev, 0) + size
+                continue
+        if compress_cutoff is not None and mtime < compress_cutoff and not file_path.endswith(COMPRESSED_EXTS):
+            compress.append((mtime, size, file_path, dev))
+        if keep is not None:
+            keep.append((mtime, size, file_path, dev))
+    return summary
+
+
+def compress_file(task):
+    """在子进程中压缩单个文件，返回 (原路径, 新路径, 新大小, 错误信息)，原文件由主进程删除"""
+    path, fmt = task
+    opener, ext = COMPRESSORS[fmt]
+    target = path + ext
+    tmp_path = target + '.tmp'
+    try:
+        st = os.stat(path)
+        with open(path, 'rb') as src, opener(tmp_path, 'wb') as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+        # 保留原文件的权限和时间，后续按时间清理仍以原始修改时间为准
+        os.chmod(tmp_path, st.st_mode & 0o7777)
+        os.utime(tmp_path, ns=(st.st_atime_ns, st.st_mtime_ns))
+        os.replace(tmp_path, target)
+        return path, target, os.path.getsize(target), None
+    except Exception as e:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        return path, None, None, str(e)
+
+
+def compress_files(files, fmt='gz', workers=None, dry_run=False, verbose=True, throttle=None):
+    """用进程池并行压缩文件，返回 (统计信息, {原路径: (新路径, 新大小)})"""
+    summary = new_summary('compression')
+    summary['scanned'] = None
+    results = {}
+    if dry_run:
+        for _, size, path, _ in files:
+            summary['compressed'] += 1
+            if verbose:
+                print(f"Would compress: {path} ({size} bytes)")
+        return summary, results
+
+    sizes = {path: size for _, size, path, _ in files}
+    tasks = [(path, fmt) for _, _, path, _ in files]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for path, target, new_size, error in executor.map(compress_file, tasks):
+            if error is None:
+                try:
+                    # 原文件在主进程中删除，大文件同样受限速器控制
+                    delete_file(path, throttle)
+                except OSError as e:
+                    error = str(e)
+            if error is not None:
+                summary['errors'] += 1
+                print(f"Error compressing {path}: {error}", file=sys.stderr)
+                continue
+            summary['compressed'] += 1
+            summary['bytes'] += sizes[path] - new_size
+            results[path] = (target, new_size)
+            if verbose:
+                print(f"Compressed: {path} -> {target} ({sizes[path]} -> {new_size} bytes)")
+    return summary, results
+
+
+def budget_candidates(files, keep_newest=1, min_mtime=None):
+    """预算模式下可以删除的文件：去掉每个目录最新的 keep_newest 个文件和修改时间晚于 min_mtime 的文件"""
+    by_dir = {}
+    for f in files:
+        by_dir.setdefault(os.path.dirname(f[2]), []).append(f)
+    candidates = []
+    for dir_files in by_dir.values():
+        dir_files.sort()
+        if keep_newest:
+            dir_files = dir_files[:-keep_newest]
+        candidates.extend(f for f in dir_files if min_mtime is None or f[0] < min_mtime)
+    return candidates
+
+
+def enforce_budget(files, max_size=None, max_usage=None, dry_run=False, verbose=True, freed=None, throttle=None,
+                   keep_newest=1, min_mtime=None):
+    """按修改时间从旧到新删除文件，直到总大小和分区使用率都满足预算
+
+    files 为 (修改时间, 大小, 路径, 设备号) 列表；freed 是 {设备号: 字节数}，
+    表示 dry-run 下按时间清理“应该”释放但实际还占用的空间。
+    每个目录最新的 keep_newest 个文件和修改时间晚于 min_mtime 的文件不会删除，
+    可删的文件删完仍超出预算时打印警告后返回。
+    """
+    summary = new_summary('size budget')
+    summary['scanned'] = None
+    total_over = sum(f[1] for f in files) - max_size if max_size is not None else 0
+    dev_over = {}
+    if max_usage is not None:
+        # 每个文件系统取一个路径来查询使用情况
+        samples = {}
+        for _, _, path, dev in files:
+            samples.setdefault(dev, path)
+        for dev, path in samples.items():
+            usage = shutil.disk_usage(os.path.dirname(path))
+            over = usage.used - (freed or {}).get(dev, 0) - usage.total * max_usage / 100
+            if over > 0:
+                dev_over[dev] = over
+
+    files = budget_candidates(files, keep_newest, min_mtime)
+    heapq.heapify(files)
+    while files and (total_over > 0 or dev_over):
+        mtime, size, path, dev = heapq.heappop(files)
+        if total_over <= 0 and dev not in dev_over:
+            # 这个文件所在的分区已经满足预算
+            continue
+        if not remove_file(path, size, summary, dry_run, verbose, throttle):
+            continue
+        total_over -= size
+        if dev in dev_over:
+            dev_over[dev] -= size
+            if dev_over[dev] <= 0:
+                del dev_over[dev]
+    if total_over > 0 or dev_over:
+        print("Warning: size budget not reached, the remaining files are too new or still being written",
+              file=sys.stderr)
+    return summary
+
+
+def clean(roots, days=retention_days, include=('*',), exclude=(), dry_run=False, workers=4, verbose=True,
+          max_size=None, max_usage=None, compress_after=None, compress_format='gz', compress_workers=None,
+          throttle=None, keep_newest=1, min_age=1):
+    """并发清理多个目录，返回每个目录（以及压缩、预算清理）的统计信息"""
+    now = time.time()
+    cutoff = now - days * 86400 if days is not None else None
+    compress_cutoff = now - compress_after * 86400 if compress_after is not None else None
+    budget = max_size is not None or max_usage is not None
+    keeps = [[] if budget else None for _ in roots]
+    compress = [[] for _ in roots]
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(roots)))) as executor:
+        futures = [executor.submit(clean_root, root, cutoff, include, exclude, dry_run, verbose, keep,
+                                   compress_cutoff, to_compress, throttle)
+                   for root, keep, to_compress in zip(roots, keeps, compress)]
+        summaries = [future.result() for future in futures]
+
+    compressed = {}
+    to_compress = [f for files in compress for f in files]
+    if to_compress:
+        summary, compressed = compress_files(to_compress, compress_format, compress_workers, dry_run, verbose,
+                                             throttle)
+        summaries.append(summary)
+
+    if budget:
+        files = [f for keep in keeps for f in keep]
+        if compressed:
+            # 预算按压缩后的文件和大小计算
+            files = [(mtime, compressed[path][1], compressed[path][0], dev) if path in compressed
+                     else (mtime, size, path, dev) for mtime, size, path, dev in files]
+        freed = None
+        if dry_run:
+            # dry-run 时按时间清理的文件并没有真的删除，计算使用率时要扣掉
+            freed = {}
+            for s in summaries:
+                for dev, size in s['freed'].items():
+                    freed[dev] = freed.get(dev, 0) + size
+        min_mtime = now - min_age * 3600 if min_age else None
+        summaries.append(enforce_budget(files, max_size, max_usage, dry_run, verbose, freed, throttle,
+                                        keep_newest, min_mtime))
+    return summaries
+
+
+def format_size(size):
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if size < 1024:
+            return f"{size:.1f}{unit}"
+        size /= 1024
+    return f"{size:.1f}TiB"
+
+
+def print_summary(summaries, dry_run=False):
+    action = 'would free' if dry_run else 'freed'
+    for s in summaries:
+        if s['root'] == 'compression':
+            print(f"compression: {s['compressed']} files, {action} {format_size(s['bytes'])}, {s['errors']} errors")
+            continue
+        count = s['matched'] if dry_run else s['deleted']
+        scanned = f"scanned {s['scanned']} files, " if s['scanned'] is not None else ''
+        print(f"{s['root']}: {scanned}{count} removed, {action} {format_size(s['bytes'])}, {s['errors']} errors")
+    total_bytes = sum(s['bytes'] for s in summaries)
+    total_count = sum(s['matched'] if dry_run else s['deleted'] for s in summaries)
+    total_compressed = sum(s['compressed'] for s in summaries)
+    print(f"Total: {total_count} files removed, {total_compressed} compressed, {action} {format_size(total_bytes)}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Delete log files older than the retention period')
+    parser.add_argument('roots', nargs='*', default=[log_dir], help='log directories to clean (recursive)')
+    parser.add_argument('--days', type=float, default=None,
+                        help=f'retention period in days (default: {retention_days} unless a size budget is given)')
+    parser.add_argument('--max-size', type=parse_size, default=None, help='keep total size of matched files below this, e.g. 200G')
+    parser.add_argument('--max-usage', type=float, default=None, help='keep partition usage below this percentage')
+    parser.add_argument('--keep-newest', type=int, default=1,
+                        help='size budget never deletes the newest N files of each directory (default: 1)')
+    parser.add_argument('--min-age', type=float, default=1,
+                        help='size budget never deletes files modified within this many hours (default: 1)')
+    parser.add_argument('--include', action='append', default=None, help="glob of files to consider (default: '*')")
+    parser.add_argument('--exclude', action='append', default=[], help='glob of files or directories to skip')
+    parser.add_argument('--compress-after', type=float, default=None,
+                        help='compress files older than this many days instead of keeping them as-is')
+    parser.add_argument('--compress-format', default='gz', choices=sorted(COMPRESSORS))
+    parser.add_argument('--compress-workers', type=int, default=None, help='compression processes (default: CPU count)')
+    parser.add_argument('--throttle-above', type=parse_size, default=None,
+                        help='truncate files larger than this step by step before unlinking, e.g. 1G')
+    parser.add_argument('--throttle-rate', type=parse_size, default=parse_size('100M'),
+                        help='bytes per second released by throttled deletion (default: 100M)')
+    parser.add_argument('--throttle-step', type=parse_size, default=parse_size('64M'),
+                        help='bytes truncated per step (default: 64M)')
+    parser.add_argument('--dry-run', action='store_true', help='only print what would be deleted')
+    parser.add_argument('--workers', type=int, default=4, help='directories processed concurrently')
+    parser.add_argument('--quiet', action='store_true', help='do not print every file')
+    args = parser.parse_args()
+
+    days = args.days
+    if days is None and args.max_size is None and args.max_usage is None:
+        days = retention_days
+    throttle = None
+    if args.throttle_above is not None:
+        throttle = DeleteThrottle(args.throttle_above, args.throttle_rate, args.throttle_step)
+    summaries = clean(args.roots, days, args.include or ['*'], args.exclude,
+                      args.dry_run, args.workers, not args.quiet, args.max_size, args.max_usage,
+                      args.compress_after, args.compress_format, args.compress_workers, throttle,
+                      args.keep_newest, args.min_age)
+    print_summary(summaries, args.dry_run)
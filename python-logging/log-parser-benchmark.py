@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+日志解析器性能基准测试脚本
+
+功能描述:
+    为 nginx-log-analysis.py 和 prase-IP-from-logs.py 提供可重复的吞吐量测试。
+    先按指定大小（1M ~ 10G）生成确定性的 nginx 访问日志和 syslog 日志，
+    再对每个解析器和模式分别测量 lines/s、MB/s 和峰值内存(RSS)，
+    可以把结果保存为 JSON，并和之前的结果对比，发现解析性能退化。
+
+测试数据:
+    - nginx: main 格式（combined + "$http_x_forwarded_for"），包含带空格和 \\x22 转义的 User-Agent、
+      IPv4/IPv6 客户端地址、各种状态码，以及约 0.5% 的异常行
+      （截断的行、TLS 握手乱码、空请求 "-"、空行）
+    - syslog: RFC 3164 为主，混有 RFC 5424 行、不带 pid 的服务、包含 IPv6 的消息和异常行
+    - 同样的 --seed 和 --size 每次生成完全相同的文件，时间戳单调递增
+
+技术实现:
+    - 通过 importlib.util.spec_from_file_location 加载同目录下带连字符的脚本
+    - 每个模式在单独的子进程中运行，resource.getrusage() 读取该进程
+      （以及并行模式下工作进程）的峰值 RSS，互不影响
+    - 生成的文件按 种类-大小-种子 命名并缓存，重复运行不会重新生成
+    - --baseline 读取之前 --json 保存的结果，lines/s 下降超过 --tolerance 时标记为 REGRESSION 并返回非零
+
+测试模式:
+    nginx-split        make_log_praser('nginx') 按空格切分的解析器
+    nginx-format       按 NGINX_MAIN_FORMAT 编译的正则解析器
+    nginx-columnar     流式解析并填充列式结果(ColumnarLog)
+    nginx-parallel     多进程分片解析，精确聚合
+    nginx-sketch       多进程分片解析，近似聚合(SketchAggregate)
+    syslog-regex       RFC 3164/5424 正则解析器
+    syslog-messages    原来的 messages 切分解析器
+    ip-v4 / ip-v6      prase-IP-from-logs.py 的 count_ips()
+
+用法:
+    python3 log-parser-benchmark.py generate nginx 1G /data/bench/nginx-1G.log
+    python3 log-parser-benchmark.py run --size 200M --dir /data/bench --json result.json
+    python3 log-parser-benchmark.py run --size 200M --dir /data/bench --baseline result.json --tolerance 0.1
+    python3 log-parser-benchmark.py run --size 50M --modes nginx-split nginx-format ip-v4
+
+"""
+
+import os, sys, json, time, random, argparse, resource, subprocess
+import importlib.util
+from datetime import datetime, timedelta, timezone
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# 基准时间 2030-08-30 00:00:00 +0800，生成的日志从这里开始递增
+START_TIME = datetime(2030, 8, 30, tzinfo=timezone(timedelta(hours=8)))
+MONTH_NAMES = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+
+USER_AGENTS = [
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/126.0 Safari/537.36',
+    'Mozilla/5.0 (iPhone; CPU iPhone OS 17_5 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Mobile/15E148',
+    'curl/7.61.1',
+    'python-requests/2.31.0',
+    'Go-http-client/1.1',
+    'Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)',
+    'Mozilla/5.0 (compatible; \\x22Scanner\\x22 v1.0)',
+    '-',
+]
+PATHS = ['/', '/index.html', '/api/users/{}', '/api/orders/{}/items', '/static/js/app.{}.js',
+         '/static/css/site.css', '/login', '/search?q={}&page=2', '/healthz', '/favicon.ico']
+METHODS = ['GET'] * 8 + ['POST', 'PUT', 'DELETE', 'HEAD']
+STATUSES = [200] * 12 + [201, 204, 301, 302, 304, 304, 400, 401, 403, 404, 404, 499, 500, 502, 503, 504]
+REFERERS = ['-', '-', '-', 'https://www.example.com/', 'https://www.example.com/search?q=log']
+HOSTS = ['web01', 'web02', 'db01', 'cache01']
+SERVICES = [('sshd', True), ('CRON', True), ('kernel', False), ('systemd', True), ('nginx', True), ('dockerd', True)]
+
+MALFORMED_NGINX = [
+    '{ip} - - [{time}] "\\x16\\x03\\x01\\x00\\xA5\\x01\\x00\\x00\\xA1\\x03\\x03" 400 157 "-" "-" "-"',
+    '{ip} - - [{time}] "-" 400 0 "-" "-" "-"',
+    '{ip} - - [{time}] "GET /api/users/1 HT',
+    '',
+]
+
+
+# 与 clear-old-logs.py、log-rotate.py 中的 parse_size 相同，脚本保持单文件可独立运行，
+# 由 tests/test_shared_copies.py 检查几份一致
+def parse_size(value):
+    """解析 '200G'、'512M'、'1048576' 这样的大小参数（按 1024 进制）"""
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+    value = value.strip().upper().rstrip('IB')
+    if value and value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
+
+
+def load_script(filename, module_name):
+    """加载同目录下文件名带连字符的脚本；注册到 sys.modules，进程池才能 pickle 其中的函数"""
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+    spec = importlib.util.spec_from_file_location(module_name, os.path.join(SCRIPT_DIR, filename))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def make_ip_pools(rng):
+    v4 = [f"{rng.choice([10, 172, 192, 58, 114, 223])}.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, 254)}"
+          for _ in range(5000)]
+    v6 = [f"2001:db8:{rng.randint(0, 0xffff):x}:{rng.randint(0, 0xffff):x}::{rng.randint(1, 0xffff):x}"
+          for _ in range(500)]
+    return v4, v6
+
+
+def nginx_lines(rng, v4, v6, batch, second):
+    """生成一批 nginx 日志行，每秒约 200 行"""
+    lines = []
+    # 时间戳每秒只格式化一次
+    stamps = [(START_TIME + timedelta(seconds=second + s)).strftime('%d/%b/%Y:%H:%M:%S %z')
+              for s in range(batch // 200 + 1)]
+    for i in range(batch):
+        time_local = stamps[i // 200]
+        ip = rng.choice(v6) if rng.random() < 0.1 else rng.choice(v4)
+        if rng.random() < 0.005:
+            lines.append(rng.choice(MALFORMED_NGINX).format(ip=ip, time=time_local))
+            continue
+        path = rng.choice(PATHS).format(rng.randint(1, 99999))
+        forwarded = rng.choice(v4) if rng.random() < 0.3 else '-'
+        lines.append(f'{ip} - - [{time_local}] "{rng.choice(METHODS)} {path} HTTP/1.1" {rng.choice(STATUSES)} '
+                     f'{rng.randint(0, 50000)} "{rng.choice(REFERERS)}" "{rng.choice(USER_AGENTS)}" "{forwarded}"')
+    return lines
+
+
+def syslog_lines(rng, v4, v6, batch, second):
+    """生成一批 syslog 日志行，以 RFC 3164 为主，混有 RFC 5424 行和异常行"""
+    lines = []
+    times = [START_TIME + timedelta(seconds=second + s) for s in range(batch // 50 + 1)]
+    for i in range(batch):
+        t = times[i // 50]
+        host = rng.choice(HOSTS)
+        service, has_pid = rng.choice(SERVICES)
+        ip = rng.choice(v6) if rng.random() < 0.2 else rng.choice(v4)
+        kind = rng.randrange(6)
+        if kind == 0:
+            message = f'Accepted password for user{rng.randint(1, 50)} from {ip} port {rng.randint(1024, 65535)} ssh2'
+        elif kind == 1:
+            message = f'Failed password for invalid user admin from {ip} port {rng.randint(1024, 65535)} ssh2'
+        elif kind == 2:
+            message = '(root) CMD (run-parts /etc/cron.hourly)'
+        elif kind == 3:
+            message = f'[{rng.randint(1, 99999)}.{rng.randint(0, 999999):06d}] eth0: link up, 1000Mbps, full-duplex'
+        elif kind == 4:
+            message = f'Started Session {rng.randint(1, 9999)} of user root.'
+        else:
+            message = f'upstream timed out (110: Connection timed out) while connecting to upstream, client: {ip}'
+        r = rng.random()
+        if r < 0.005:
+            lines.append(rng.choice(['', '-- MARK --', f'{host} truncated line without timestamp']))
+        elif r < 0.055:
+            stamp = t.isoformat(timespec='milliseconds')
+            lines.append(f'<{rng.randint(0, 191)}>1 {stamp} {host} {service} {rng.randint(100, 99999)} - - {message}')
+        else:
+            stamp = f"{MONTH_NAMES[t.month - 1]} {t.day:2d} {t:%H:%M:%S}"
+            tag = f'{service}[{rng.randint(100, 99999)}]' if has_pid else service
+            lines.append(f'{stamp} {host} {tag}: {message}')
+    return lines
+
+
+GENERATORS = {'nginx': nginx_lines, 'syslog': syslog_lines}
+
+
+def generate(kind, size, path, seed=1, batch=10000):
+    """生成约 size 字节的确定性日志文件，返回 (行数, 字节数)"""
+    rng = random.Random(f'{kind}-{seed}')
+    v4, v6 = make_ip_pools(rng)
+    make_lines = GENERATORS[kind]
+    lines = written = second = 0
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb', buffering=4 * 1024 * 1024) as f:
+        while written < size:
+            block = make_lines(rng, v4, v6, batch, second)
+            second += batch // (200 if kind == 'nginx' else 50)
+            data = ('\n'.join(block) + '\n').encode('utf-8')
+            if written + len(data) > size:
+                # 最后一批只写到目标大小为止，保证同样的参数生成同样的文件
+                cut = data.rfind(b'\n', 0, size - written)
+                data = data[:cut + 1] if cut >= 0 else data[:data.index(b'\n') + 1]
+            f.write(data)
+            written += len(data)
+            lines += data.count(b'\n')
+    os.replace(tmp_path, path)
+    return lines, written
+
+
+def dataset_path(directory, kind, size_spec, seed):
+    return os.path.join(directory, f'bench-{kind}-{size_spec}-s{seed}.log')
+
+
+def ensure_dataset(directory, kind, size_spec, seed):
+    path = dataset_path(directory, kind, size_spec, seed)
+    if not os.path.exists(path):
+        start = time.perf_counter()
+        lines, written = generate(kind, parse_size(size_spec), path, seed)
+        print(f"Generated {path}: {lines} lines, {written / 1024 / 1024:.1f} MiB "
+              f"in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+    return path
+
+
+def count_lines(path, block_size=64 * 1024 * 1024):
+    lines = 0
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                return lines
+            lines += block.count(b'\n')
+
+
+def run_nginx_stream(path, service_name='nginx', log_format=None, workers=None):
+    nla = load_script('nginx-log-analysis.py', 'nginx_log_analysis')
+    stats = nla.ParseStats()
+    for _ in nla.parse_log_file(path, service_name, stats=stats, log_format=log_format):
+        pass
+    return stats.lines, stats.errors
+
+
+def run_nginx_format(path, workers=None):
+    nla = load_script('nginx-log-analysis.py', 'nginx_log_analysis')
+    return run_nginx_stream(path, 'nginx', nla.NGINX_MAIN_FORMAT)
+
+
+def run_nginx_columnar(path, workers=None):
+    nla = load_script('nginx-log-analysis.py', 'nginx_log_analysis')
+    stats = nla.ParseStats()
+    nla.parse_log_columnar(path, stats=stats)
+    return stats.lines, stats.errors
+
+
+def run_nginx_parallel(path, workers=None, mode='exact'):
+    nla = load_script('nginx-log-analysis.py', 'nginx_log_analysis')
+    agg = nla.parse_log_parallel(path, workers=workers, mode=mode)
+    if mode == 'sketch':
+        return agg.lines, agg.errors
+    return agg['lines'], agg['errors']
+
+
+def run_ip(path, workers=None, ipv6=False):
+    pil = load_script('prase-IP-from-logs.py', 'prase_ip_from_logs')
+    pil.count_ips(path, ipv6)
+    return None, 0
+
+
+# 模式名: (数据集, 运行函数)
+MODES = {
+    'nginx-split': ('nginx', lambda path, workers: run_nginx_stream(path, 'nginx')),
+    'nginx-format': ('nginx', run_nginx_format),
+    'nginx-columnar': ('nginx', run_nginx_columnar),
+    'nginx-parallel': ('nginx', lambda path, workers: run_nginx_parallel(path, workers, 'exact')),
+    'nginx-sketch': ('nginx', lambda path, workers: run_nginx_parallel(path, workers, 'sketch')),
+    'syslog-regex': ('syslog', lambda path, workers: run_nginx_stream(path, 'syslog')),
+    'syslog-messages': ('syslog', lambda path, workers: run_nginx_stream(path, 'messages')),
+    'ip-v4': ('nginx', lambda path, workers: run_ip(path, workers, False)),
+    'ip-v6': ('nginx', lambda path, workers: run_ip(path, workers, True)),
+}
+
+
+def peak_rss_mb():
+    # Linux 上 ru_maxrss 的单位是 KiB；并行模式取主进程和工作进程中的最大值
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max(own, children) / 1024
+
+
+def cmd_run_one(args):
+    _, func = MODES[args.mode]
+    # 先加载模块，导入时间不计入解析时间
+    load_script('nginx-log-analysis.py', 'nginx_log_analysis')
+    load_script('prase-IP-from-logs.py', 'prase_ip_from_logs')
+    start = time.perf_counter()
+    lines, errors = func(args.path, args.workers)
+    elapsed = time.perf_counter() - start
+    if lines is None:
+        lines = count_lines(args.path)
+    print(json.dumps({'mode': args.mode, 'lines': lines, 'errors': errors, 'bytes': os.path.getsize(args.path),
+                      'elapsed': elapsed, 'rss_mb': peak_rss_mb()}))
+
+
+def run_mode(mode, path, workers=None):
+    command = [sys.executable, os.path.abspath(__file__), 'run-one', mode, path]
+    if workers:
+        command += ['--workers', str(workers)]
+    result = subprocess.run(command, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"{mode} failed: {result.stderr.strip().splitlines()[-1:]}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def cmd_run(args):
+    os.makedirs(args.dir, exist_ok=True)
+    modes = args.modes or list(MODES)
+    datasets = {}
+    for kind in sorted({MODES[m][0] for m in modes}):
+        datasets[kind] = ensure_dataset(args.dir, kind, args.size, args.seed)
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = {r['mode']: r for r in json.load(f)['results']}
+
+    results = []
+    regressions = 0
+    print(f"{'mode':<17}{'lines':>12}{'errors':>9}{'seconds':>9}{'lines/s':>12}{'MB/s':>9}{'peak RSS':>11}")
+    for mode in modes:
+        best = None
+        for _ in range(args.repeat):
+            r = run_mode(mode, datasets[MODES[mode][0]], args.workers)
+            if best is None or r['elapsed'] < best['elapsed']:
+                best = r
+        best['lines_per_sec'] = best['lines'] / best['elapsed'] if best['elapsed'] else 0.0
+        best['mb_per_sec'] = best['bytes'] / 1024 / 1024 / best['elapsed'] if best['elapsed'] else 0.0
+        results.append(best)
+        note = ''
+        if mode in baseline and baseline[mode]['lines_per_sec']:
+            change = best['lines_per_sec'] / baseline[mode]['lines_per_sec'] - 1
+            note = f"  {change:+.1%}"
+            if change < -args.tolerance:
+                note += ' REGRESSION'
+                regressions += 1
+        print(f"{mode:<17}{best['lines']:>12}{best['errors']:>9}{best['elapsed']:>9.2f}"
+              f"{best['lines_per_sec']:>12,.0f}{best['mb_per_sec']:>9.1f}{best['rss_mb']:>8.1f} MB{note}", flush=True)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'size': args.size, 'seed': args.seed, 'workers': args.workers, 'python': sys.version.split()[0],
+                       'time': datetime.now().isoformat(timespec='seconds'), 'results': results}, f, indent=2)
+    return 1 if regressions else 0
+
+
+def cmd_generate(args):
+    start = time.perf_counter()
+    lines, written = generate(args.kind, parse_size(args.size), args.path, args.seed)
+    print(f"{args.path}: {lines} lines, {written / 1024 / 1024:.1f} MiB in {time.perf_counter() - start:.1f}s")
+    return 0
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description='Generate synthetic logs and benchmark the log parsers')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('generate', help='write a deterministic synthetic log file')
+    p.add_argument('kind', choices=sorted(GENERATORS))
+    p.add_argument('size', help='target size, e.g. 1M, 500M, 10G')
+    p.add_argument('path')
+    p.add_argument('--seed', type=int, default=1)
+    p.set_defaults(func=cmd_generate)
+
+    p = sub.add_parser('run', help='benchmark every parser and mode')
+    p.add_argument('--size', default='100M', help='size of the generated datasets (default: 100M)')
+    p.add_argument('--dir', default='/tmp/log-parser-benchmark', help='where datasets are generated and cached')
+    p.add_argument('--seed', type=int, default=1)
+    p.add_argument('--modes', nargs='+', choices=list(MODES), default=None, help='modes to run (default: all)')
+    p.add_argument('--workers', type=int, default=None, help='processes for the parallel modes (default: CPU count)')
+    p.add_argument('--repeat', type=int, default=1, help='runs per mode, the fastest one is reported')
+    p.add_argument('--json', default=None, help='save results to this file')
+    p.add_argument('--baseline', default=None, help='compare lines/s with results saved by --json')
+    p.add_argument('--tolerance', type=float, default=0.1, help='allowed slowdown before reporting a regression')
+    p.set_defaults(func=cmd_run)
+
+    # 内部使用：在独立进程中运行单个模式，输出一行 JSON
+    p = sub.add_parser('run-one')
+    p.add_argument('mode', choices=list(MODES))
+    p.add_argument('path')
+    p.add_argument('--workers', type=int, default=None)
+    p.set_defaults(func=cmd_run_one)
+
+    return parser
+
+
+if __name__ == '__main__':
+    args = build_arg_parser().parse_args()
+    sys.exit(args.func(args))
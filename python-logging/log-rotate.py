@@ -33,31 +33,466 @@
     - %(levelname)s: 日志级别
     - %(message)s: 日志消息内容
 
+批量异步写入:
+    RotatingFileHandler 每条日志都要同步 write、flush 并检查文件大小，
+    日志量大时调用 logger.debug 的线程会被磁盘 I/O 拖慢。
+    setup_batch_logging() 把记录器改为:
+        logger -> QueueHandler(只入队，不做 I/O) -> SimpleQueue
+               -> BatchQueueListener(后台线程，一次取出一批记录)
+               -> BatchRotatingFileHandler(拼成一次大块写入，自己累计文件大小)
+    - 轮替规则与 RotatingFileHandler 相同（继承它的 doRollover/namer/rotator），
+      写入前如果 当前大小 + 本条字节数 >= maxBytes 就先轮替
+    - 文件大小在内存里累加，不用每条记录 tell()/seek()
+    - 每批只 flush 一次；listener.stop() 会写完队列中剩余的记录
+
+轮替后后台压缩:
+    CompressingRotatingFileHandler 按大小(maxBytes)和/或时间(when/interval)轮替，
+    轮替时只把当前文件改名为带时间戳的分段（my_log.log.20250704-143025），
+    然后交给后台压缩线程，写日志的线程从不等待压缩:
+    - 后台线程把分段压缩成 .gz（先写 .gz.tmp 再改名，保留原文件的修改时间和权限）
+    - 保留数量 backupCount 按分段计算，已压缩的 .gz 和还没压缩的分段都算在内，
+      按修改时间删除最旧的分段（backupCount=0 表示全部保留）
+    - 启动时会把上次退出前没来得及压缩的分段重新放入压缩队列
+    - close() 会等待压缩队列处理完，进程退出前不会留下未压缩的分段
+
+用法:
+    python3 log-rotate.py                              # 原来的演示：写 1000 条日志观察轮替结果
+    python3 log-rotate.py bench --records 200000       # 对比标准处理器和批量处理器的 records/sec
+    python3 log-rotate.py compress --dir /tmp/logs --max-bytes 1M --when M
+                                                       # 按 1MiB 或每分钟轮替，分段在后台压缩为 .gz
+
+    logger, listener = setup_batch_logging('app', 'app.log', max_bytes=100*1024*1024, backup_count=5)
+    logger.info('...')
+    listener.stop()                                    # 退出前停止后台线程，保证日志全部落盘
+
+    handler = CompressingRotatingFileHandler('app.log', maxBytes=100*1024*1024, when='midnight', backupCount=30)
+
 """
 
-import logging, os
-from logging.handlers import RotatingFileHandler
+import logging, os, re, sys, gzip, time, queue, shutil, argparse, tempfile, threading
+from logging.handlers import RotatingFileHandler, QueueHandler
+
+log_dir = '/path/to/logs/'
+
+LOG_FORMAT = '%(asctime)s-%(name)s-%(levelname)s: %(message)s'
+DATE_FORMAT = '%Y%m%d_%H:%M:%S'
+
+
+class BatchRotatingFileHandler(RotatingFileHandler):
+    """按批写入的轮替处理器：文件大小在内存中累计，每批只写一次、flush 一次"""
+
+    def __init__(self, filename, maxBytes=0, backupCount=0, encoding='utf-8', delay=False,
+                 buffer_size=1024 * 1024):
+        self.buffer_size = buffer_size
+        super().__init__(filename, maxBytes=maxBytes, backupCount=backupCount, encoding=encoding, delay=delay)
+        self.size = self._current_size()
+
+    def _open(self):
+        # 二进制追加模式 + 大缓冲区，编码在 emit_batch 中完成，顺便得到准确的字节数
+        return open(self.baseFilename, 'ab', buffering=self.buffer_size)
+
+    def _current_size(self):
+        try:
+            return os.path.getsize(self.baseFilename)
+        except OSError:
+            return 0
+
+    def doRollover(self):
+        super().doRollover()
+        # backupCount=0 时标准处理器不会真正轮替，文件继续增长，所以重新取一次大小
+        self.size = self._current_size()
+
+    def need_rollover(self, record, nbytes):
+        return self.maxBytes > 0 and self.size and self.size + nbytes >= self.maxBytes
+
+    def emit(self, record):
+        self.emit_batch([record])
+
+    def emit_batch(self, records):
+        encoding = self.encoding or 'utf-8'
+        chunk = []
+        record = None
+        self.acquire()
+        try:
+            if self.stream is None:
+                self.stream = self._open()
+            for record in records:
+                data = (self.format(record) + self.terminator).encode(encoding)
+                if self.need_rollover(record, len(data)):
+                    # 先写出轮替前的部分，再轮替，和逐条写入的结果一致
+                    if chunk:
+                        self.stream.write(b''.join(chunk))
+                        chunk = []
+                    self.doRollover()
+                    if self.stream is None:
+                        self.stream = self._open()
+                chunk.append(data)
+                self.size += len(data)
+            if chunk:
+                self.stream.write(b''.join(chunk))
+            self.stream.flush()
+        except Exception:
+            self.handleError(record)
+        finally:
+            self.release()
+
+
+class CompressingRotatingFileHandler(BatchRotatingFileHandler):
+    """按大小和/或时间轮替，轮替出的分段由后台线程压缩为 .gz"""
+
+    WHEN_SECONDS = {'S': 1, 'M': 60, 'H': 3600, 'D': 86400}
+    SEGMENT_FORMAT = '%Y%m%d-%H%M%S'
+
+    def __init__(self, filename, maxBytes=0, when=None, interval=1, backupCount=0, encoding='utf-8',
+                 compresslevel=6, buffer_size=1024 * 1024):
+        self.when = when.upper() if when else None
+        if self.when is not None and self.when != 'MIDNIGHT' and self.when not in self.WHEN_SECONDS:
+            raise ValueError(f"Invalid rollover interval specified: {when}")
+        self.interval = interval
+        self.compresslevel = compresslevel
+        # 父类的 backupCount 只用于编号轮替，这里由压缩线程按分段数量清理
+        self.keep = backupCount
+        super().__init__(filename, maxBytes=maxBytes, backupCount=0, encoding=encoding, buffer_size=buffer_size)
+        self.segment_pattern = re.compile(re.escape(os.path.basename(self.baseFilename))
+                                          + r'\.\d{8}-\d{6}(?:\.\d+)?(?:\.gz)?$')
+        # 上一个分段的时间戳和序号，同一秒内多次轮替时序号只增不减
+        self._last_segment = (None, -1)
+        start = os.path.getmtime(self.baseFilename) if self.size else time.time()
+        self.rollover_at = self.next_rollover(start) if self.when else None
+
+        self.pending = queue.Queue()
+        self.worker = threading.Thread(target=self._compress_loop, name='log-compressor', daemon=True)
+        self.worker.start()
+        for segment in self.segments():
+            if not segment.endswith('.gz'):
+                self.pending.put(segment)
+
+    def next_rollover(self, now):
+        if self.when == 'MIDNIGHT':
+            t = time.localtime(now)
+            midnight = time.mktime((t.tm_year, t.tm_mon, t.tm_mday + 1, 0, 0, 0, 0, 0, -1))
+            return midnight + (self.interval - 1) * 86400
+        step = self.WHEN_SECONDS[self.when] * self.interval
+        return now - now % step + step
+
+    def need_rollover(self, record, nbytes):
+        if self.rollover_at is not None and record.created >= self.rollover_at:
+            if self.size:
+                return True
+            # 这个周期内没有写过日志，不生成空分段
+            self.rollover_at = self.next_rollover(record.created)
+        return super().need_rollover(record, nbytes)
+
+    def segments(self):
+        """返回所有分段（含 .gz），按修改时间从旧到新排序"""
+        directory = os.path.dirname(self.baseFilename)
+        found = []
+        for entry in os.scandir(directory):
+            if self.segment_pattern.match(entry.name):
+                try:
+                    found.append((entry.stat().st_mtime, entry.path))
+                except OSError:
+                    continue
+        return [path for _, path in sorted(found)]
+
+    def doRollover(self):
+        if self.stream:
+            self.stream.close()
+            self.stream = None
+        now = time.time()
+        segment = f"{self.baseFilename}.{time.strftime(self.SEGMENT_FORMAT, time.localtime(now))}"
+        n = self.next_segment_index(segment)
+        self._last_segment = (segment, n)
+        target = f"{segment}.{n}" if n else segment
+        if os.path.exists(self.baseFilename):
+            # 只做一次 rename，压缩和清理都交给后台线程
+            os.rename(self.baseFilename, target)
+            self.pending.put(target)
+        self.stream = self._open()
+        self.size = 0
+        if self.when:
+            self.rollover_at = self.next_rollover(now)
+
+    def next_segment_index(self, segment):
+        """同一秒内的第几个分段：取上次用过的序号和磁盘上已有的最大序号中较大的一个加一，
+        旧分段被清理后也不会重用序号"""
+        last_segment, last_index = self._last_segment
+        index = last_index + 1 if last_segment == segment else 0
+        prefix = os.path.basename(segment)
+        pattern = re.compile(re.escape(prefix) + r'(?:\.(\d+))?(?:\.gz)?(?:\.tmp)?$')
+        for entry in os.scandir(os.path.dirname(segment)):
+            m = pattern.match(entry.name)
+            if m is not None:
+                index = max(index, int(m.group(1) or 0) + 1)
+        return index
+
+    def compress_segment(self, path):
+        target = path + '.gz'
+        tmp_path = target + '.tmp'
+        try:
+            st = os.stat(path)
+            with open(path, 'rb') as src, gzip.open(tmp_path, 'wb', compresslevel=self.compresslevel) as dst:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+            os.chmod(tmp_path, st.st_mode & 0o7777)
+            os.utime(tmp_path, ns=(st.st_atime_ns, st.st_mtime_ns))
+            os.replace(tmp_path, target)
+            os.remove(path)
+        except OSError:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    def remove_old_segments(self):
+        if self.keep <= 0:
+            return
+        segments = self.segments()
+        for path in segments[:max(0, len(segments) - self.keep)]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _compress_loop(self):
+        while True:
+            path = self.pending.get()
+            try:
+                if path is None:
+                    return
+                if os.path.exists(path):
+                    self.compress_segment(path)
+                self.remove_old_segments()
+            except Exception as e:
+                print(f"Error compressing {path}: {e}", file=sys.stderr)
+            finally:
+                self.pending.task_done()
+
+    def close(self):
+        super().close()
+        if self.worker.is_alive():
+            self.pending.put(None)
+            self.worker.join()
+
+
+class BatchQueueListener:
+    """后台线程从队列中成批取出日志记录，交给处理器一次写入"""
+
+    _sentinel = None
+
+    def __init__(self, log_queue, handler, batch_size=1024):
+        self.queue = log_queue
+        self.handler = handler
+        self.batch_size = batch_size
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._monitor, name='batch-log-listener', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self.queue.put(self._sentinel)
+        self._thread.join()
+        self._thread = None
+
+    def _write(self, batch):
+        handler = self.handler
+        batch = [r for r in batch if r.levelno >= handler.level and handler.filter(r)]
+        if not batch:
+            return
+        if hasattr(handler, 'emit_batch'):
+            handler.emit_batch(batch)
+        else:
+            for record in batch:
+                handler.handle(record)
+
+    def _monitor(self):
+        q = self.queue
+        while True:
+            # 阻塞等待第一条，然后把队列中已有的记录一次取完（最多 batch_size 条）
+            record = q.get()
+            if record is self._sentinel:
+                return
+            batch = [record]
+            stop = False
+            while len(batch) < self.batch_size:
+                try:
+                    record = q.get_nowait()
+                except queue.Empty:
+                    break
+                if record is self._sentinel:
+                    stop = True
+                    break
+                batch.append(record)
+            self._write(batch)
+            if stop:
+                return
+
+
+def setup_batch_logging(name, filename, max_bytes=2000, backup_count=5, batch_size=1024,
+                        level=logging.DEBUG, fmt=LOG_FORMAT, datefmt=DATE_FORMAT):
+    """创建一个只入队的记录器和写文件的后台线程，返回 (logger, listener)"""
+    file_handler = BatchRotatingFileHandler(filename, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')
+    file_handler.setFormatter(logging.Formatter(fmt, datefmt=datefmt))
+
+    log_queue = queue.SimpleQueue()
+    logger = logging.getLogger(name)
+    logger.setLevel(level)
+    logger.propagate = False
+    logger.addHandler(QueueHandler(log_queue))
+
+    listener = BatchQueueListener(log_queue, file_handler, batch_size)
+    listener.start()
+    return logger, listener
+
+
+def cmd_compress(args):
+    os.makedirs(args.dir, exist_ok=True)
+    handler = CompressingRotatingFileHandler(os.path.join(args.dir, 'my_log.log'), maxBytes=args.max_bytes,
+                                             when=args.when, interval=args.interval, backupCount=args.backup_count)
+    handler.setFormatter(logging.Formatter(LOG_FORMAT, datefmt=DATE_FORMAT))
+    logger = logging.getLogger('compressing_logger')
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+    logger.addHandler(handler)
+
+    start = time.perf_counter()
+    for i in range(args.records):
+        logger.debug('This is number %d message.', i)
+    elapsed = time.perf_counter() - start
+    logger.removeHandler(handler)
+    handler.close()
+    print(f"{args.records} records in {elapsed:.2f}s ({args.records / elapsed:,.0f} rec/s), "
+          f"compression finished after {time.perf_counter() - start:.2f}s")
+    for name in sorted(os.listdir(args.dir)):
+        print(f"{name:<40}{os.path.getsize(os.path.join(args.dir, name)):>12}")
+
+
+# 与 clear-old-logs.py、log-parser-benchmark.py 中的 parse_size 相同，脚本保持单文件可独立运行，
+# 由 tests/test_shared_copies.py 检查几份一致
+def parse_size(value):
+    """解析 '200G'、'512M'、'1048576' 这样的大小参数（按 1024 进制）"""
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+    value = value.strip().upper().rstrip('IB')
+    if value and value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
+
+
+def run_stock(directory, records, max_bytes, backup_count):
+    logger = logging.getLogger('bench_stock')
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+    handler = RotatingFileHandler(os.path.join(directory, 'stock.log'), maxBytes=max_bytes,
+                                  backupCount=backup_count, encoding='utf-8')
+    handler.setFormatter(logging.Formatter(LOG_FORMAT, datefmt=DATE_FORMAT))
+    logger.addHandler(handler)
+
+    start = time.perf_counter()
+    for i in range(records):
+        logger.debug('This is number %d message.', i)
+    elapsed = time.perf_counter() - start
+    logger.removeHandler(handler)
+    handler.close()
+    return elapsed, elapsed
+
+
+def run_batch(directory, records, max_bytes, backup_count, batch_size):
+    logger, listener = setup_batch_logging('bench_batch', os.path.join(directory, 'batch.log'),
+                                           max_bytes, backup_count, batch_size)
+    start = time.perf_counter()
+    for i in range(records):
+        logger.debug('This is number %d message.', i)
+    caller = time.perf_counter() - start
+    listener.stop()
+    total = time.perf_counter() - start
+    listener.handler.close()
+    return caller, total
+
+
+def count_lines(directory, prefix):
+    lines = files = 0
+    for name in os.listdir(directory):
+        if name.startswith(prefix):
+            files += 1
+            with open(os.path.join(directory, name), 'rb') as f:
+                lines += sum(1 for _ in f)
+    return files, lines
+
+
+def cmd_bench(args):
+    directory = tempfile.mkdtemp(prefix='log-rotate-bench-', dir=args.dir)
+    try:
+        results = [('RotatingFileHandler', *run_stock(directory, args.records, args.max_bytes, args.backup_count)),
+                   ('BatchRotatingFileHandler', *run_batch(directory, args.records, args.max_bytes,
+                                                           args.backup_count, args.batch_size))]
+        print(f"{args.records} records, maxBytes={args.max_bytes}, backupCount={args.backup_count}")
+        print(f"{'handler':<26}{'caller rec/s':>14}{'drained rec/s':>15}")
+        for name, caller, total in results:
+            print(f"{name:<26}{args.records / caller:>14,.0f}{args.records / total:>15,.0f}")
+        for prefix in ('stock.log', 'batch.log'):
+            files, lines = count_lines(directory, prefix)
+            print(f"{prefix}: {files} files, {lines} lines kept")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def demo():
+    os.chdir(log_dir)
+
+    # 创建一个日志记录器
+    logger = logging.getLogger('rotating_logger')
+    logger.setLevel(logging.DEBUG)
+
+    # 创建日志轮替处理器
+    # maxBytes=2000: 当文件大小达到2000字节，触发日志轮替
+    # backupCount = 5 最多保留五个旧的日志文件（my_log.log1 ... my_log.log5）
+    # encoding = 'utf-8' 文件使用UTF-8编码，避免中文乱码
+    rotating_handler = RotatingFileHandler('my_log.log', maxBytes=2000,backupCount=5,encoding='utf-8')
+
+    # 创建格式化器
+    formatter = logging.Formatter(LOG_FORMAT, datefmt=DATE_FORMAT)
+    # 对处理器应用这个格式
+    rotating_handler.setFormatter(formatter)
+
+    # 将处理器添加到记录器上
+    logger.addHandler(rotating_handler)
+
+    # 记录日志，观察日志轮替的生成文件的结果
+    for i in range(1000):
+        logger.debug(f'This is number {i} message.')
+
 
-os.chdir('/path/to/logs/')
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description='Log rotation demo and batched rotating handler')
+    sub = parser.add_subparsers(dest='command')
 
-# 创建一个日志记录器
-logger = logging.getLogger('rotating_logger')
-logger.setLevel(logging.DEBUG)
+    p = sub.add_parser('bench', help='compare records/sec of RotatingFileHandler and the batched handler')
+    p.add_argument('--records', type=int, default=200000)
+    p.add_argument('--max-bytes', type=int, default=10 * 1024 * 1024)
+    p.add_argument('--backup-count', type=int, default=5)
+    p.add_argument('--batch-size', type=int, default=1024)
+    p.add_argument('--dir', default=None, help='directory for the benchmark files (default: system temp dir)')
+    p.set_defaults(func=cmd_bench)
 
-# 创建日志轮替处理器
-# maxBytes=2000: 当文件大小达到2000字节，触发日志轮替
-# backupCount = 5 最多保留五个旧的日志文件（my_log.log1 ... my_log.log5）
-# encoding = 'utf-8' 文件使用UTF-8编码，避免中文乱码
-rotating_handler = RotatingFileHandler('my_log.log', maxBytes=2000,backupCount=5,encoding='utf-8')
+    p = sub.add_parser('compress', help='write records through the size/time rotating handler with gzip segments')
+    p.add_argument('--dir', required=True, help='directory for my_log.log and its segments')
+    p.add_argument('--records', type=int, default=200000)
+    p.add_argument('--max-bytes', type=parse_size, default=parse_size('1M'))
+    p.add_argument('--when', default=None, choices=['S', 'M', 'H', 'D', 'midnight'], help='also rotate by time')
+    p.add_argument('--interval', type=int, default=1)
+    p.add_argument('--backup-count', type=int, default=5, help='segments to keep, compressed or not (0: keep all)')
+    p.set_defaults(func=cmd_compress)
 
-# 创建格式化器
-formatter = logging.Formatter('%(asctime)s-%(name)s-%(levelname)s: %(message)s', datefmt='%Y%m%d_%H:%M:%S')
-# 对处理器应用这个格式
-rotating_handler.setFormatter(formatter)
+    return parser
 
-# 将处理器添加到记录器上
-logger.addHandler(rotating_handler)
 
-# 记录日志，观察日志轮替的生成文件的结果
-for i in range(1000):
-    logger.debug(f'This is number {i} message.')
\ No newline at end of file
+if __name__ == '__main__':
+    args = build_arg_parser().parse_args()
+    # 不带子命令时保持原来的演示行为
+    if args.command is None:
+        demo()
+    else:
+        args.func(args)
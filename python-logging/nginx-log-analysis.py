@@ -13,6 +13,7 @@ Nginx 和系统日志分析脚本
     - 采用工厂模式设计提供统一的解析器接口
     - 字符串分割和切片技术精确定位字段
     - 闭包函数实现解析器的封装和返回
+    - mmap 内存映射按行流式读取大文件，分块(chunk)惰性产出解析结果
 
 数据结构:
     Nginx 日志解析结果:
@@ -46,6 +47,171 @@ Nginx 和系统日志分析脚本
         - 提取日期时间、主机名、服务名称、消息内容
         - 处理服务 PID 信息的提取和清理
 
+流式解析:
+    parse_log_file / iter_parsed_chunks 面向几十 GB 的日志文件：
+        - 通过 mmap 映射文件，由操作系统按需换页，不把整个文件读进内存
+        - 已处理过的区域定期 madvise(MADV_DONTNEED)，常驻内存保持有界
+        - 每 chunk_size 行产出一个列表，调用方边读边处理
+        - ParseStats 记录行数、字节数、错误行数，并给出 lines/s、MB/s
+
+    命令行用法:
+        python3 nginx-log-analysis.py stream /var/log/nginx/access.log --progress 5
+
+多核并行解析:
+    parse_log_parallel 把单个大文件按字节切分成若干分片（边界对齐到换行符），
+    交给进程池并行解析；每个分片只返回聚合结果（状态码计数、总字节数、IP 计数），
+    最后在主进程合并，进程间不传递逐行数据，吞吐量随核数近似线性增长。
+
+        python3 nginx-log-analysis.py parallel /var/log/nginx/access.log --workers 8 --top 20
+
+列式结果格式:
+    逐行字典每行约 1KB 的 Python 对象，而且 status/size 都是字符串。ColumnarLog 把
+    解析结果存成紧凑的列：
+        - status: array('H')，size / time: array('q')（time 为 Unix 时间戳）
+        - IP / path / user_agent: StringDictionary 字典编码，相同字符串只存一份，
+          每行只占一个 4 字节的整数编码
+    列上的统计（状态码直方图、字节求和、时间分桶、条件筛选）直接在整数数组上完成，
+    安装了 numpy 时还可以用 to_numpy() 转成 ndarray 做向量化计算。
+
+        python3 nginx-log-analysis.py columnar /var/log/nginx/access.log
+
+增量(follow)模式:
+    LogFollower 每次只解析上次之后新写入的字节，并把检查点保存成 JSON：
+        {"path": ..., "inode": ..., "offset": ..., "last_line_hash": ...}
+    - 同一个 inode 且文件没有变小、offset 前最后一行的哈希一致: 从 offset 继续
+    - inode 变化(logrotate 重命名): 先在 access.log* 中按 inode 找到旧文件读完剩余部分，
+      再从新文件开头读
+    - 文件变小或哈希不一致(copytruncate / 被覆盖): 从头开始读
+    - 只处理以换行结尾的完整行，写了一半的行留到下一次
+    适合 1 分钟一次的 cron（--once）或常驻进程（持续轮询）：
+
+        python3 nginx-log-analysis.py follow /var/log/nginx/access.log --checkpoint /var/tmp/access.ckpt --once
+
+近似聚合(sketch):
+    精确统计一周日志的独立 IP 和热门路径需要巨大的字典，SketchAggregate 用固定内存的
+    可合并数据结构代替：
+        - HyperLogLog: 估算独立 IP 数（p=14 时约 16KB，误差约 0.8%）
+        - CountMinSketch + 最小堆(TopK): 热门 IP / URL 的 Top-K
+        - MinuteCounters: 环形数组保存最近 N 分钟的请求数和 5xx 数
+    所有结构都支持 merge()，parallel 模式下各分片的结果可以直接合并：
+
+        python3 nginx-log-analysis.py sketch /var/log/nginx/access.log --workers 8 --top 20
+
+轮替和压缩日志:
+    stream / parallel / sketch 的 path 参数可以是单个文件、glob 通配符或目录：
+        - .gz / .bz2 / .xz 文件边读边解压，不需要先解压到磁盘
+        - 多个文件按修改时间从旧到新排序（同一时间按轮替序号，access.log.30.gz 在前）
+        - parallel / sketch 模式下多个文件并行处理，未压缩的大文件仍按字节区间切分
+
+        python3 nginx-log-analysis.py sketch '/var/log/nginx/access.log*' --workers 8
+
+按 log_format 生成解析器:
+    nginx_praser 按空格位置切分，用户代理里带空格（几乎都带）时后面的字段就错位了，
+    也不支持 $request_time 等自定义变量。make_format_praser 读取 nginx.conf 中的
+    log_format 定义，一次性编译出专用的正则表达式：
+        - 方括号 / 双引号中的变量匹配到对应的闭合符号为止，其余变量匹配到下一个分隔符
+        - 常见变量沿用 nginx_praser 的字段名（remote_addr -> IP, time_local -> date ...），
+          其它变量保留原名（request_time、upstream_response_time ...）
+    所有子命令都可以通过 --log-format 使用自定义格式，bench 子命令对比两种解析器的速度：
+
+        python3 nginx-log-analysis.py stream access.log --log-format '$remote_addr - $remote_user [$time_local] "$request" $status $body_bytes_sent "$http_referer" "$http_user_agent" $request_time'
+        python3 nginx-log-analysis.py bench access.log
+
+高性能 syslog 解析器:
+    make_syslog_praser（service_name='syslog'）每行只做一次预编译正则匹配，同时支持：
+        - RFC 3164: 'Aug 30 18:08:01 myhost sshd[1234]: message'（可带 <PRI> 前缀）
+        - RFC 5424: '<34>1 2030-08-30T18:08:01.003Z myhost sshd 1234 ID47 [sd] message'
+    RFC 3164 时间戳没有年份：月份晚于参考时间（默认文件修改时间）所在月份时判定为上一年，
+    解析结果中的 timestamp 为 Unix 时间戳；RFC 5424 的时间戳为 NILVALUE（-）时为 None。
+    格式不对的行抛出 ValueError。
+
+        python3 nginx-log-analysis.py stream /var/log/messages --service syslog
+        python3 nginx-log-analysis.py bench /var/log/messages --service syslog
+
+时间戳解码:
+    按分钟、时间窗口统计时，每条记录都要把时间字符串转换成 Unix 时间戳，strptime 每次都要
+    重新做格式匹配，是这类分析中最慢的部分。make_nginx_time_decoder / make_rfc5424_time_decoder /
+    make_rfc3164_time_decoder 生成专用的解码函数：
+        - 按固定位置切片取出日、月、年、时、分、秒，月份查 MONTHS 表
+        - 记住上一个时间戳（同一秒的行直接返回）和上一分钟的起点（同一分钟只加秒数），
+          日期和时区换算的结果也分别缓存；RFC 3164 的本地时间每小时只调用一次 time.mktime
+        - 不符合固定格式的时间戳交给 strptime / fromisoformat，结果和错误都与原来一致
+    nginx_time_to_epoch 和 syslog 解析器都使用这些解码函数。bench --timestamps 在真实日志的
+    时间戳序列上对比 strptime 和解码函数的速度，并核对两者的结果：
+
+        python3 nginx-log-analysis.py bench /var/log/nginx/access.log --timestamps
+        python3 nginx-log-analysis.py bench /var/log/messages --service syslog --timestamps
+
+时间索引:
+    build_time_index 扫描一遍日志，生成旁路索引文件 <path>.tidx，记录每个时间桶
+    （默认 60 秒）第一行所在的字节偏移。文件头保存 inode 和已索引的大小，日志继续追加后
+    只需要索引新增部分。query_time_range 用二分查找定位起始偏移，只读取时间窗口附近的字节：
+
+        python3 nginx-log-analysis.py index /var/log/nginx/access.log
+        python3 nginx-log-analysis.py window /var/log/nginx/access.log --start '2030-08-30 14:02' --end '2030-08-30 14:07'
+
+多报表单遍聚合:
+    ReportEngine 预先注册多个报表（聚合器），只读一遍日志、对每条解析结果依次更新所有报表，
+    最后输出合并后的 JSON 或文本报告，每晚的报表不再需要每个问题各读一遍日志：
+        - status: 状态码分布
+        - bandwidth: 按路由模板统计响应字节数（Top N）
+        - referers: 热门来源页面
+        - user_agents / ips: 热门客户端
+        - error_rate: 每分钟请求数、5xx 数和错误率
+        - latency: 按路由和按分钟的请求耗时 / 上游耗时分位数（需要 $request_time）
+        - endpoints: 按“方法 + 路由模板”统计请求数、字节数和错误比例
+    报表通过 REPORTS 注册，自定义报表只需实现 update / merge / result / text 四个方法；
+    --workers 大于 1 时按字节区间分片并行，各分片的报表在主进程合并。
+    解析默认使用按 combined 格式编译的解析器（main 格式的行同样能匹配），带空格的用户代理不会被截断。
+
+        python3 nginx-log-analysis.py report /var/log/nginx/access.log --format json --output report.json
+        python3 nginx-log-analysis.py report '/var/log/nginx/access.log*' --reports status,error_rate --workers 8
+
+谓词下推查询:
+    大部分临时查询只关心一小部分行（status >= 500、某个路径前缀……），先完整解析再过滤
+    要为每一行切分字符串、构造字典。query 子命令先在原始字节上检查过滤条件，
+    只有命中的行才会被解析或输出，不命中的行几乎没有额外开销：
+        - ip^=10.1.      行首字节前缀比较
+        - path^=/api/    定位 '] "' 之后的方法和空格，直接比较路径前缀
+        - status>=500    定位请求字段结束的 '" '，取后面 3 个字节比较（也支持 status=5xx）
+        - time>=... / time<...   复用时间索引的逐秒缓存时间转换；已有 .tidx 索引时直接跳到起始偏移
+    多个条件用 and 连接，便宜的字节比较排在时间转换之前。--no-pushdown 按“先解析再过滤”执行，
+    用来核对结果和对比速度。
+
+        python3 nginx-log-analysis.py query /var/log/nginx/access.log 'status>=500 and path^=/api/'
+        python3 nginx-log-analysis.py query access.log 'ip^=10.0. and time>=2030-08-30T14:00 and time<2030-08-30T15:00' --count
+
+延迟分位数:
+    LatencyHistogram 是 HDR 风格的对数-线性直方图：以微秒为单位，每个 2 的幂区间再均分成 64 个桶，
+    任何值的相对误差不超过 1/128（约 0.8%），1 小时以内的延迟最多用到约 1700 个桶。
+    计数以稀疏字典保存，内存只和用到的桶数有关，与请求数无关；两个直方图的合并就是桶计数相加，
+    可以在分片、进程和主机之间合并后再求 p50/p95/p99/p99.9，不需要保留每个延迟值。
+    latency 报表按路由（归一化后的路径模板，最多 1000 个，之后出现的新路由归入 <other>）和按分钟
+    分别统计 $request_time 与 $upstream_response_time（多个上游的时间相加）：
+
+        python3 nginx-log-analysis.py latency /var/log/nginx/access.log --workers 8 --save web01.json
+        python3 nginx-log-analysis.py latency --merge web01.json web02.json --top 20
+
+    默认的日志格式是 main 格式后面加上 '$request_time $upstream_response_time'，其它格式用 --log-format 指定。
+
+路由归一化:
+    按原始路径聚合时 /api/users/123、/api/users/124 …… 各是一个键，键的数量随用户数增长。
+    RouteNormalizer 把路径逐段放进一棵路径段前缀树，归一化为 /api/users/:id 这样的模板：
+        1. 树中已有的字面量子节点（--route-template 声明的或之前见过的）直接沿用
+        2. 模板中声明的变量段（/api/orders/:order 或 *）匹配任意一段
+        3. 段规则：纯数字 -> :id，UUID -> :uuid，16 位以上十六进制 -> :hash，
+           --route-rule name=REGEX 可以追加规则（整段匹配，替换为 :name）
+        4. 其它段作为字面量加入树中；同一节点下学到的字面量超过 --route-fanout 个时节点折叠，
+           已经见过的和之后出现的段都归为 *（例如 /blog/<文章标题>），保证模板数量有上限
+    归一化结果放在 LRU 缓存中（--route-cache），重复的路径只做一次字典查找。
+    节点折叠前得到的模板在报表输出前按最终的前缀树重写（canonical），分片的前缀树在合并报表时
+    一起合并，所以同一份日志不论行的顺序和 --workers / --shards 如何，得到的模板都相同。
+    bandwidth、latency 和 endpoints 报表都按模板聚合，endpoints 按“方法 + 模板”统计
+    请求数、字节数、4xx/5xx 比例，日志中有 $request_time 时同时给出 p50/p99：
+
+        python3 nginx-log-analysis.py report access.log --reports endpoints --route-template /api/orders/:order
+        python3 nginx-log-analysis.py report access.log --reports endpoints --route-rule sku='[A-Z]{3}-\\d+'
+
 正则表达式说明:
     - r'(\\S+)': 匹配非空白字符，用于提取主机名
     - r'(\\S+)(?:\\[\\d+\\])': 匹配服务名并可选匹配PID部分
@@ -53,9 +219,17 @@ Nginx 和系统日志分析脚本
 
 """
 
-import re
+import re, os, sys, bz2, glob, gzip, json, lzma, math, mmap, time, heapq, bisect, struct, hashlib, argparse, operator
+from functools import lru_cache
+from array import array
+from collections import Counter
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
 
-def make_log_praser(service_name):
+def make_log_praser(service_name, log_format=None):
+    # 指定了 log_format 时使用按格式编译的解析器
+    if log_format is not None:
+        return make_format_praser(log_format)
 
     def nginx_praser(line):
     # IP、日期、请求方法、状态码、返回值大小、用户代理
@@ -99,16 +273,16 @@ def make_log_praser(service_name):
         # 获取 sshd 部分，去掉[1234]
         service_message_split = rest.split(':', 1) # 剩余部分用冒号分割一次，分割成两部分 ['sshd[1234]', 'Accepted......']
         if len(service_message_split) < 2:
-            return ValueError('Log line is malformed')
-        service_message = service_message_split[0].strip()
+            raise ValueError('Log line is malformed')
+        service_part = service_message_split[0].strip()
         # 去掉[1234]
-        service_message = re.match(r'(\S+)(?:\[\d+\])', service_message)
+        service_message = re.match(r'(\S+)(?:\[\d+\])', service_part)
         if service_message:
             # 匹配到就取出第1个捕获组的值
             service = service_message.group(1)
         else:
-            # 没匹配到说明没有[1234]部分，service就是它本身？（有没有可能是没有前面的部分？）
-            service = service_message
+            # 没匹配到说明没有[1234]部分，service就是它本身
+            service = service_part
 
         # 获取 Accepted password ... 部分
         message = service_message_split[1].strip()
@@ -126,10 +300,2634 @@ def make_log_praser(service_name):
         return nginx_praser
     elif service_name == 'messages':
         return messages_praser
+    elif service_name == 'syslog':
+        return make_syslog_praser()
     else:
         raise ValueError('Unknown service name')
 
-if __name__=='__main__':
+
+# nginx 默认的 combined / main 日志格式
+NGINX_COMBINED_FORMAT = ('$remote_addr - $remote_user [$time_local] "$request" '
+                         '$status $body_bytes_sent "$http_referer" "$http_user_agent"')
+NGINX_MAIN_FORMAT = NGINX_COMBINED_FORMAT + ' "$http_x_forwarded_for"'
+# 带请求耗时和上游耗时的 main 格式，latency 子命令默认使用
+NGINX_TIMED_FORMAT = NGINX_MAIN_FORMAT + ' $request_time $upstream_response_time'
+
+# 与 nginx_praser 保持一致的字段名
+NGINX_FIELD_ALIASES = {
+    'remote_addr': 'IP',
+    'time_local': 'date',
+    'request': 'request',
+    'status': 'status',
+    'body_bytes_sent': 'size',
+    'http_referer': 'referer',
+    'http_user_agent': 'user_agent',
+}
+
+MONTHS = {name: i for i, name in enumerate(
+    ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'), 1)}
+
+EPOCH_ORDINAL = datetime(1970, 1, 1).toordinal()
+
+
+def epoch_day(year, month, day):
+    """公历日期 -> 当天 UTC 零点的 Unix 时间戳；日期不存在时抛出 ValueError"""
+    return (datetime(year, month, day).toordinal() - EPOCH_ORDINAL) * 86400
+
+
+def parse_zone_offset(zone):
+    """'+0800' / '+08:00' / 'Z' -> 相对 UTC 的秒数，格式不对时返回 None"""
+    if zone == 'Z':
+        return 0
+    digits = zone[1:].replace(':', '', 1) if len(zone) == 6 else zone[1:]
+    if zone[:1] not in ('+', '-') or len(digits) != 4 or not digits.isdigit():
+        return None
+    hours, minutes = int(digits[:2]), int(digits[2:])
+    if hours > 23 or minutes > 59:
+        return None
+    offset = hours * 3600 + minutes * 60
+    return -offset if zone[0] == '-' else offset
+
+
+def nginx_time_to_epoch_strptime(date):
+    """strptime 实现，作为快速解码的后备和基准测试的对照"""
+    return int(datetime.strptime(date, '%d/%b/%Y:%H:%M:%S %z').timestamp())
+
+
+def rfc5424_time_to_epoch_isoformat(stamp):
+    return int(datetime.fromisoformat(stamp).timestamp())
+
+
+def make_nginx_time_decoder():
+    """生成 '30/Aug/2030:11:27:18 +0800' -> Unix 时间戳（整数秒）的解码函数"""
+    last = [None, None]
+    # 上一分钟: ['dd/Mon/yyyy:HH:MM', 时区, 该分钟起点]
+    minute = [None, None, None]
+    days = {}
+    zones = {}
+
+    def minute_start(key, zone):
+        if key[2] != '/' or key[6] != '/' or key[11] != ':' or key[14] != ':':
+            return None
+        day = days.get(key[:11])
+        if day is None:
+            month = MONTHS.get(key[3:6])
+            if month is None or not key[:2].isdigit() or not key[7:11].isdigit():
+                return None
+            try:
+                day = epoch_day(int(key[7:11]), month, int(key[:2]))
+            except ValueError:
+                return None
+            if len(days) > 4096:
+                days.clear()
+            days[key[:11]] = day
+        offset = zones.get(zone)
+        if offset is None:
+            offset = parse_zone_offset(zone)
+            if offset is None:
+                return None
+            zones[zone] = offset
+        if not key[12:14].isdigit() or not key[15:17].isdigit():
+            return None
+        hours, minutes = int(key[12:14]), int(key[15:17])
+        if hours > 23 or minutes > 59:
+            return None
+        return day + hours * 3600 + minutes * 60 - offset
+
+    def nginx_time_to_epoch(date):
+        if date == last[0]:
+            return last[1]
+        if len(date) != 26 or date[17] != ':' or date[20] != ' ' or not date[18:20].isdigit():
+            return nginx_time_to_epoch_strptime(date)
+        seconds = int(date[18:20])
+        key = date[:17]
+        zone = date[21:]
+        if key != minute[0] or zone != minute[1]:
+            base = minute_start(key, zone)
+            if base is None:
+                return nginx_time_to_epoch_strptime(date)
+            minute[0], minute[1], minute[2] = key, zone, base
+        if seconds > 59:
+            return nginx_time_to_epoch_strptime(date)
+        epoch = minute[2] + seconds
+        last[0], last[1] = date, epoch
+        return epoch
+
+    return nginx_time_to_epoch
+
+
+def make_rfc5424_time_decoder():
+    """生成 '2030-08-30T11:27:18.123+08:00' / '...Z' -> Unix 时间戳（整数秒）的解码函数"""
+    minute = [None, None, None]
+    zones = {}
+
+    def minute_start(body):
+        parts = (body[0:4], body[5:7], body[8:10], body[11:13], body[14:16])
+        if not all(part.isdigit() for part in parts):
+            return None
+        year, month, day, hours, minutes = map(int, parts)
+        if hours > 23 or minutes > 59:
+            return None
+        try:
+            return epoch_day(year, month, day) + hours * 3600 + minutes * 60
+        except ValueError:
+            return None
+
+    def rfc5424_time_to_epoch(stamp):
+        if stamp[-1:] == 'Z':
+            zone, body = 'Z', stamp[:-1]
+        else:
+            zone, body = stamp[-6:], stamp[:-6]
+        offset = zones.get(zone)
+        if offset is None:
+            offset = parse_zone_offset(zone)
+        fraction = body[19:]
+        if (offset is None or len(body) < 19 or body[4] != '-' or body[7] != '-' or body[10] != 'T'
+                or body[13] != ':' or body[16] != ':' or not body[17:19].isdigit()
+                or (fraction and (fraction[0] != '.' or not fraction[1:].isdigit()))):
+            # 没有时区、NILVALUE 等不常见的写法
+            return rfc5424_time_to_epoch_isoformat(stamp)
+        zones[zone] = offset
+        key = body[:16]
+        if key != minute[0] or zone != minute[1]:
+            base = minute_start(body)
+            if base is None:
+                return rfc5424_time_to_epoch_isoformat(stamp)
+            minute[0], minute[1], minute[2] = key, zone, base - offset
+        seconds = int(body[17:19])
+        if seconds > 59:
+            return rfc5424_time_to_epoch_isoformat(stamp)
+        return minute[2] + seconds
+
+    return rfc5424_time_to_epoch
+
+
+def make_rfc3164_time_decoder(year_of):
+    """生成 'Aug 30 18:08:01' / 'Aug  3 18:08'（本地时间）-> Unix 时间戳 的解码函数
+
+    时间戳里没有年份，由 year_of(月份) 给出。每个本地小时只调用一次 time.mktime（夏令时由它处理），
+    同一小时内直接加上分和秒。
+    """
+    last = [None, None]
+    hours = {}
+
+    def rfc3164_time_to_epoch(stamp):
+        if stamp == last[0]:
+            return last[1]
+        month = MONTHS.get(stamp[:3])
+        if month is None:
+            raise ValueError(f"Unknown month: {stamp[:3]}")
+        day, _, clock = stamp[4:].lstrip(' ').partition(' ')
+        clock = clock.split(':')
+        hour_key = (month, day, clock[0])
+        base = hours.get(hour_key)
+        if base is None:
+            year, hour = year_of(month), int(clock[0])
+            # 和 strptime 一样拒绝不存在的日期和超出范围的小时，mktime 会把它们换算到别的时间
+            datetime(year, month, int(day))
+            if hour > 23:
+                raise ValueError(f"Hour out of range: {stamp}")
+            base = int(time.mktime((year, month, int(day), hour, 0, 0, 0, 0, -1)))
+            if len(hours) > 4096:
+                hours.clear()
+            hours[hour_key] = base
+        minutes = int(clock[1])
+        seconds = int(clock[2]) if len(clock) > 2 else 0
+        # strptime 的 %S 允许 60、61（闰秒）
+        if minutes > 59 or seconds > 61:
+            raise ValueError(f"Minute or second out of range: {stamp}")
+        epoch = base + minutes * 60 + seconds
+        last[0], last[1] = stamp, epoch
+        return epoch
+
+    return rfc3164_time_to_epoch
+
+
+# 模块级的 nginx 时间戳解码函数，各处共用一份缓存
+nginx_time_to_epoch = make_nginx_time_decoder()
+
+# RFC 3164: [<PRI>]Mmm dd hh:mm[:ss] hostname tag[pid]: message
+RFC3164_PATTERN = re.compile(
+    r'(?:<(?P<pri>\d{1,3})>)?(?P<month>[A-Z][a-z]{2}) {1,2}(?P<day>\d{1,2}) '
+    r'(?P<time>\d{2}:\d{2}(?::\d{2})?) (?P<hostname>\S+) '
+    r'(?P<service>[^\s:\[]+)(?:\[(?P<pid>[^\]]*)\])?: ?(?P<message>.*)', re.S)
+
+# RFC 5424: <PRI>1 TIMESTAMP HOSTNAME APP-NAME PROCID MSGID STRUCTURED-DATA [MSG]
+RFC5424_PATTERN = re.compile(
+    r'<(?P<pri>\d{1,3})>1 (?P<timestamp>\S+) (?P<hostname>\S+) (?P<service>\S+) '
+    r'(?P<pid>\S+) (?P<msgid>\S+) (?P<structured_data>-|(?:\[(?:[^\]\\]|\\.)*\])+)(?: (?P<message>.*))?', re.S)
+
+
+def make_syslog_praser(year=None, reference_time=None):
+    """生成 RFC 3164 / RFC 5424 syslog 解析函数
+
+    year 指定 RFC 3164 时间戳的年份；不指定时按 reference_time（默认当前时间）推断：
+    月份晚于参考月份的日志属于上一年（例如 1 月份读取去年 12 月的日志）。
+    """
+    reference = datetime.fromtimestamp(reference_time if reference_time is not None else time.time())
+    match_3164 = RFC3164_PATTERN.match
+    match_5424 = RFC5424_PATTERN.match
+
+    def year_of(month):
+        if year is not None:
+            return year
+        return reference.year - 1 if month > reference.month else reference.year
+
+    decode_3164 = make_rfc3164_time_decoder(year_of)
+    decode_5424 = make_rfc5424_time_decoder()
+
+    def syslog_praser(line):
+        m = match_5424(line) if line.startswith('<') else None
+        if m is not None:
+            record = m.groupdict()
+            stamp = record['timestamp']
+            try:
+                # NILVALUE：发送方不知道时间，记录照常解析，时间为 None
+                record['timestamp'] = None if stamp == '-' else decode_5424(stamp)
+            except ValueError:
+                raise ValueError(f'Invalid RFC 5424 timestamp: {stamp}')
+            record['message'] = record['message'] or ''
+            return record
+
+        m = match_3164(line)
+        if m is None:
+            raise ValueError('Log line is malformed')
+        record = m.groupdict()
+        # 同一秒内的日志共用一次时间转换
+        record['timestamp'] = decode_3164(line[m.start('month'):m.end('time')])
+        record['date'] = record.pop('month') + ' ' + record.pop('day')
+        return record
+
+    return syslog_praser
+
+
+LOG_FORMAT_VARIABLE = re.compile(r'\$(?:\{(\w+)\}|(\w+))')
+
+
+def compile_log_format(log_format):
+    """把 nginx log_format 字符串编译成带命名分组的正则表达式"""
+    pieces = []
+    literals = LOG_FORMAT_VARIABLE.split(log_format)
+    # split 的结果为: 文本, 变量(花括号), 变量, 文本, ...
+    tokens = [literals[0]]
+    for i in range(1, len(literals), 3):
+        tokens.append(('var', literals[i] or literals[i + 1]))
+        tokens.append(literals[i + 2])
+
+    seen = set()
+    for i, token in enumerate(tokens):
+        if isinstance(token, str):
+            pieces.append(re.escape(token))
+            continue
+        name = NGINX_FIELD_ALIASES.get(token[1], token[1])
+        before, after = tokens[i - 1], tokens[i + 1]
+        if before.endswith('[') and after.startswith(']'):
+            value = r'[^\]]*'
+        elif before.endswith('"') and after.startswith('"'):
+            value = r'[^"]*'
+        elif token[1].startswith('upstream_'):
+            # 多个上游时值形如 '0.010, 0.002' 或 '0.010 : 0.002'
+            value = r'[^ ,]*(?:(?:, | : )[^ ,]*)*'
+        elif after:
+            value = '[^' + re.escape(after[0]) + ']*'
+        else:
+            value = r'\S*'
+        if name in seen:
+            pieces.append('(?:' + value + ')')
+        else:
+            seen.add(name)
+            pieces.append('(?P<' + name + '>' + value + ')')
+    return re.compile(''.join(pieces))
+
+
+def make_format_praser(log_format=NGINX_MAIN_FORMAT):
+    """根据 nginx log_format 生成预编译的解析函数，不匹配的行抛出 ValueError"""
+    match = compile_log_format(log_format).match
+
+    def format_praser(line):
+        m = match(line)
+        if m is None:
+            raise ValueError('Log line does not match log_format')
+        return m.groupdict()
+
+    return format_praser
+
+# 流式读取时每处理这么多字节，就释放一次已读过的映射页
+MMAP_RELEASE_BYTES = 64 * 1024 * 1024
+
+
+class ParseStats:
+    """解析过程的统计信息，用于输出吞吐量"""
+
+    def __init__(self):
+        self.lines = 0
+        self.bytes = 0
+        self.errors = 0
+        self.start = time.perf_counter()
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    @property
+    def lines_per_sec(self):
+        elapsed = self.elapsed
+        return self.lines / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def mb_per_sec(self):
+        elapsed = self.elapsed
+        return self.bytes / (2 ** 20) / elapsed if elapsed > 0 else 0.0
+
+    def __str__(self):
+        return (f"lines={self.lines} errors={self.errors} bytes={self.bytes} "
+                f"elapsed={self.elapsed:.2f}s {self.lines_per_sec:.0f} lines/s {self.mb_per_sec:.1f} MB/s")
+
+
+def iter_mmap_lines(path, start=0, end=None, with_offsets=False):
+    """通过 mmap 逐行产出 [start, end) 字节范围内的行（bytes，不含换行符）
+
+    with_offsets=True 时产出 (line, next_offset)，next_offset 是下一行的起始位置。
+    """
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if hasattr(mm, 'madvise'):
+                mm.madvise(mmap.MADV_SEQUENTIAL)
+            end = size if end is None else min(end, size)
+            pos = start
+            released = start - start % mmap.PAGESIZE
+            find = mm.find
+            while pos < end:
+                nl = find(b'\n', pos, end)
+                if nl == -1:
+                    nl = end
+                line = mm[pos:nl]
+                pos = nl + 1
+                if line.endswith(b'\r'):
+                    line = line[:-1]
+                yield (line, pos) if with_offsets else line
+
+                # 已经读过的页不会再用到，主动归还给操作系统，保证常驻内存有界
+                if hasattr(mm, 'madvise') and pos - released >= MMAP_RELEASE_BYTES:
+                    upto = pos - pos % mmap.PAGESIZE
+                    mm.madvise(mmap.MADV_DONTNEED, released, upto - released)
+                    released = upto
+
+
+# COMPRESSED_OPENERS、ROTATION_SUFFIX 和 expand_log_paths 与 prase-IP-from-logs.py 中的相同：
+# 每个脚本都要能单独复制到服务器上运行，所以不抽成共享模块，由 tests/test_shared_copies.py 检查两份一致
+COMPRESSED_OPENERS = {
+    '.gz': gzip.open,
+    '.bz2': bz2.open,
+    '.xz': lzma.open,
+}
+
+# 匹配 access.log.30 / access.log.30.gz 中的轮替序号
+ROTATION_SUFFIX = re.compile(r'\.(\d+)(?:\.(?:gz|bz2|xz))?$')
+
+
+def is_compressed(path):
+    return os.path.splitext(path)[1] in COMPRESSED_OPENERS
+
+
+def open_log(path):
+    """以二进制方式打开日志文件，压缩文件按扩展名透明解压"""
+    opener = COMPRESSED_OPENERS.get(os.path.splitext(path)[1])
+    return opener(path, 'rb') if opener else open(path, 'rb')
+
+
+def expand_log_paths(spec):
+    """把文件、glob 通配符或目录展开成日志文件列表，按时间从旧到新排序"""
+    if os.path.isdir(spec):
+        paths = [entry.path for entry in os.scandir(spec) if entry.is_file()]
+    else:
+        paths = [p for p in glob.glob(spec) if os.path.isfile(p)]
+
+    def sort_key(path):
+        match = ROTATION_SUFFIX.search(path)
+        # 修改时间相同时，轮替序号越大越旧
+        return os.path.getmtime(path), -int(match.group(1)) if match else 0
+
+    return sorted(paths, key=sort_key)
+
+
+def iter_compressed_lines(path):
+    """边解压边逐行产出压缩日志中的行"""
+    with open_log(path) as f:
+        for line in f:
+            if line.endswith(b'\n'):
+                line = line[:-1]
+            if line.endswith(b'\r'):
+                line = line[:-1]
+            yield line
+
+
+def iter_log_lines(path, start=0, end=None):
+    """逐行读取日志：普通文件走 mmap，压缩文件流式解压（不支持字节区间）"""
+    if is_compressed(path):
+        if start or end is not None:
+            raise ValueError(f'Byte ranges are not supported for compressed file {path}')
+        return iter_compressed_lines(path)
+    return iter_mmap_lines(path, start, end)
+
+
+def iter_parsed_chunks(path, service_name='nginx', chunk_size=10000, stats=None,
+                       start=0, end=None, progress=None, progress_interval=5.0, log_format=None):
+    """流式解析日志文件，每 chunk_size 条解析结果产出一个列表
+
+    无法解析的行计入 stats.errors 并跳过；progress 是可选的回调，
+    每隔 progress_interval 秒以 stats 为参数调用一次，用于输出实时吞吐量。
+    """
+    if service_name == 'syslog' and log_format is None:
+        # 用文件修改时间推断 RFC 3164 日志的年份
+        praser = make_syslog_praser(reference_time=os.path.getmtime(path))
+    else:
+        praser = make_log_praser(service_name, log_format)
+    if stats is None:
+        stats = ParseStats()
+    last_report = stats.start
+    chunk = []
+    for raw in iter_log_lines(path, start, end):
+        stats.lines += 1
+        stats.bytes += len(raw) + 1
+        if not raw:
+            continue
+        try:
+            chunk.append(praser(raw.decode('utf-8', 'replace')))
+        except (IndexError, ValueError):
+            stats.errors += 1
+            continue
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+            if progress is not None:
+                now = time.perf_counter()
+                if now - last_report >= progress_interval:
+                    progress(stats)
+                    last_report = now
+    if chunk:
+        yield chunk
+
+
+def parse_log_file(path, service_name='nginx', chunk_size=10000, stats=None, **kwargs):
+    """逐条产出解析结果，内部按块读取，内存占用与文件大小无关"""
+    for chunk in iter_parsed_chunks(path, service_name, chunk_size, stats, **kwargs):
+        yield from chunk
+
+
+def split_byte_ranges(path, shards):
+    """把文件切成 shards 个字节区间，每个区间都从行首开始、在换行符之后结束"""
+    size = os.path.getsize(path)
+    if size == 0:
+        return []
+    shards = max(1, min(shards, size))
+    boundaries = [0]
+    with open(path, 'rb') as f:
+        for i in range(1, shards):
+            target = size * i // shards
+            if target <= boundaries[-1]:
+                continue
+            # 从目标位置前一个字节开始读到行尾，保证切分点落在换行符之后
+            f.seek(target - 1)
+            f.readline()
+            pos = f.tell()
+            if pos >= size:
+                break
+            if pos > boundaries[-1]:
+                boundaries.append(pos)
+    boundaries.append(size)
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def new_aggregate():
+    return {'lines': 0, 'errors': 0, 'records': 0, 'bytes': 0, 'status': Counter(), 'ips': Counter()}
+
+
+def update_aggregate(agg, record):
+    agg['records'] += 1
+    agg['status'][record['status']] += 1
+    agg['ips'][record['IP']] += 1
+    size = record['size']
+    if size.isdigit():
+        agg['bytes'] += int(size)
+
+
+def merge_aggregates(aggs):
+    """合并多个分片的聚合结果"""
+    total = new_aggregate()
+    for agg in aggs:
+        for key in ('lines', 'errors', 'records', 'bytes'):
+            total[key] += agg[key]
+        total['status'].update(agg['status'])
+        total['ips'].update(agg['ips'])
+    return total
+
+
+def _parse_shard(task):
+    # 在子进程中运行：解析一个字节区间，只把聚合结果返回给主进程
+    path, start, end, service_name, mode, log_format = task
+    stats = ParseStats()
+    records = parse_log_file(path, service_name, stats=stats, start=start, end=end, log_format=log_format)
+    if mode == 'sketch':
+        agg = SketchAggregate()
+        for record in records:
+            agg.update(record)
+        agg.lines = stats.lines
+        agg.errors = stats.errors
+        return agg
+    agg = new_aggregate()
+    for record in records:
+        update_aggregate(agg, record)
+    agg['lines'] = stats.lines
+    agg['errors'] = stats.errors
+    return agg
+
+
+def merge_sketches(aggs):
+    total = SketchAggregate()
+    for agg in aggs:
+        total.merge(agg)
+    return total
+
+
+def build_shard_tasks(paths, shards, service_name='nginx', mode='exact', log_format=None):
+    """为多个文件生成分片任务：压缩文件整体作为一个任务，普通文件按大小分配字节区间"""
+    tasks = []
+    plain = [p for p in paths if not is_compressed(p)]
+    plain_size = sum(os.path.getsize(p) for p in plain) or 1
+    for path in paths:
+        if is_compressed(path):
+            tasks.append((path, 0, None, service_name, mode, log_format))
+            continue
+        file_shards = max(1, round(shards * os.path.getsize(path) / plain_size))
+        for start, end in split_byte_ranges(path, file_shards):
+            tasks.append((path, start, end, service_name, mode, log_format))
+    return tasks
+
+
+def parse_log_parallel(path, workers=None, shards=None, service_name='nginx', mode='exact', log_format=None):
+    """用进程池并行解析日志文件（文件 / glob / 目录），返回合并后的聚合结果
+
+    mode='exact' 返回精确计数的字典，mode='sketch' 返回固定内存的 SketchAggregate。
+    """
+    workers = workers or os.cpu_count() or 1
+    # 分片数多于进程数，避免个别分片慢拖住整体
+    shards = shards or workers * 4
+    tasks = build_shard_tasks(expand_log_paths(path), shards, service_name, mode, log_format)
+    merge = merge_sketches if mode == 'sketch' else merge_aggregates
+    if workers == 1:
+        return merge(map(_parse_shard, tasks))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return merge(executor.map(_parse_shard, tasks))
+
+
+def request_path(request):
+    """从 '"GET /index.html HTTP/1.1"' 形式的请求字段中取出路径"""
+    parts = request.split(' ')
+    return parts[1] if len(parts) > 1 else parts[0]
+
+
+# 默认的路径段规则: (名称, 正则)，整段匹配时替换为 ':名称'，按顺序优先
+DEFAULT_ROUTE_RULES = (
+    ('id', r'\d+'),
+    ('uuid', r'[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}'),
+    ('hash', r'[0-9a-fA-F]{16,}'),
+)
+
+
+class RouteNode:
+    """路径段前缀树的节点"""
+
+    __slots__ = ('children', 'variable', 'fixed', 'learned', 'collapsed')
+
+    def __init__(self):
+        self.children = {}
+        # 模板中声明的变量段（':name' 或 '*'）
+        self.variable = None
+        # 模板中声明的字面量子节点，不计入扇出、不会被折叠
+        self.fixed = set()
+        # 从日志中学到的字面量子节点个数；超过上限后节点折叠，这些子节点都并入 '*'
+        self.learned = 0
+        self.collapsed = False
+
+
+class RouteNormalizer:
+    """把请求路径归一化为路由模板，例如 /api/users/123/orders -> /api/users/:id/orders"""
+
+    def __init__(self, rules=DEFAULT_ROUTE_RULES, templates=(), max_children=100, cache_size=65536):
+        self.rules = tuple(rules)
+        self.templates = tuple(templates)
+        self.max_children = max_children
+        self.cache_size = cache_size
+        # 所有规则合并成一个正则，用 lastgroup 得到命中的规则名，每段只匹配一次
+        self.rule_pattern = re.compile('|'.join(f'(?P<{name}>{pattern})' for name, pattern in self.rules)) \
+            if self.rules else None
+        self.root = RouteNode()
+        for template in self.templates:
+            self.add_template(template)
+        self.normalize_path = lru_cache(maxsize=cache_size)(self._normalize)
+
+    def __reduce__(self):
+        # lru_cache 包装的方法不能 pickle：按配置重新构造，再恢复学到的前缀树（分片结果要合并前缀树）
+        return self.__class__, (self.rules, self.templates, self.max_children, self.cache_size), self.root
+
+    def __setstate__(self, root):
+        self.root = root
+
+    def add_template(self, template):
+        node = self.root
+        for segment in template.strip('/').split('/'):
+            if segment.startswith(':') or segment == '*':
+                if node.variable is None:
+                    node.variable = (segment, RouteNode())
+                node = node.variable[1]
+            else:
+                node.fixed.add(segment)
+                node = node.children.setdefault(segment, RouteNode())
+
+    @staticmethod
+    def _is_learned(node, name):
+        return bool(name) and name != '*' and name[0] != ':' and name not in node.fixed
+
+    def _child(self, node, name):
+        """返回 (名称, 子节点)，必要时新建；学到的字面量超过上限时折叠节点，返回 '*'"""
+        child = node.children.get(name)
+        if child is not None:
+            return name, child
+        if self._is_learned(node, name):
+            if node.collapsed:
+                return self._child(node, '*')
+            node.learned += 1
+            if node.learned > self.max_children:
+                self._collapse(node)
+                return '*', node.children['*']
+        child = node.children[name] = RouteNode()
+        return name, child
+
+    def _collapse(self, node):
+        """把节点下已经学到的字面量子树全部并入 '*'，之后出现的新字面量也归为 '*'"""
+        node.collapsed = True
+        star = node.children.setdefault('*', RouteNode())
+        for name in [name for name in node.children if self._is_learned(node, name)]:
+            self._merge_nodes(star, node.children.pop(name))
+        node.learned = 0
+        # 缓存中可能还有折叠前的字面量模板
+        self.normalize_path.cache_clear()
+
+    def _merge_nodes(self, dst, src):
+        if src.variable is not None:
+            if dst.variable is None:
+                dst.variable = src.variable
+            else:
+                self._merge_nodes(dst.variable[1], src.variable[1])
+        dst.fixed |= src.fixed
+        if src.collapsed and not dst.collapsed:
+            self._collapse(dst)
+        for name, child in src.children.items():
+            self._merge_nodes(self._child(dst, name)[1], child)
+
+    def merge(self, other):
+        """合并另一个分片（或主机）学到的前缀树；合并结果与行的顺序和分片方式无关"""
+        if other is not self:
+            self._merge_nodes(self.root, other.root)
+        return self
+
+    def _normalize(self, path):
+        node = self.root
+        parts = []
+        match = self.rule_pattern.fullmatch if self.rule_pattern else None
+        for segment in path.split('/')[1:]:
+            child = node.children.get(segment)
+            if child is not None:
+                parts.append(segment)
+                node = child
+                continue
+            if node.variable is not None and segment:
+                name, node = node.variable
+                parts.append(name)
+                continue
+            name = segment
+            if match is not None and segment:
+                m = match(segment)
+                if m is not None:
+                    name = ':' + m.lastgroup
+                elif '.' in segment:
+                    # 带扩展名的段（app.d41d8cd98f00b204.js）按去掉扩展名的部分匹配
+                    stem, _, ext = segment.rpartition('.')
+                    m = match(stem) if stem else None
+                    if m is not None:
+                        name = ':' + m.lastgroup + '.' + ext
+            child = node.children.get(name)
+            if child is None:
+                name, child = self._child(node, name)
+            parts.append(name)
+            node = child
+        return '/' + '/'.join(parts)
+
+    def normalize(self, path):
+        """归一化路径（去掉查询参数），不是以 / 开头的请求目标原样返回"""
+        path = path.split('?', 1)[0]
+        if not path.startswith('/'):
+            return path
+        return self.normalize_path(path)
+
+    def canonical(self, template):
+        """按当前的前缀树重写之前得到的模板：节点折叠前学到的字面量改为 '*'"""
+        if not template.startswith('/'):
+            return template
+        node = self.root
+        parts = []
+        for segment in template.split('/')[1:]:
+            child = None
+            if node is not None:
+                child = node.children.get(segment)
+                if child is None and node.variable is not None and node.variable[0] == segment:
+                    child = node.variable[1]
+                elif child is None and node.collapsed and self._is_learned(node, segment):
+                    segment = '*'
+                    child = node.children.get('*')
+            parts.append(segment)
+            node = child
+        return '/' + '/'.join(parts)
+
+    def canonical_keys(self, table, combine, key=None):
+        """按 canonical() 重写字典的键，重写后相同的键用 combine(旧值, 新值) 合并"""
+        key = key or self.canonical
+        result = {}
+        for name, value in table.items():
+            name = key(name)
+            result[name] = combine(result[name], value) if name in result else value
+        return result
+
+    def cache_info(self):
+        return self.normalize_path.cache_info()
+
+    def to_dict(self):
+        def dump(node):
+            data = {'children': {name: dump(child) for name, child in node.children.items()}}
+            if node.variable is not None:
+                data['variable'] = [node.variable[0], dump(node.variable[1])]
+            if node.fixed:
+                data['fixed'] = sorted(node.fixed)
+            if node.learned:
+                data['learned'] = node.learned
+            if node.collapsed:
+                data['collapsed'] = True
+            return data
+        return {'rules': [list(rule) for rule in self.rules], 'templates': list(self.templates),
+                'max_children': self.max_children, 'cache_size': self.cache_size, 'trie': dump(self.root)}
+
+    @classmethod
+    def from_dict(cls, data):
+        def load(data):
+            node = RouteNode()
+            node.children = {name: load(child) for name, child in data['children'].items()}
+            if 'variable' in data:
+                node.variable = (data['variable'][0], load(data['variable'][1]))
+            node.fixed = set(data.get('fixed', ()))
+            node.learned = data.get('learned', 0)
+            node.collapsed = data.get('collapsed', False)
+            return node
+        normalizer = cls([tuple(rule) for rule in data['rules']], data['templates'], data['max_children'],
+                         data['cache_size'])
+        normalizer.root = load(data['trie'])
+        return normalizer
+
+
+def parse_route_rules(specs, defaults=True):
+    """把命令行的 name=REGEX 列表转换为规则元组，自定义规则排在默认规则之前"""
+    rules = []
+    for spec in specs or []:
+        name, sep, pattern = spec.partition('=')
+        if not sep or not name.isidentifier():
+            raise ValueError(f"Invalid route rule (expected name=REGEX): {spec}")
+        re.compile(pattern)
+        rules.append((name, pattern))
+    if defaults:
+        rules.extend(rule for rule in DEFAULT_ROUTE_RULES if rule[0] not in {name for name, _ in rules})
+    return tuple(rules)
+
+
+class StringDictionary:
+    """字典编码的字符串列：相同的字符串只保存一份，每行只保存一个整数编码"""
+
+    def __init__(self):
+        self.values = []
+        self.index = {}
+        self.codes = array('I')
+
+    def append(self, value):
+        code = self.index.get(value)
+        if code is None:
+            code = len(self.values)
+            self.index[value] = code
+            self.values.append(value)
+        self.codes.append(code)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, i):
+        return self.values[self.codes[i]]
+
+    def counts(self, indices=None):
+        """统计每个字符串出现的次数，可以只统计 indices 指定的行"""
+        codes = self.codes if indices is None else (self.codes[i] for i in indices)
+        return Counter({self.values[code]: count for code, count in Counter(codes).items()})
+
+    def nbytes(self):
+        return self.codes.itemsize * len(self.codes) + sum(sys.getsizeof(v) for v in self.values)
+
+
+class ColumnarLog:
+    """Nginx 访问日志的列式存储"""
+
+    def __init__(self):
+        self.status = array('H')
+        self.size = array('q')
+        self.time = array('q')
+        self.ip = StringDictionary()
+        self.path = StringDictionary()
+        self.user_agent = StringDictionary()
+
+    def __len__(self):
+        return len(self.status)
+
+    def append_record(self, record):
+        # 先转换所有字段再追加，转换失败时各列仍然对齐
+        size = record['size']
+        status = int(record['status'])
+        epoch = nginx_time_to_epoch(record['date'])
+        self.status.append(status)
+        self.size.append(int(size) if size.isdigit() else 0)
+        self.time.append(epoch)
+        self.ip.append(record['IP'])
+        self.path.append(request_path(record['request']))
+        self.user_agent.append(record['user_agent'])
+
+    def row(self, i):
+        return {
+            'IP': self.ip[i],
+            'time': self.time[i],
+            'path': self.path[i],
+            'status': self.status[i],
+            'size': self.size[i],
+            'user_agent': self.user_agent[i],
+        }
+
+    def indices_where(self, status_min=None, status_max=None, start=None, end=None):
+        """按状态码区间和时间区间 [start, end) 筛选，返回行号数组"""
+        status, times = self.status, self.time
+        result = array('I')
+        for i in range(len(status)):
+            if status_min is not None and status[i] < status_min:
+                continue
+            if status_max is not None and status[i] > status_max:
+                continue
+            if start is not None and times[i] < start:
+                continue
+            if end is not None and times[i] >= end:
+                continue
+            result.append(i)
+        return result
+
+    def status_histogram(self, indices=None):
+        if indices is None:
+            return Counter(self.status)
+        return Counter(self.status[i] for i in indices)
+
+    def total_bytes(self, indices=None):
+        if indices is None:
+            return sum(self.size)
+        return sum(self.size[i] for i in indices)
+
+    def time_histogram(self, bucket_seconds=60):
+        return Counter(t - t % bucket_seconds for t in self.time)
+
+    def nbytes(self):
+        """估算列式结果占用的内存（字节）"""
+        arrays = (self.status, self.size, self.time)
+        return (sum(a.itemsize * len(a) for a in arrays)
+                + self.ip.nbytes() + self.path.nbytes() + self.user_agent.nbytes())
+
+    def to_numpy(self):
+        """把数值列和字符串编码列转换为 numpy 数组，需要安装 numpy"""
+        try:
+            import numpy as np
+        except ImportError:
+            raise ImportError('to_numpy() requires numpy, install it with: pip install numpy')
+        return {
+            'status': np.frombuffer(self.status, dtype=np.uint16),
+            'size': np.frombuffer(self.size, dtype=np.int64),
+            'time': np.frombuffer(self.time, dtype=np.int64),
+            'ip': np.frombuffer(self.ip.codes, dtype=np.uint32),
+            'path': np.frombuffer(self.path.codes, dtype=np.uint32),
+            'user_agent': np.frombuffer(self.user_agent.codes, dtype=np.uint32),
+        }
+
+
+def parse_log_columnar(path, stats=None, **kwargs):
+    """流式解析 Nginx 日志并直接填充列式结果"""
+    columns = ColumnarLog()
+    for chunk in iter_parsed_chunks(path, 'nginx', stats=stats, **kwargs):
+        for record in chunk:
+            try:
+                columns.append_record(record)
+            except ValueError:
+                if stats is not None:
+                    stats.errors += 1
+    return columns
+
+
+def _line_hash(line):
+    return hashlib.sha1(line).hexdigest()
+
+
+def _line_before(f, offset, window=65536):
+    """读取文件中以 offset 之前的换行符结尾的那一行"""
+    begin = max(0, offset - window)
+    f.seek(begin)
+    data = f.read(offset - begin)
+    if not data.endswith(b'\n'):
+        return None
+    line = data[data.rfind(b'\n', 0, len(data) - 1) + 1:-1]
+    return line[:-1] if line.endswith(b'\r') else line
+
+
+def _last_complete_offset(path, start, size):
+    """返回 [start, size) 范围内最后一个换行符之后的位置，没有完整行时返回 start"""
+    if size <= start:
+        return start
+    with open(path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            nl = mm.rfind(b'\n', start, size)
+    return start if nl == -1 else nl + 1
+
+
+class LogFollower:
+    """增量解析日志文件，通过检查点文件记住上次读到的位置"""
+
+    def __init__(self, path, service_name='nginx', checkpoint_path=None, chunk_size=10000, log_format=None):
+        self.path = path
+        self.praser = make_log_praser(service_name, log_format)
+        self.checkpoint_path = checkpoint_path or path + '.ckpt'
+        self.chunk_size = chunk_size
+        self.stats = ParseStats()
+        self.checkpoint = self.load_checkpoint()
+
+    def load_checkpoint(self):
+        try:
+            with open(self.checkpoint_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable checkpoint {self.checkpoint_path}: {e}", file=sys.stderr)
+            return None
+
+    def save_checkpoint(self, inode, offset, last_line):
+        self.checkpoint = {
+            'path': self.path,
+            'inode': inode,
+            'offset': offset,
+            'last_line_hash': _line_hash(last_line) if last_line is not None else None,
+        }
+        # 先写临时文件再原子替换，进程中途被杀也不会留下半个检查点
+        tmp_path = self.checkpoint_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.checkpoint, f)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def _checkpoint_matches(self, path, offset):
+        expected = self.checkpoint.get('last_line_hash')
+        if offset == 0 or expected is None:
+            return True
+        with open(path, 'rb') as f:
+            line = _line_before(f, offset)
+        return line is not None and _line_hash(line) == expected
+
+    def _find_rotated(self, inode):
+        """在 access.log.1、access.log-20300830 等轮替文件中按 inode 找到旧文件"""
+        for candidate in glob.glob(glob.escape(self.path) + '*'):
+            if candidate == self.path or candidate == self.checkpoint_path:
+                continue
+            try:
+                if os.stat(candidate).st_ino == inode:
+                    return candidate
+            except OSError:
+                continue
+        return None
+
+    def _plan(self):
+        """根据检查点决定要读取哪些 (文件, inode, 起始位置)"""
+        st = os.stat(self.path)
+        ckpt = self.checkpoint
+        if ckpt is None:
+            return [(self.path, st.st_ino, 0)]
+
+        offset = ckpt['offset']
+        if ckpt['inode'] != st.st_ino:
+            plan = []
+            rotated = self._find_rotated(ckpt['inode'])
+            if rotated is None:
+                print(f"Rotated file for inode {ckpt['inode']} not found (compressed or removed), "
+                      f"unread lines after offset {offset} are skipped", file=sys.stderr)
+            elif self._checkpoint_matches(rotated, offset):
+                plan.append((rotated, ckpt['inode'], offset))
+            return plan + [(self.path, st.st_ino, 0)]
+
+        if st.st_size < offset or not self._checkpoint_matches(self.path, offset):
+            print(f"{self.path} was truncated or replaced, reading from the beginning", file=sys.stderr)
+            offset = 0
+        return [(self.path, st.st_ino, offset)]
+
+    def poll(self):
+        """产出自上次检查点以来新增的解析结果（按块），每块被消费后都会更新检查点"""
+        plan = self._plan()
+        for path, inode, offset in plan:
+            end = _last_complete_offset(path, offset, os.path.getsize(path))
+            chunk = []
+            last_line = None
+            for line, next_offset in iter_mmap_lines(path, offset, end, with_offsets=True):
+                self.stats.lines += 1
+                self.stats.bytes += next_offset - offset
+                offset = next_offset
+                last_line = line
+                if not line:
+                    continue
+                try:
+                    chunk.append(self.praser(line.decode('utf-8', 'replace')))
+                except (IndexError, ValueError):
+                    self.stats.errors += 1
+                if len(chunk) >= self.chunk_size:
+                    yield chunk
+                    chunk = []
+                    self.save_checkpoint(inode, offset, last_line)
+            if chunk:
+                yield chunk
+            if last_line is None:
+                ckpt = self.checkpoint
+                if ckpt is not None and ckpt['inode'] == inode and ckpt['offset'] == offset:
+                    continue
+                # 没有新行但位置变了（如切换到轮替后的新文件），重新计算最后一行的哈希
+                if offset > 0:
+                    with open(path, 'rb') as f:
+                        last_line = _line_before(f, offset)
+            self.save_checkpoint(inode, offset, last_line)
+
+    def follow(self, interval=1.0):
+        """持续轮询文件，产出新的解析结果块"""
+        while True:
+            yield from self.poll()
+            time.sleep(interval)
+
+
+def _hash64(value):
+    return int.from_bytes(hashlib.blake2b(value.encode('utf-8', 'replace'), digest_size=8).digest(), 'little')
+
+
+class HyperLogLog:
+    """HyperLogLog 基数估算，内存固定为 2**p 字节"""
+
+    def __init__(self, p=14):
+        self.p = p
+        self.m = 1 << p
+        self.registers = bytearray(self.m)
+
+    def add(self, value):
+        x = _hash64(value)
+        idx = x >> (64 - self.p)
+        # 剩余 64-p 位中第一个 1 出现的位置
+        w = x & ((1 << (64 - self.p)) - 1)
+        rank = (64 - self.p) - w.bit_length() + 1
+        if rank > self.registers[idx]:
+            self.registers[idx] = rank
+
+    def merge(self, other):
+        if other.p != self.p:
+            raise ValueError('Cannot merge HyperLogLog with different precision')
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def count(self):
+        m = self.m
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        # 基数较小时改用线性计数，误差更小
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+
+class CountMinSketch:
+    """Count-Min 频率估算，只会高估不会低估"""
+
+    def __init__(self, width=32768, depth=4):
+        self.width = width
+        self.depth = depth
+        self.tables = [array('Q', bytes(8 * width)) for _ in range(depth)]
+
+    def _indexes(self, value):
+        x = _hash64(value)
+        h1, h2 = x & 0xFFFFFFFF, x >> 32
+        return [(h1 + i * h2) % self.width for i in range(self.depth)]
+
+    def add(self, value, count=1):
+        """增加计数并返回新的估算值"""
+        estimate = None
+        for table, i in zip(self.tables, self._indexes(value)):
+            table[i] += count
+            if estimate is None or table[i] < estimate:
+                estimate = table[i]
+        return estimate
+
+    def estimate(self, value):
+        return min(table[i] for table, i in zip(self.tables, self._indexes(value)))
+
+    def merge(self, other):
+        if (other.width, other.depth) != (self.width, self.depth):
+            raise ValueError('Cannot merge CountMinSketch with different dimensions')
+        for table, other_table in zip(self.tables, other.tables):
+            for i, count in enumerate(other_table):
+                if count:
+                    table[i] += count
+
+
+class TopK:
+    """基于 Count-Min 的 Top-K，最小堆中只保留 k 个候选"""
+
+    def __init__(self, k=20, width=32768, depth=4):
+        self.k = k
+        self.cms = CountMinSketch(width, depth)
+        self.candidates = {}
+        self.heap = []
+
+    def _min(self):
+        # 堆中的估算值可能已经过期（候选被再次计数），刷新到堆顶是最新值为止
+        heap, candidates = self.heap, self.candidates
+        while True:
+            estimate, value = heap[0]
+            current = candidates[value]
+            if estimate == current:
+                return estimate
+            heapq.heapreplace(heap, (current, value))
+
+    def add(self, value, count=1):
+        estimate = self.cms.add(value, count)
+        candidates = self.candidates
+        if value in candidates:
+            candidates[value] = estimate
+        elif len(candidates) < self.k:
+            candidates[value] = estimate
+            heapq.heappush(self.heap, (estimate, value))
+        elif estimate > self._min():
+            _, evicted = heapq.heapreplace(self.heap, (estimate, value))
+            del candidates[evicted]
+            candidates[value] = estimate
+
+    def merge(self, other):
+        self.cms.merge(other.cms)
+        values = set(self.candidates) | set(other.candidates)
+        ranked = sorted(((self.cms.estimate(v), v) for v in values), reverse=True)[:self.k]
+        self.candidates = {value: estimate for estimate, value in ranked}
+        self.heap = [(estimate, value) for estimate, value in ranked]
+        heapq.heapify(self.heap)
+
+    def most_common(self, n=None):
+        ranked = sorted(self.candidates.items(), key=lambda item: item[1], reverse=True)
+        return ranked if n is None else ranked[:n]
+
+
+class MinuteCounters:
+    """固定大小的每分钟计数器（环形数组），只保留最近 size 分钟"""
+
+    def __init__(self, size=10080):
+        self.size = size
+        self.minutes = array('q', [-1]) * size
+        self.requests = array('Q', bytes(8 * size))
+        self.errors = array('Q', bytes(8 * size))
+
+    def _slot(self, minute):
+        slot = minute % self.size
+        current = self.minutes[slot]
+        if current == minute:
+            return slot
+        if current > minute:
+            # 比窗口还旧的数据直接丢弃
+            return None
+        self.minutes[slot] = minute
+        self.requests[slot] = 0
+        self.errors[slot] = 0
+        return slot
+
+    def add(self, epoch, requests=1, errors=0):
+        slot = self._slot(epoch // 60)
+        if slot is not None:
+            self.requests[slot] += requests
+            self.errors[slot] += errors
+
+    def merge(self, other):
+        for minute, requests, errors in zip(other.minutes, other.requests, other.errors):
+            if minute >= 0:
+                self.add(minute * 60, requests, errors)
+
+    def items(self):
+        """按时间顺序返回 (分钟起始时间戳, 请求数, 5xx 数)"""
+        return sorted((minute * 60, self.requests[slot], self.errors[slot])
+                      for slot, minute in enumerate(self.minutes) if minute >= 0)
+
+
+class LatencyHistogram:
+    """HDR 风格的对数-线性延迟直方图（单位：微秒），固定精度、可合并"""
+
+    SUB_BUCKET_BITS = 7
+    HALF = 1 << (SUB_BUCKET_BITS - 1)
+
+    def __init__(self):
+        self.counts = {}
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    @classmethod
+    def bucket_index(cls, value):
+        # 小于 128 的值每个数一个桶；更大的值按 2 的幂分段，每段 64 个等宽的桶
+        if value < cls.HALF * 2:
+            return value
+        shift = value.bit_length() - cls.SUB_BUCKET_BITS
+        return (shift << (cls.SUB_BUCKET_BITS - 1)) + (value >> shift)
+
+    @classmethod
+    def bucket_value(cls, index):
+        """桶的代表值（桶中点）"""
+        if index < cls.HALF * 2:
+            return index
+        shift = (index >> (cls.SUB_BUCKET_BITS - 1)) - 1
+        mantissa = index - (shift << (cls.SUB_BUCKET_BITS - 1))
+        return (mantissa << shift) + (1 << shift) // 2
+
+    def add(self, value, count=1):
+        index = self.bucket_index(value)
+        self.counts[index] = self.counts.get(index, 0) + count
+        self.count += count
+        self.total += value * count
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        counts = self.counts
+        for index, count in other.counts.items():
+            counts[index] = counts.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (self.max is None or other.max > self.max):
+            self.max = other.max
+        return self
+
+    def percentiles(self, quantiles=(0.5, 0.95, 0.99, 0.999)):
+        """一次遍历有序的桶，返回 {分位数: 微秒}"""
+        result = {}
+        if not self.count:
+            return {q: None for q in quantiles}
+        targets = sorted((max(1, math.ceil(q * self.count)), q) for q in quantiles)
+        seen = 0
+        i = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            while i < len(targets) and seen >= targets[i][0]:
+                # 代表值限制在实际的最小值和最大值之间
+                result[targets[i][1]] = min(max(self.bucket_value(index), self.min), self.max)
+                i += 1
+            if i == len(targets):
+                break
+        return result
+
+    def percentile(self, q):
+        return self.percentiles((q,))[q]
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def to_dict(self):
+        return {'count': self.count, 'total': self.total, 'min': self.min, 'max': self.max,
+                'counts': sorted(self.counts.items())}
+
+    @classmethod
+    def from_dict(cls, data):
+        hist = cls()
+        hist.counts = {int(index): count for index, count in data['counts']}
+        hist.count, hist.total, hist.min, hist.max = data['count'], data['total'], data['min'], data['max']
+        return hist
+
+
+class SketchAggregate:
+    """固定内存的访问日志聚合结果，可在分片之间合并"""
+
+    def __init__(self, top_k=20, minutes=10080):
+        self.lines = 0
+        self.errors = 0
+        self.records = 0
+        self.bytes = 0
+        self.status = Counter()
+        self.distinct_ips = HyperLogLog()
+        self.top_ips = TopK(top_k)
+        self.top_paths = TopK(top_k)
+        self.per_minute = MinuteCounters(minutes)
+
+    def update(self, record):
+        self.records += 1
+        status = record['status']
+        self.status[status] += 1
+        size = record['size']
+        if size.isdigit():
+            self.bytes += int(size)
+        ip = record['IP']
+        self.distinct_ips.add(ip)
+        self.top_ips.add(ip)
+        self.top_paths.add(request_path(record['request']))
+        try:
+            self.per_minute.add(nginx_time_to_epoch(record['date']), errors=status.startswith('5'))
+        except ValueError:
+            pass
+
+    def merge(self, other):
+        self.lines += other.lines
+        self.errors += other.errors
+        self.records += other.records
+        self.bytes += other.bytes
+        self.status.update(other.status)
+        self.distinct_ips.merge(other.distinct_ips)
+        self.top_ips.merge(other.top_ips)
+        self.top_paths.merge(other.top_paths)
+        self.per_minute.merge(other.per_minute)
+        return self
+
+
+# 索引文件头: 魔数、inode、已索引的字节数、时间桶秒数
+TIME_INDEX_MAGIC = b'TIDX1\0\0\0'
+TIME_INDEX_HEADER = struct.Struct('<8sQQq')
+
+
+def make_line_timer(service_name='nginx', reference_time=None):
+    """返回从原始行(bytes)中提取 Unix 时间戳的函数，无法识别时返回 None"""
+    last = [None, None]
+
+    if service_name == 'nginx':
+        def line_time(line):
+            i = line.find(b'[')
+            j = line.find(b']', i + 1)
+            if i < 0 or j < 0:
+                return None
+            stamp = line[i + 1:j]
+            # 同一秒内的行共用一次时间转换
+            if stamp != last[0]:
+                try:
+                    last[1] = nginx_time_to_epoch(stamp.decode('ascii'))
+                except (UnicodeDecodeError, ValueError):
+                    return None
+                last[0] = stamp
+            return last[1]
+        return line_time
+
+    if service_name == 'syslog':
+        praser = make_syslog_praser(reference_time=reference_time)
+
+        def line_time(line):
+            try:
+                return praser(line.decode('utf-8', 'replace'))['timestamp']
+            except ValueError:
+                return None
+        return line_time
+
+    raise ValueError(f'Time index is not supported for service {service_name}')
+
+
+class TimeIndex:
+    """时间桶 -> 字节偏移 的稀疏索引"""
+
+    def __init__(self, inode=0, indexed_size=0, bucket_seconds=60):
+        self.inode = inode
+        self.indexed_size = indexed_size
+        self.bucket_seconds = bucket_seconds
+        self.buckets = array('q')
+        self.offsets = array('q')
+
+    @classmethod
+    def load(cls, index_path):
+        with open(index_path, 'rb') as f:
+            magic, inode, indexed_size, bucket_seconds = TIME_INDEX_HEADER.unpack(f.read(TIME_INDEX_HEADER.size))
+            if magic != TIME_INDEX_MAGIC:
+                raise ValueError(f'{index_path} is not a time index file')
+            index = cls(inode, indexed_size, bucket_seconds)
+            pairs = array('q')
+            pairs.frombytes(f.read())
+        index.buckets = pairs[0::2]
+        index.offsets = pairs[1::2]
+        return index
+
+    def save(self, index_path):
+        pairs = array('q', bytes(16 * len(self.buckets)))
+        pairs[0::2] = self.buckets
+        pairs[1::2] = self.offsets
+        tmp_path = index_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(TIME_INDEX_HEADER.pack(TIME_INDEX_MAGIC, self.inode, self.indexed_size, self.bucket_seconds))
+            f.write(pairs.tobytes())
+        os.replace(tmp_path, index_path)
+
+    def add(self, bucket, offset):
+        # 只记录比已有时间桶更新的桶，日志中轻微的乱序由查询时的余量处理
+        if not self.buckets or bucket > self.buckets[-1]:
+            self.buckets.append(bucket)
+            self.offsets.append(offset)
+
+    def seek_offset(self, start):
+        """返回可能包含 start 时刻日志的最小偏移（向前多留一个时间桶的余量）"""
+        i = bisect.bisect_right(self.buckets, start - self.bucket_seconds) - 1
+        return self.offsets[i] if i >= 0 else 0
+
+
+def build_time_index(path, bucket_seconds=60, index_path=None, service_name='nginx'):
+    """为日志文件生成或增量更新时间索引，返回 TimeIndex"""
+    index_path = index_path or path + '.tidx'
+    st = os.stat(path)
+    index = None
+    try:
+        index = TimeIndex.load(index_path)
+        # 文件被替换、变小或桶大小不同时重新生成
+        if index.inode != st.st_ino or index.indexed_size > st.st_size or index.bucket_seconds != bucket_seconds:
+            index = None
+    except (FileNotFoundError, ValueError, struct.error):
+        index = None
+    if index is None:
+        index = TimeIndex(st.st_ino, 0, bucket_seconds)
+
+    line_time = make_line_timer(service_name, reference_time=st.st_mtime)
+    offset = index.indexed_size
+    end = _last_complete_offset(path, offset, st.st_size)
+    for line, next_offset in iter_mmap_lines(path, offset, end, with_offsets=True):
+        epoch = line_time(line)
+        if epoch is not None:
+            index.add(epoch - epoch % bucket_seconds, offset)
+        offset = next_offset
+    index.indexed_size = end
+    index.save(index_path)
+    return index
+
+
+def query_time_range(path, start, end, index_path=None, service_name='nginx', bucket_seconds=60):
+    """产出时间在 [start, end) 内的原始行(bytes)，只读取索引定位到的字节范围"""
+    index = build_time_index(path, bucket_seconds, index_path, service_name)
+    line_time = make_line_timer(service_name, reference_time=os.path.getmtime(path))
+    # 超过 end 一个时间桶之后就不会再有窗口内的日志了
+    stop = end + index.bucket_seconds
+    for line in iter_mmap_lines(path, index.seek_offset(start)):
+        epoch = line_time(line)
+        if epoch is None:
+            continue
+        if epoch >= stop:
+            break
+        if start <= epoch < end:
+            yield line
+
+
+class StatusReport:
+    """状态码分布"""
+
+    title = 'Status codes'
+
+    def __init__(self, top=20):
+        self.counts = Counter()
+
+    def update(self, record):
+        self.counts[record['status']] += 1
+
+    def merge(self, other):
+        self.counts.update(other.counts)
+
+    def result(self):
+        return dict(sorted(self.counts.items()))
+
+    def text(self):
+        return [f"{status}: {count}" for status, count in self.result().items()]
+
+
+class TopCounterReport:
+    """按某个字段计数并取 Top N 的报表基类，子类实现 key() 和可选的 weight()"""
+
+    title = ''
+
+    def __init__(self, top=20):
+        self.top = top
+        self.counts = Counter()
+
+    def key(self, record):
+        raise NotImplementedError
+
+    def weight(self, record):
+        return 1
+
+    def update(self, record):
+        key = self.key(record)
+        if key is not None:
+            self.counts[key] += self.weight(record)
+
+    def merge(self, other):
+        self.counts.update(other.counts)
+
+    def result(self):
+        return [{'key': key, 'value': value} for key, value in self.counts.most_common(self.top)]
+
+    def text(self):
+        return [f"{item['key']}: {item['value']}" for item in self.result()]
+
+
+class BandwidthReport(TopCounterReport):
+    """按路由模板统计响应字节数"""
+
+    title = 'Bandwidth by route (bytes)'
+    uses_routes = True
+
+    def __init__(self, top=20, normalizer=None):
+        super().__init__(top)
+        self.normalizer = normalizer or RouteNormalizer()
+
+    def key(self, record):
+        return self.normalizer.normalize(request_path(record['request']))
+
+    def merge(self, other):
+        self.normalizer.merge(other.normalizer)
+        super().merge(other)
+
+    def result(self):
+        self.counts = Counter(self.normalizer.canonical_keys(self.counts, operator.add))
+        return super().result()
+
+    def weight(self, record):
+        size = record['size']
+        return int(size) if size.isdigit() else 0
+
+
+class RefererReport(TopCounterReport):
+    title = 'Top referers'
+
+    def key(self, record):
+        referer = record['referer']
+        return referer if referer not in ('', '-') else None
+
+
+class UserAgentReport(TopCounterReport):
+    title = 'Top user agents'
+
+    def key(self, record):
+        return record['user_agent']
+
+
+class IPReport(TopCounterReport):
+    title = 'Top client IPs'
+
+    def key(self, record):
+        return record['IP']
+
+
+def _minute_sort_key(minute):
+    try:
+        return datetime.strptime(minute, '%d/%b/%Y:%H:%M')
+    except ValueError:
+        return datetime.max
+
+
+def sorted_minutes(minutes):
+    """把 'dd/Mon/yyyy:HH:MM' 形式的分钟键按时间排序，无法解析的排在最后"""
+    # 不同分钟数最多每天 1440 个，排序时再解析时间
+    return sorted(minutes, key=_minute_sort_key)
+
+
+class ErrorRateReport:
+    """每分钟的请求数、5xx 数和错误率"""
+
+    title = 'Error rate per minute'
+
+    def __init__(self, top=20):
+        # 分钟键直接取时间字段的前 17 个字符 '30/Aug/2030:11:27'，不逐行解析时间
+        self.minutes = {}
+
+    def update(self, record):
+        minute = record['date'][:17]
+        counts = self.minutes.get(minute)
+        if counts is None:
+            counts = self.minutes[minute] = [0, 0]
+        counts[0] += 1
+        if record['status'].startswith('5'):
+            counts[1] += 1
+
+    def merge(self, other):
+        for minute, (requests, errors) in other.minutes.items():
+            counts = self.minutes.setdefault(minute, [0, 0])
+            counts[0] += requests
+            counts[1] += errors
+
+    def result(self):
+        return [{'minute': minute, 'requests': self.minutes[minute][0], 'errors': self.minutes[minute][1],
+                 'error_rate': round(self.minutes[minute][1] / self.minutes[minute][0], 4)}
+                for minute in sorted_minutes(self.minutes)]
+
+    def text(self):
+        return [f"{row['minute']}: {row['requests']} requests, {row['errors']} 5xx ({row['error_rate']:.2%})"
+                for row in self.result()]
+
+
+def parse_latency(value):
+    """把 '0.123' 或多个上游的 '0.010, 0.002 : 0.005' 转换为微秒，没有值时返回 None"""
+    if not value or value == '-':
+        return None
+    if ',' in value or ':' in value:
+        total = None
+        for part in value.replace(' : ', ',').split(','):
+            part = part.strip()
+            if part and part != '-':
+                total = (total or 0) + round(float(part) * 1000000)
+        return total
+    return round(float(value) * 1000000)
+
+
+LATENCY_QUANTILES = (0.5, 0.95, 0.99, 0.999)
+LATENCY_FIELDS = ('request_time', 'upstream_response_time')
+
+
+class LatencyReport:
+    """按路由和按分钟统计请求耗时与上游耗时的分布"""
+
+    title = 'Latency percentiles (ms)'
+    OTHER_ROUTE = '<other>'
+    uses_routes = True
+
+    def __init__(self, top=20, max_routes=1000, normalizer=None):
+        self.top = top
+        self.max_routes = max_routes
+        self.normalizer = normalizer or RouteNormalizer()
+        self.missing = 0
+        self.overall = {field: LatencyHistogram() for field in LATENCY_FIELDS}
+        self.routes = {}
+        self.minutes = {}
+
+    def route(self, record):
+        return self.normalizer.normalize(request_path(record['request']))
+
+    def _histograms(self, table, key):
+        hists = table.get(key)
+        if hists is None:
+            hists = table[key] = {field: LatencyHistogram() for field in LATENCY_FIELDS}
+        return hists
+
+    def update(self, record):
+        values = []
+        for field in LATENCY_FIELDS:
+            try:
+                values.append(parse_latency(record.get(field)))
+            except ValueError:
+                values.append(None)
+        if values[0] is None and values[1] is None:
+            self.missing += 1
+            return
+        route = self.route(record)
+        if route not in self.routes and len(self.routes) >= self.max_routes:
+            # 路由数量有上限，超出的都归到 <other>，内存不会随路径数增长
+            route = self.OTHER_ROUTE
+        by_route = self._histograms(self.routes, route)
+        by_minute = self._histograms(self.minutes, record['date'][:17])
+        for field, value in zip(LATENCY_FIELDS, values):
+            if value is not None:
+                self.overall[field].add(value)
+                by_route[field].add(value)
+                by_minute[field].add(value)
+
+    def canonicalize(self):
+        def combine(mine, other):
+            for field in LATENCY_FIELDS:
+                mine[field].merge(other[field])
+            return mine
+        self.routes = self.normalizer.canonical_keys(self.routes, combine)
+
+    def merge(self, other):
+        self.normalizer.merge(other.normalizer)
+        self.missing += other.missing
+        for field in LATENCY_FIELDS:
+            self.overall[field].merge(other.overall[field])
+        for table, other_table in ((self.routes, other.routes), (self.minutes, other.minutes)):
+            for key, hists in other_table.items():
+                if table is self.routes and key not in table and len(table) >= self.max_routes:
+                    key = self.OTHER_ROUTE
+                mine = self._histograms(table, key)
+                for field in LATENCY_FIELDS:
+                    mine[field].merge(hists[field])
+        return self
+
+    @staticmethod
+    def summarize(hist):
+        if not hist.count:
+            return None
+        summary = {'count': hist.count, 'mean_ms': round(hist.mean / 1000, 3), 'max_ms': hist.max / 1000}
+        for q, value in hist.percentiles(LATENCY_QUANTILES).items():
+            summary[f'p{q * 100:g}_ms'] = value / 1000
+        return summary
+
+    def result(self):
+        self.canonicalize()
+        routes = sorted(self.routes.items(), key=lambda item: -item[1]['request_time'].count)[:self.top]
+        return {
+            'missing': self.missing,
+            'overall': {field: self.summarize(hist) for field, hist in self.overall.items()},
+            'routes': [{'route': route, **{field: self.summarize(h) for field, h in hists.items()}}
+                       for route, hists in routes],
+            'minutes': [{'minute': minute, **{field: self.summarize(h) for field, h in self.minutes[minute].items()}}
+                        for minute in sorted_minutes(self.minutes)],
+        }
+
+    @staticmethod
+    def _row(label, summary):
+        if summary is None:
+            return f"{label}: -"
+        return (f"{label}: n={summary['count']} p50={summary['p50_ms']:.1f} p95={summary['p95_ms']:.1f} "
+                f"p99={summary['p99_ms']:.1f} p99.9={summary['p99.9_ms']:.1f} max={summary['max_ms']:.1f}")
+
+    def text(self, minutes=None):
+        result = self.result()
+        lines = [self._row(field, summary) for field, summary in result['overall'].items()]
+        if result['missing']:
+            lines.append(f"{result['missing']} records without request_time / upstream_response_time")
+        lines.append(f"Top {self.top} routes (request_time):")
+        lines.extend('  ' + self._row(row['route'], row['request_time']) for row in result['routes'])
+        rows = result['minutes'] if minutes is None else result['minutes'][-minutes:]
+        lines.append('Per minute (request_time):')
+        lines.extend('  ' + self._row(row['minute'], row['request_time']) for row in rows)
+        return lines
+
+    def to_dict(self):
+        """完整保存所有直方图，用于跨主机合并"""
+        def dump(table):
+            return {key: {field: h.to_dict() for field, h in hists.items()} for key, hists in table.items()}
+        self.canonicalize()
+        return {'missing': self.missing, 'max_routes': self.max_routes, 'normalizer': self.normalizer.to_dict(),
+                'overall': {field: h.to_dict() for field, h in self.overall.items()},
+                'routes': dump(self.routes), 'minutes': dump(self.minutes)}
+
+    @classmethod
+    def from_dict(cls, data, top=20):
+        def load(table):
+            return {key: {field: LatencyHistogram.from_dict(h) for field, h in hists.items()}
+                    for key, hists in table.items()}
+        normalizer = RouteNormalizer.from_dict(data['normalizer']) if 'normalizer' in data else None
+        report = cls(top, data.get('max_routes', 1000), normalizer)
+        report.missing = data['missing']
+        report.overall = {field: LatencyHistogram.from_dict(h) for field, h in data['overall'].items()}
+        report.routes = load(data['routes'])
+        report.minutes = load(data['minutes'])
+        return report
+
+
+class EndpointReport:
+    """按“方法 + 路由模板”统计请求数、字节数、错误比例和延迟"""
+
+    title = 'Endpoints'
+    uses_routes = True
+
+    def __init__(self, top=20, normalizer=None):
+        self.top = top
+        self.normalizer = normalizer or RouteNormalizer()
+        # 端点 -> [请求数, 字节数, 4xx 数, 5xx 数]
+        self.stats = {}
+        self.latency = {}
+
+    def update(self, record):
+        request = record['request']
+        parts = request.split(' ')
+        method = parts[0] if len(parts) > 1 else '-'
+        endpoint = method + ' ' + self.normalizer.normalize(request_path(request))
+        stats = self.stats.get(endpoint)
+        if stats is None:
+            stats = self.stats[endpoint] = [0, 0, 0, 0]
+        stats[0] += 1
+        size = record['size']
+        if size.isdigit():
+            stats[1] += int(size)
+        status = record['status']
+        if status[:1] == '4':
+            stats[2] += 1
+        elif status[:1] == '5':
+            stats[3] += 1
+        try:
+            value = parse_latency(record.get('request_time'))
+        except ValueError:
+            value = None
+        if value is not None:
+            hist = self.latency.get(endpoint)
+            if hist is None:
+                hist = self.latency[endpoint] = LatencyHistogram()
+            hist.add(value)
+
+    def endpoint_key(self, endpoint):
+        method, _, path = endpoint.partition(' ')
+        return method + ' ' + self.normalizer.canonical(path)
+
+    def canonicalize(self):
+        def add(mine, other):
+            for i, value in enumerate(other):
+                mine[i] += value
+            return mine
+        self.stats = self.normalizer.canonical_keys(self.stats, add, self.endpoint_key)
+        self.latency = self.normalizer.canonical_keys(self.latency, LatencyHistogram.merge, self.endpoint_key)
+
+    def merge(self, other):
+        self.normalizer.merge(other.normalizer)
+        for endpoint, stats in other.stats.items():
+            mine = self.stats.get(endpoint)
+            if mine is None:
+                self.stats[endpoint] = list(stats)
+            else:
+                for i, value in enumerate(stats):
+                    mine[i] += value
+        for endpoint, hist in other.latency.items():
+            if endpoint in self.latency:
+                self.latency[endpoint].merge(hist)
+            else:
+                self.latency[endpoint] = hist
+        return self
+
+    def result(self):
+        self.canonicalize()
+        rows = []
+        for endpoint, (count, size, client_errors, server_errors) in \
+                sorted(self.stats.items(), key=lambda item: -item[1][0])[:self.top]:
+            row = {'endpoint': endpoint, 'requests': count, 'bytes': size,
+                   '4xx_ratio': round(client_errors / count, 4), '5xx_ratio': round(server_errors / count, 4)}
+            hist = self.latency.get(endpoint)
+            if hist is not None:
+                p50, p99 = (value / 1000 for value in hist.percentiles((0.5, 0.99)).values())
+                row.update(p50_ms=p50, p99_ms=p99)
+            rows.append(row)
+        return {'endpoints': len(self.stats), 'top': rows}
+
+    def text(self):
+        result = self.result()
+        lines = [f"{result['endpoints']} endpoints"]
+        for row in result['top']:
+            line = (f"{row['endpoint']}: {row['requests']} requests, {row['bytes']} bytes, "
+                    f"4xx {row['4xx_ratio']:.2%}, 5xx {row['5xx_ratio']:.2%}")
+            if 'p50_ms' in row:
+                line += f", p50 {row['p50_ms']:.1f}ms, p99 {row['p99_ms']:.1f}ms"
+            lines.append(line)
+        return lines
+
+
+# 报表名 -> 报表类，自定义报表加到这里即可在 report 子命令中使用
+REPORTS = {
+    'status': StatusReport,
+    'bandwidth': BandwidthReport,
+    'referers': RefererReport,
+    'user_agents': UserAgentReport,
+    'ips': IPReport,
+    'error_rate': ErrorRateReport,
+    'latency': LatencyReport,
+    'endpoints': EndpointReport,
+}
+
+
+class ReportEngine:
+    """一次遍历解析结果，同时计算所有已注册的报表"""
+
+    def __init__(self, names=None, top=20, normalizer=None):
+        self.top = top
+        # 按路由聚合的报表共用一个归一化器（和它的缓存）
+        self.normalizer = normalizer or RouteNormalizer()
+        self.reports = {}
+        self.lines = 0
+        self.errors = 0
+        self.records = 0
+        for name in names or REPORTS:
+            self.register(name)
+
+    def register(self, name, report=None):
+        if report is None:
+            if name not in REPORTS:
+                raise ValueError(f"Unknown report: {name}")
+            cls = REPORTS[name]
+            report = cls(self.top, normalizer=self.normalizer) if getattr(cls, 'uses_routes', False) else cls(self.top)
+        self.reports[name] = report
+        return report
+
+    def update(self, record):
+        self.records += 1
+        for report in self.reports.values():
+            report.update(record)
+
+    def consume(self, records):
+        # 热循环里只做一次方法查找
+        updates = [report.update for report in self.reports.values()]
+        count = 0
+        for record in records:
+            count += 1
+            for update in updates:
+                update(record)
+        self.records += count
+        return self
+
+    def merge(self, other):
+        self.lines += other.lines
+        self.errors += other.errors
+        self.records += other.records
+        for name, report in other.reports.items():
+            if name in self.reports:
+                self.reports[name].merge(report)
+            else:
+                self.reports[name] = report
+        return self
+
+    def to_dict(self):
+        return {'lines': self.lines, 'records': self.records, 'errors': self.errors,
+                'reports': {name: report.result() for name, report in self.reports.items()}}
+
+    def to_json(self, indent=2):
+        return json.dumps(self.to_dict(), indent=indent, ensure_ascii=False)
+
+    def to_text(self):
+        out = [f"{self.records} records, {self.errors} unparsable lines"]
+        for name, report in self.reports.items():
+            out.append('')
+            out.append(f"[{name}] {report.title}")
+            out.extend('  ' + line for line in report.text())
+        return '\n'.join(out)
+
+
+def _report_shard(task):
+    # 在子进程中运行：一个分片只读一遍，返回该分片的全部报表
+    shard, names, top, normalizer = task
+    path, start, end, service_name, _, log_format = shard
+    stats = ParseStats()
+    engine = ReportEngine(names, top, normalizer)
+    engine.consume(parse_log_file(path, service_name, stats=stats, start=start, end=end, log_format=log_format))
+    engine.lines = stats.lines
+    engine.errors = stats.errors
+    return engine
+
+
+def run_reports(spec, names=None, top=20, workers=1, shards=None, log_format=NGINX_COMBINED_FORMAT, normalizer=None):
+    """对日志（文件 / glob / 目录）只读一遍，返回计算好全部报表的 ReportEngine
+
+    默认按 combined 格式编译解析器（main 格式的行末尾多一个字段，同样能匹配），
+    用户代理、来源等带空格或引号的字段都能完整取出。
+    """
+    log_format = log_format or NGINX_COMBINED_FORMAT
+    paths = expand_log_paths(spec)
+    if workers <= 1:
+        stats = ParseStats()
+        engine = ReportEngine(names, top, normalizer)
+        for path in paths:
+            engine.consume(parse_log_file(path, 'nginx', stats=stats, log_format=log_format))
+        engine.lines = stats.lines
+        engine.errors = stats.errors
+        return engine
+    tasks = [(shard, names, top, normalizer) for shard in build_shard_tasks(paths, shards or workers * 4, 'nginx',
+                                                                             'report', log_format)]
+    total = ReportEngine(names, top, normalizer)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for engine in executor.map(_report_shard, tasks):
+            total.merge(engine)
+    return total
+
+
+QUERY_TERM = re.compile(r'^(status|path|ip|time)\s*(>=|<=|!=|\^=|=|<|>)\s*(.+)$')
+QUERY_OPERATORS = {'=': operator.eq, '!=': operator.ne, '>=': operator.ge, '<=': operator.le,
+                   '>': operator.gt, '<': operator.lt}
+# 原始字节过滤依赖的字段顺序（combined / main 格式都以此开头）
+PUSHDOWN_PREFIX = '$remote_addr - $remote_user [$time_local] "$request" $status'
+# 检查代价从低到高，便宜的条件先过滤掉大部分行
+QUERY_COST = {'ip': 0, 'status': 1, 'path': 2, 'time': 3}
+
+
+def parse_query(expression):
+    """把 'status>=500 and path^=/api/' 解析成 [(字段, 运算符, 值), ...]"""
+    terms = []
+    for part in re.split(r'\s+and\s+', expression.strip(), flags=re.IGNORECASE):
+        match = QUERY_TERM.match(part.strip())
+        if match is None:
+            raise ValueError(f"Invalid query term: {part!r}")
+        field, op, value = match.groups()
+        value = value.strip()
+        if field in ('path', 'ip') and op not in ('=', '^=', '!='):
+            raise ValueError(f"{field} only supports =, != and ^=")
+        if field == 'status':
+            if op == '^=' or not re.fullmatch(r'\d{3}|[1-5]xx', value, re.IGNORECASE):
+                raise ValueError(f"Invalid status condition: {part!r}")
+            if value[1:].lower() == 'xx' and op not in ('=', '!='):
+                raise ValueError('status=Nxx only supports = and !=')
+        if field == 'time':
+            if op in ('=', '!=', '^='):
+                raise ValueError('time only supports <, <=, > and >=')
+            value = parse_time_arg(value)
+        terms.append((field, op, value))
+    return sorted(terms, key=lambda term: QUERY_COST[term[0]])
+
+
+def _match_value(op, actual, value):
+    if op == '^=':
+        return actual.startswith(value)
+    return QUERY_OPERATORS[op](actual, value)
+
+
+def make_raw_filter(terms):
+    """返回直接在原始行(bytes)上判断是否满足所有条件的函数"""
+    checks = []
+    for field, op, value in terms:
+        if field == 'ip':
+            prefix = value.encode()
+            if op == '^=':
+                checks.append(lambda raw, prefix=prefix: raw.startswith(prefix))
+            else:
+                want = op == '='
+                checks.append(lambda raw, ip=prefix + b' ', want=want: raw.startswith(ip) == want)
+        elif field == 'status':
+            if value[1:].lower() == 'xx':
+                first, want = value[:1].encode(), op == '='
+                def check(raw, first=first, want=want):
+                    j = raw.find(b'" ', raw.find(b'] "') + 3)
+                    return j > 0 and raw.startswith(first, j + 2) == want
+            else:
+                # 3 位状态码按字节比较和按数值比较结果相同
+                compare, code = QUERY_OPERATORS[op], value.encode()
+                def check(raw, compare=compare, code=code):
+                    j = raw.find(b'" ', raw.find(b'] "') + 3)
+                    return j > 0 and compare(raw[j + 2:j + 5], code)
+            checks.append(check)
+        elif field == 'path':
+            target = value.encode()
+            def check(raw, op=op, target=target):
+                i = raw.find(b'] "')
+                if i < 0:
+                    return False
+                start = raw.find(b' ', i + 3) + 1
+                if start <= 0:
+                    return False
+                if op == '^=':
+                    return raw.startswith(target, start)
+                end = raw.find(b' ', start)
+                return (raw[start:end] == target) == (op == '=')
+            checks.append(check)
+        elif field == 'time':
+            line_time = make_line_timer('nginx')
+            compare = QUERY_OPERATORS[op]
+            def check(raw, line_time=line_time, compare=compare, value=value):
+                epoch = line_time(raw)
+                return epoch is not None and compare(epoch, value)
+            checks.append(check)
+
+    def raw_filter(raw):
+        for check in checks:
+            if not check(raw):
+                return False
+        return True
+    return raw_filter
+
+
+def make_record_filter(terms):
+    """先解析再过滤时使用：在解析结果(字典)上判断条件"""
+    last = [None, None]
+
+    def record_time(date):
+        if date != last[0]:
+            last[0], last[1] = date, nginx_time_to_epoch(date)
+        return last[1]
+
+    def record_filter(record):
+        for field, op, value in terms:
+            if field == 'ip':
+                actual = record['IP']
+            elif field == 'path':
+                actual = request_path(record['request'])
+            elif field == 'status':
+                actual = record['status']
+                if value[1:].lower() == 'xx':
+                    if actual.startswith(value[0]) != (op == '='):
+                        return False
+                    continue
+            else:
+                try:
+                    actual = record_time(record['date'])
+                except ValueError:
+                    return False
+            if not _match_value(op, actual, value):
+                return False
+        return True
+    return record_filter
+
+
+def _status_regex(op, value):
+    """把状态码条件转换成只匹配 3 位数字的正则片段，例如 >=500 -> 5\\d\\d"""
+    if value[1:].lower() == 'xx':
+        return value[0] + r'\d\d' if op == '=' else f'(?!{value[0]})' + r'\d{3}'
+    compare, code = QUERY_OPERATORS[op], value
+    codes = {str(c) for c in range(100, 1000) if compare(str(c), code)}
+    parts = []
+    for first in '123456789':
+        if all(f'{first}{i:02d}' in codes for i in range(100)):
+            parts.append(first + r'\d\d')
+            continue
+        for second in '0123456789':
+            digits = ''.join(d for d in '0123456789' if f'{first}{second}{d}' in codes)
+            if len(digits) == 10:
+                parts.append(f'{first}{second}' + r'\d')
+            elif digits:
+                parts.append(f'{first}{second}[{digits}]')
+    return '(?:' + '|'.join(parts or ['(?!)']) + ')'
+
+
+def make_line_pattern(terms):
+    """把 ip / path / status 条件编译成从行首开始匹配的 bytes 正则，返回 (首行正则, 换行符开头的正则)
+
+    第二个正则以字面的 '\\n' 开头，正则引擎可以先快速查找换行符，比 MULTILINE 下的 '^' 快得多。
+    """
+    ip = path = status = ''
+    for field, op, value in terms:
+        if field == 'ip':
+            escaped = re.escape(value)
+            ip += {'^=': f'(?={escaped})', '=': f'(?={escaped} )', '!=': f'(?!{escaped} )'}[op]
+        elif field == 'path':
+            escaped = re.escape(value)
+            path += {'^=': f'(?={escaped})', '=': f'(?={escaped} )', '!=': f'(?!{escaped} )'}[op]
+        elif field == 'status':
+            status += f'(?={_status_regex(op, value)})'
+    # '$remote_addr - $remote_user [$time_local] "$request" $status'：第一个双引号就是请求字段的开始，
+    # 请求里的双引号会被 nginx 转义成 \x22
+    request = r'[^ "\n]* ' + path + r'[^"\n]*' if path else r'[^"\n]*'
+    body = (ip + r'[^"\n]*"' + request + r'" ' + status).encode()
+    return re.compile(body), re.compile(b'\n' + body)
+
+
+def iter_pattern_lines(path, patterns, start=0, end=None, stats=None):
+    """在 mmap 上用正则查找匹配的行，只有命中的行才会切片成 bytes；patterns 来自 make_line_pattern()"""
+    first_line, next_lines = patterns
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if hasattr(mm, 'madvise'):
+                mm.madvise(mmap.MADV_SEQUENTIAL)
+            end = size if end is None else min(end, size)
+            pos = start
+            while pos < end:
+                # 按 MMAP_RELEASE_BYTES 分段扫描，段尾对齐到换行符，扫描完的页归还给操作系统
+                stop = mm.find(b'\n', min(pos + MMAP_RELEASE_BYTES, end) - 1, end)
+                stop = end if stop == -1 else stop + 1
+                # pos 总是行首：这一行单独匹配，后面的行从换行符开始匹配
+                match = first_line.match(mm, pos, stop)
+                line_start = pos if match else None
+                matches = next_lines.finditer(mm, pos, stop)
+                try:
+                    while True:
+                        if line_start is not None:
+                            line_end = mm.find(b'\n', match.end(), stop)
+                            line = mm[line_start:line_end if line_end != -1 else stop]
+                            yield line[:-1] if line.endswith(b'\r') else line
+                        match = next(matches, None)
+                        if match is None:
+                            break
+                        line_start = match.start() + 1
+                finally:
+                    # finditer 和 match 对象引用着 mmap 的缓冲区，提前结束时要先释放才能关闭 mmap
+                    matches = match = None
+                if stats is not None:
+                    stats.bytes += stop - pos
+                    stats.lines += mm[pos:stop].count(b'\n')
+                if hasattr(mm, 'madvise'):
+                    begin = pos - pos % mmap.PAGESIZE
+                    upto = stop - stop % mmap.PAGESIZE
+                    if upto > begin:
+                        mm.madvise(mmap.MADV_DONTNEED, begin, upto - begin)
+                pos = stop
+
+
+def _counted_lines(lines, stats):
+    for raw in lines:
+        stats.lines += 1
+        stats.bytes += len(raw) + 1
+        if raw:
+            yield raw
+
+
+def query_log(path, expression, log_format=None, pushdown=True, index_path=None, stats=None):
+    """产出满足查询条件的原始行(bytes)
+
+    pushdown=True 时 ip / path / status 条件编译成一个正则直接扫描 mmap，
+    时间条件在命中的行上检查；命中的行还会完整解析一次，结果与先解析再过滤完全一致。
+    """
+    terms = parse_query(expression)
+    if stats is None:
+        stats = ParseStats()
+    praser = make_log_praser('nginx', log_format)
+    if log_format is not None and not log_format.startswith(PUSHDOWN_PREFIX):
+        # 自定义格式的字段位置未知，只能先解析再过滤
+        pushdown = False
+
+    start, end = 0, None
+    starts = [value for field, op, value in terms if field == 'time' and op in ('>', '>=')]
+    ends = [value for field, op, value in terms if field == 'time' and op in ('<', '<=')]
+    index_path = index_path or path + '.tidx'
+    if (starts or ends) and not is_compressed(path) and os.path.exists(index_path):
+        try:
+            index = TimeIndex.load(index_path)
+            if index.inode == os.stat(path).st_ino:
+                if starts:
+                    start = index.seek_offset(max(starts))
+                if ends:
+                    # 超过结束时间一个时间桶之后就不会再有窗口内的日志了
+                    i = bisect.bisect_left(index.buckets, min(ends) + 1 + index.bucket_seconds)
+                    end = index.offsets[i] if i < len(index.offsets) else None
+        except (ValueError, struct.error):
+            pass
+
+    if not pushdown:
+        record_filter = make_record_filter(terms)
+        for raw in _counted_lines(iter_log_lines(path, start, end), stats):
+            try:
+                record = praser(raw.decode('utf-8', 'replace'))
+            except (IndexError, ValueError):
+                stats.errors += 1
+                continue
+            if record_filter(record):
+                yield raw
+        return
+
+    byte_terms = [term for term in terms if term[0] != 'time']
+    time_terms = [term for term in terms if term[0] == 'time']
+    if byte_terms and not is_compressed(path):
+        candidates = iter_pattern_lines(path, make_line_pattern(byte_terms), start, end, stats)
+        raw_filter = make_raw_filter(time_terms) if time_terms else None
+    else:
+        # 压缩文件或只有时间条件时逐行检查
+        candidates = _counted_lines(iter_log_lines(path, start, end), stats)
+        raw_filter = make_raw_filter(terms)
+    for raw in candidates:
+        if raw_filter is not None and not raw_filter(raw):
+            continue
+        try:
+            praser(raw.decode('utf-8', 'replace'))
+        except (IndexError, ValueError):
+            stats.errors += 1
+            continue
+        yield raw
+
+
+def parse_log_files(spec, service_name='nginx', chunk_size=10000, stats=None, **kwargs):
+    """按时间顺序逐条产出多个日志文件（文件 / glob / 目录，可含压缩文件）的解析结果"""
+    for path in expand_log_paths(spec):
+        yield from parse_log_file(path, service_name, chunk_size, stats, **kwargs)
+
+
+def print_progress(stats):
+    print(f"[progress] {stats}", file=sys.stderr, flush=True)
+
+
+def cmd_stream(args):
+    stats = ParseStats()
+    records = 0
+    for path in expand_log_paths(args.path):
+        for chunk in iter_parsed_chunks(path, args.service, args.chunk_size, stats, progress=print_progress,
+                                        progress_interval=args.progress, log_format=args.log_format):
+            records += len(chunk)
+    print(f"Parsed {records} records from {args.path}")
+    print(stats)
+
+
+def cmd_parallel(args):
+    start = time.perf_counter()
+    agg = parse_log_parallel(args.path, args.workers, args.shards, log_format=args.log_format)
+    elapsed = time.perf_counter() - start
+    size = sum(os.path.getsize(p) for p in expand_log_paths(args.path))
+    print(f"Parsed {agg['records']} records ({agg['errors']} errors) from {args.path}")
+    print(f"elapsed={elapsed:.2f}s {agg['lines'] / elapsed:.0f} lines/s {size / (2 ** 20) / elapsed:.1f} MB/s")
+    print(f"Total bytes sent: {agg['bytes']}")
+    print('Status codes:')
+    for status, count in sorted(agg['status'].items()):
+        print(f"  {status}: {count}")
+    print(f"Top {args.top} IPs:")
+    for ip, count in agg['ips'].most_common(args.top):
+        print(f"  {ip}: {count}")
+
+
+def cmd_columnar(args):
+    stats = ParseStats()
+    columns = parse_log_columnar(args.path, stats=stats, log_format=args.log_format)
+    print(f"Loaded {len(columns)} rows from {args.path}")
+    print(stats)
+    print(f"Columnar memory: {columns.nbytes() / (2 ** 20):.1f} MiB "
+          f"({len(columns.ip.values)} distinct IPs, {len(columns.path.values)} distinct paths)")
+    print(f"Total bytes sent: {columns.total_bytes()}")
+    print('Status codes:')
+    for status, count in sorted(columns.status_histogram().items()):
+        print(f"  {status}: {count}")
+    errors = columns.indices_where(status_min=500)
+    print(f"5xx responses: {len(errors)}, bytes: {columns.total_bytes(errors)}")
+    print(f"Top {args.top} paths:")
+    for path, count in columns.path.counts().most_common(args.top):
+        print(f"  {path}: {count}")
+
+
+def cmd_follow(args):
+    follower = LogFollower(args.path, args.service, args.checkpoint, log_format=args.log_format)
+    chunks = follower.poll() if args.once else follower.follow(args.interval)
+    try:
+        for chunk in chunks:
+            if args.service == 'nginx':
+                status = Counter(record['status'] for record in chunk)
+                print(f"{len(chunk)} new records, status: {dict(sorted(status.items()))}")
+            else:
+                print(f"{len(chunk)} new records")
+    except KeyboardInterrupt:
+        pass
+    print(follower.stats)
+
+
+def cmd_sketch(args):
+    start = time.perf_counter()
+    agg = parse_log_parallel(args.path, args.workers, args.shards, mode='sketch', log_format=args.log_format)
+    elapsed = time.perf_counter() - start
+    print(f"Parsed {agg.records} records ({agg.errors} errors) from {args.path} in {elapsed:.2f}s")
+    print(f"Total bytes sent: {agg.bytes}")
+    print(f"Distinct IPs (estimated): {agg.distinct_ips.count()}")
+    print(f"Top {args.top} IPs (estimated counts):")
+    for ip, count in agg.top_ips.most_common(args.top):
+        print(f"  {ip}: {count}")
+    print(f"Top {args.top} paths (estimated counts):")
+    for path, count in agg.top_paths.most_common(args.top):
+        print(f"  {path}: {count}")
+    print(f"Last {args.minutes} minutes (requests / 5xx):")
+    for minute, requests, errors in agg.per_minute.items()[-args.minutes:]:
+        print(f"  {datetime.fromtimestamp(minute).strftime('%Y-%m-%d %H:%M')}: {requests} / {errors}")
+
+
+def build_route_normalizer(args):
+    try:
+        rules = parse_route_rules(args.route_rule, not args.no_default_route_rules)
+    except (ValueError, re.error) as e:
+        print(f"Invalid --route-rule: {e}", file=sys.stderr)
+        sys.exit(2)
+    return RouteNormalizer(rules, args.route_template or (), args.route_fanout, args.route_cache)
+
+
+def cmd_report(args):
+    names = [name.strip() for name in args.reports.split(',')] if args.reports else None
+    start = time.perf_counter()
+    engine = run_reports(args.path, names, args.top, args.workers, args.shards, args.log_format,
+                         build_route_normalizer(args))
+    elapsed = time.perf_counter() - start
+    report = engine.to_json() if args.format == 'json' else engine.to_text()
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(report + '\n')
+    else:
+        print(report)
+    print(f"{len(engine.reports)} reports from {engine.lines} lines in one pass, {elapsed:.2f}s", file=sys.stderr)
+
+
+def cmd_latency(args):
+    report = None
+    if args.path:
+        start = time.perf_counter()
+        engine = run_reports(args.path, ['latency'], args.top, args.workers, args.shards, args.log_format,
+                             build_route_normalizer(args))
+        report = engine.reports['latency']
+        print(f"Parsed {engine.records} records ({engine.errors} errors) from {args.path} "
+              f"in {time.perf_counter() - start:.2f}s", file=sys.stderr)
+    for path in args.merge or []:
+        with open(path) as f:
+            other = LatencyReport.from_dict(json.load(f), args.top)
+        report = other if report is None else report.merge(other)
+    if report is None:
+        print('Nothing to report: give a log path or --merge files', file=sys.stderr)
+        sys.exit(2)
+    report.top = args.top
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(report.to_dict(), f)
+    if args.format == 'json':
+        print(json.dumps(report.result(), indent=2, ensure_ascii=False))
+    else:
+        print('\n'.join(report.text(args.minutes)))
+
+
+def benchmark(praser, lines, repeat=3):
+    """返回解析器在给定行上的最佳吞吐量 (lines/s) 和解析失败的行数"""
+    best = 0.0
+    errors = 0
+    for _ in range(repeat):
+        errors = 0
+        start = time.perf_counter()
+        for line in lines:
+            try:
+                praser(line)
+            except (IndexError, ValueError):
+                errors += 1
+        elapsed = time.perf_counter() - start
+        best = max(best, len(lines) / elapsed if elapsed > 0 else 0.0)
+    return best, errors
+
+
+def read_sample_lines(path, limit):
+    lines = []
+    for raw in iter_log_lines(path):
+        if raw:
+            lines.append(raw.decode('utf-8', 'replace'))
+            if len(lines) >= limit:
+                break
+    return lines
+
+
+def extract_timestamps(lines, service_name):
+    """从日志行中取出时间戳字符串: nginx 的 [$time_local]，syslog 的 RFC 3164 / 5424 时间戳"""
+    stamps = []
+    for line in lines:
+        if service_name == 'nginx':
+            i = line.find('[')
+            j = line.find(']', i + 1)
+            if i >= 0 and j >= 0:
+                stamps.append(line[i + 1:j])
+            continue
+        m = RFC5424_PATTERN.match(line) if line.startswith('<') else None
+        if m is not None:
+            stamps.append(m.group('timestamp'))
+            continue
+        m = RFC3164_PATTERN.match(line)
+        if m is not None:
+            stamps.append(line[m.start('month'):m.end('time')])
+    return stamps
+
+
+def make_syslog_time_strptime(year):
+    def syslog_time_strptime(stamp):
+        if stamp[:1].isdigit():
+            return rfc5424_time_to_epoch_isoformat(stamp)
+        fmt = '%Y %b %d %H:%M:%S' if stamp.count(':') == 2 else '%Y %b %d %H:%M'
+        return int(time.mktime(time.strptime(f'{year} {stamp}', fmt)))
+    return syslog_time_strptime
+
+
+def make_syslog_time_decoder(year):
+    decode_3164 = make_rfc3164_time_decoder(lambda month: year)
+    decode_5424 = make_rfc5424_time_decoder()
+
+    def syslog_time_to_epoch(stamp):
+        return decode_5424(stamp) if stamp[:1].isdigit() else decode_3164(stamp)
+    return syslog_time_to_epoch
+
+
+def bench_timestamps(args):
+    if args.path:
+        lines = read_sample_lines(args.path, args.lines)
+    elif args.service == 'nginx':
+        # 每秒 200 行，和 log-parser-benchmark.py 生成的测试日志一样
+        lines = [time.strftime('[%d/%b/%Y:%H:%M:%S +0800]', time.gmtime(1914211638 + i // 200))
+                 for i in range(args.lines)]
+    else:
+        lines = [time.strftime('%b %d %H:%M:%S', time.gmtime(1914211638 + i // 50)) + ' myhost cron[1]: x'
+                 for i in range(args.lines)]
+    stamps = extract_timestamps(lines, args.service)
+    distinct = list(dict.fromkeys(stamps))
+    print(f"Benchmarking {len(stamps)} {args.service} timestamps ({len(distinct)} distinct)")
+    year = datetime.now().year
+    if args.service == 'nginx':
+        baseline, make_decoder = nginx_time_to_epoch_strptime, make_nginx_time_decoder
+    else:
+        baseline, make_decoder = make_syslog_time_strptime(year), lambda: make_syslog_time_decoder(year)
+    base_rate, _ = benchmark(baseline, stamps)
+    print(f"  {'strptime':<24} {base_rate:>12.0f} stamps/s")
+    for name, sample in (('decoder', stamps), ('decoder (each once)', distinct)):
+        rate, errors = benchmark(make_decoder(), sample)
+        print(f"  {name:<24} {rate:>12.0f} stamps/s  {rate / base_rate:>6.1f}x  errors={errors}")
+
+    # 核对结果：两种实现对每个时间戳给出相同的值（或者都报错）
+    decoder = make_decoder()
+    mismatched = 0
+    for stamp in stamps:
+        results = []
+        for func in (baseline, decoder):
+            try:
+                results.append(func(stamp))
+            except ValueError:
+                results.append(None)
+        mismatched += results[0] != results[1]
+    print(f"  results differ on {mismatched} timestamps")
+
+
+def cmd_bench(args):
+    if args.timestamps:
+        return bench_timestamps(args)
+    if args.service == 'syslog':
+        return bench_syslog(args)
+    if args.path:
+        lines = read_sample_lines(args.path, args.lines)
+    else:
+        sample = ('192.168.40.80 - - [30/Aug/2030:11:27:18 +0800] "GET /index.html HTTP/1.1" 200 3429 '
+                  '"https://example.com/" "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36" "-"')
+        lines = [sample] * args.lines
+    print(f"Benchmarking {len(lines)} lines")
+
+    split_praser = make_log_praser('nginx')
+    format_praser = make_format_praser(args.log_format or NGINX_MAIN_FORMAT)
+    for name, praser in (('split (nginx_praser)', split_praser), ('log_format (regex)', format_praser)):
+        rate, errors = benchmark(praser, lines)
+        print(f"  {name:<24} {rate:>12.0f} lines/s  errors={errors}")
+
+    # 对比字段：user_agent 中带空格时 split 方式会错位
+    mismatched = 0
+    for line in lines:
+        try:
+            if split_praser(line)['user_agent'] != format_praser(line).get('user_agent'):
+                mismatched += 1
+        except (IndexError, ValueError):
+            mismatched += 1
+    print(f"  user_agent differs between parsers on {mismatched} lines")
+
+
+def bench_syslog(args):
+    if args.path:
+        lines = read_sample_lines(args.path, args.lines)
+    else:
+        sample = 'Aug 30 18:08:01 myhost sshd[1234]: Accepted password for user from 192.168.1.2 port 22 ssh2'
+        lines = [sample] * args.lines
+    print(f"Benchmarking {len(lines)} lines")
+    for name, praser in (('messages_praser', make_log_praser('messages')), ('syslog (precompiled)', make_syslog_praser())):
+        rate, errors = benchmark(praser, lines)
+        print(f"  {name:<24} {rate:>12.0f} lines/s  errors={errors}")
+
+
+def parse_time_arg(value):
+    """命令行时间参数：Unix 时间戳或 '2030-08-30 14:02[:00]' 形式的本地时间"""
+    if value.isdigit():
+        return int(value)
+    return int(datetime.fromisoformat(value).timestamp())
+
+
+def cmd_query(args):
+    try:
+        parse_query(args.expression)
+    except ValueError as e:
+        print(f"Invalid query: {e}", file=sys.stderr)
+        sys.exit(2)
+    stats = ParseStats()
+    praser = make_log_praser('nginx', args.log_format) if args.json else None
+    matched = 0
+    out = sys.stdout.buffer
+    for path in expand_log_paths(args.path):
+        for raw in query_log(path, args.expression, args.log_format, not args.no_pushdown, args.index, stats):
+            matched += 1
+            if args.count:
+                continue
+            if praser is not None:
+                # 只解析命中的行
+                try:
+                    record = praser(raw.decode('utf-8', 'replace'))
+                except (IndexError, ValueError):
+                    continue
+                out.write(json.dumps(record, ensure_ascii=False).encode() + b'\n')
+            else:
+                out.write(raw + b'\n')
+    out.flush()
+    print(f"{matched} matching lines", file=sys.stderr)
+    print(stats, file=sys.stderr)
+
+
+def cmd_index(args):
+    start = time.perf_counter()
+    index = build_time_index(args.path, args.bucket, args.index, args.service)
+    elapsed = time.perf_counter() - start
+    print(f"Indexed {index.indexed_size} bytes into {len(index.buckets)} buckets "
+          f"of {index.bucket_seconds}s in {elapsed:.2f}s")
+
+
+def cmd_window(args):
+    start = time.perf_counter()
+    lines = 0
+    for line in query_time_range(args.path, parse_time_arg(args.start), parse_time_arg(args.end),
+                                 args.index, args.service, args.bucket):
+        lines += 1
+        if not args.count:
+            sys.stdout.buffer.write(line + b'\n')
+    sys.stdout.flush()
+    elapsed = time.perf_counter() - start
+    print(f"{lines} lines in window ({elapsed:.3f}s)", file=sys.stderr)
+
+
+def demo():
     nginx_log_praser = make_log_praser('nginx')
     messages_log_praser = make_log_praser('messages')
 
@@ -137,4 +2935,133 @@ if __name__=='__main__':
     messages_log = 'Aug 30 18:08 myhost sshd[1234]: Accepted password for user from 192.168.1.2 port 22 ssh2'
 
     print(nginx_log_praser(nginx_log))
-    print(messages_log_praser(messages_log))
\ No newline at end of file
+    print(messages_log_praser(messages_log))
+
+
+def add_route_arguments(p):
+    p.add_argument('--route-template', action='append', default=None,
+                   help="known route template, e.g. /api/orders/:order (repeatable)")
+    p.add_argument('--route-rule', action='append', default=None,
+                   help="extra segment rule name=REGEX, a matching segment becomes :name (repeatable)")
+    p.add_argument('--no-default-route-rules', action='store_true', help='do not collapse numeric / UUID / hash segments')
+    p.add_argument('--route-fanout', type=int, default=100,
+                   help='distinct literal segments under one path prefix before new ones become * (default: 100)')
+    p.add_argument('--route-cache', type=int, default=65536, help='LRU cache size for normalized paths')
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description='Nginx / messages log analysis')
+    sub = parser.add_subparsers(dest='command')
+
+    p = sub.add_parser('stream', help='stream-parse a log file with mmap and report throughput')
+    p.add_argument('path', help='log file, glob pattern or directory')
+    p.add_argument('--service', default='nginx', choices=['nginx', 'messages', 'syslog'])
+    p.add_argument('--chunk-size', type=int, default=10000)
+    p.add_argument('--progress', type=float, default=5.0, help='seconds between progress reports')
+    p.add_argument('--log-format', default=None, help='nginx log_format string (default: split-based parser)')
+    p.set_defaults(func=cmd_stream)
+
+    p = sub.add_parser('parallel', help='parse large nginx logs with a process pool')
+    p.add_argument('path', help='log file, glob pattern or directory')
+    p.add_argument('--workers', type=int, default=None, help='worker processes (default: CPU count)')
+    p.add_argument('--shards', type=int, default=None, help='byte-range shards (default: workers * 4)')
+    p.add_argument('--top', type=int, default=10)
+    p.add_argument('--log-format', default=None, help='nginx log_format string (default: split-based parser)')
+    p.set_defaults(func=cmd_parallel)
+
+    p = sub.add_parser('columnar', help='load an nginx log into typed columns and summarize it')
+    p.add_argument('path')
+    p.add_argument('--top', type=int, default=10)
+    p.add_argument('--log-format', default=None, help='nginx log_format string (default: split-based parser)')
+    p.set_defaults(func=cmd_columnar)
+
+    p = sub.add_parser('follow', help='parse only new lines since the last checkpoint')
+    p.add_argument('path')
+    p.add_argument('--service', default='nginx', choices=['nginx', 'messages', 'syslog'])
+    p.add_argument('--checkpoint', default=None, help='checkpoint file (default: <path>.ckpt)')
+    p.add_argument('--once', action='store_true', help='read new lines once and exit (for cron)')
+    p.add_argument('--interval', type=float, default=1.0, help='poll interval in follow mode')
+    p.add_argument('--log-format', default=None, help='nginx log_format string (default: split-based parser)')
+    p.set_defaults(func=cmd_follow)
+
+    p = sub.add_parser('sketch', help='fixed-memory distinct/top-K/per-minute aggregates')
+    p.add_argument('path', help='log file, glob pattern or directory')
+    p.add_argument('--workers', type=int, default=None, help='worker processes (default: CPU count)')
+    p.add_argument('--shards', type=int, default=None, help='byte-range shards (default: workers * 4)')
+    p.add_argument('--top', type=int, default=10)
+    p.add_argument('--minutes', type=int, default=10, help='number of recent minutes to print')
+    p.add_argument('--log-format', default=None, help='nginx log_format string (default: split-based parser)')
+    p.set_defaults(func=cmd_sketch)
+
+    p = sub.add_parser('index', help='build or update the time index sidecar file')
+    p.add_argument('path')
+    p.add_argument('--service', default='nginx', choices=['nginx', 'syslog'])
+    p.add_argument('--bucket', type=int, default=60, help='bucket size in seconds')
+    p.add_argument('--index', default=None, help='index file (default: <path>.tidx)')
+    p.set_defaults(func=cmd_index)
+
+    p = sub.add_parser('window', help='print lines in a time window using the time index')
+    p.add_argument('path')
+    p.add_argument('--start', required=True, help="epoch seconds or local time like '2030-08-30 14:02'")
+    p.add_argument('--end', required=True, help="epoch seconds or local time like '2030-08-30 14:07'")
+    p.add_argument('--service', default='nginx', choices=['nginx', 'syslog'])
+    p.add_argument('--bucket', type=int, default=60, help='bucket size in seconds')
+    p.add_argument('--index', default=None, help='index file (default: <path>.tidx)')
+    p.add_argument('--count', action='store_true', help='only count matching lines')
+    p.set_defaults(func=cmd_window)
+
+    p = sub.add_parser('report', help='compute several reports in a single pass over nginx logs')
+    p.add_argument('path', help='log file, glob pattern or directory')
+    p.add_argument('--reports', default=None, help=f"comma separated reports (default: all of {','.join(REPORTS)})")
+    p.add_argument('--top', type=int, default=20)
+    p.add_argument('--format', default='text', choices=['text', 'json'])
+    p.add_argument('--output', default=None, help='write the report to this file instead of stdout')
+    p.add_argument('--workers', type=int, default=1, help='worker processes (default: 1, no process pool)')
+    p.add_argument('--shards', type=int, default=None, help='byte-range shards (default: workers * 4)')
+    p.add_argument('--log-format', default=NGINX_COMBINED_FORMAT,
+                   help='nginx log_format string (default: combined, which also matches main-format lines)')
+    add_route_arguments(p)
+    p.set_defaults(func=cmd_report)
+
+    p = sub.add_parser('query', help='filter nginx logs on raw bytes before parsing')
+    p.add_argument('path', help='log file, glob pattern or directory')
+    p.add_argument('expression', help="e.g. 'status>=500 and path^=/api/ and ip^=10.0. and time>=2030-08-30T14:00'")
+    p.add_argument('--count', action='store_true', help='only count matching lines')
+    p.add_argument('--json', action='store_true', help='print matching lines as parsed JSON records')
+    p.add_argument('--no-pushdown', action='store_true', help='parse every line first, then filter (for comparison)')
+    p.add_argument('--index', default=None, help='time index file used to seek to time>= (default: <path>.tidx)')
+    p.add_argument('--log-format', default=None, help='nginx log_format string (default: split-based parser)')
+    p.set_defaults(func=cmd_query)
+
+    p = sub.add_parser('latency', help='request_time / upstream_response_time percentiles per route and minute')
+    p.add_argument('path', nargs='?', default=None, help='log file, glob pattern or directory')
+    p.add_argument('--merge', nargs='+', default=None, help='histogram files saved with --save (other shards or hosts)')
+    p.add_argument('--save', default=None, help='save the mergeable histograms to this JSON file')
+    p.add_argument('--top', type=int, default=20, help='routes to show')
+    p.add_argument('--minutes', type=int, default=30, help='most recent minutes to show')
+    p.add_argument('--format', default='text', choices=['text', 'json'])
+    p.add_argument('--workers', type=int, default=1, help='worker processes (default: 1, no process pool)')
+    p.add_argument('--shards', type=int, default=None, help='byte-range shards (default: workers * 4)')
+    p.add_argument('--log-format', default=NGINX_TIMED_FORMAT,
+                   help='nginx log_format containing $request_time (default: main + $request_time $upstream_response_time)')
+    add_route_arguments(p)
+    p.set_defaults(func=cmd_latency)
+
+    p = sub.add_parser('bench', help='compare split-based and log_format-compiled nginx parsers')
+    p.add_argument('path', nargs='?', default=None, help='sample lines from this log (default: synthetic line)')
+    p.add_argument('--lines', type=int, default=200000)
+    p.add_argument('--service', default='nginx', choices=['nginx', 'syslog'])
+    p.add_argument('--log-format', default=None, help='nginx log_format string (default: main format)')
+    p.add_argument('--timestamps', action='store_true', help='compare strptime with the cached timestamp decoders')
+    p.set_defaults(func=cmd_bench)
+
+    return parser
+
+
+if __name__=='__main__':
+    args = build_arg_parser().parse_args()
+    # 不带子命令时保持原来的演示行为
+    if args.command is None:
+        demo()
+    else:
+        args.func(args)
@@ -4,22 +4,49 @@
 日志文件 IP 地址提取脚本
 
 功能描述:
-    本脚本用于从日志文件中提取所有的 IPv4 地址。通过正则表达式匹配标准的 IP 地址格式，
-    快速识别和提取日志中的 IP 信息，支持各种日志格式的 IP 地址解析。
+    本脚本用于从日志文件中提取 IP 地址。通过正则表达式匹配标准的 IP 地址格式，
+    快速识别和提取日志中的 IP 信息，支持各种日志格式的 IP 地址解析，并可以对 IP
+    去重、统计出现次数、输出访问最多的 Top N，用于访问统计和攻击来源分析。
 
 技术实现:
     - 使用 re 模块进行正则表达式匹配
-    - 采用预编译正则表达式提高匹配效率
-    - 使用 findall() 方法获取所有匹配结果
-    - 文件读取采用上下文管理器确保资源释放
+    - 采用预编译的 bytes 正则表达式，直接在 mmap 映射的文件上分块匹配，不解码、不读入整个文件
+    - 每块处理完后 madvise(MADV_DONTNEED) 归还已读过的页，内存占用与文件大小无关
+    - .gz / .bz2 / .xz 压缩文件边读边解压，按块匹配，不需要先解压到磁盘
+    - 参数可以是文件、glob 通配符或目录，多个文件按时间从旧到新处理，
+      --workers 大于 1 时多个文件在进程池中并行统计
+    - 计数使用 Counter.update(findall(...))，在 C 层完成累加，只保存不同的 IP
+
+用法:
+    python3 prase-IP-from-logs.py '/var/log/nginx/access.log*'            # 按顺序输出所有 IP
+    python3 prase-IP-from-logs.py access.log --unique                    # 去重输出
+    python3 prase-IP-from-logs.py access.log --top 20 --workers 4        # 访问最多的 20 个 IP
+    python3 prase-IP-from-logs.py access.log --min-count 1000 --ipv6     # 出现至少 1000 次的 IPv4/IPv6
+    python3 prase-IP-from-logs.py access.log --group-by 24 --top 20      # 按 /24 网段汇总
+    python3 prase-IP-from-logs.py access.log --deny blocklist.txt        # 命中黑名单各网段的次数
+    python3 prase-IP-from-logs.py access.log --allow whitelist.txt --group-by 24 --min-count 1000
+                                                                         # 生成封禁网段列表
+
+网段汇总与前缀树:
+    IP 先转换成整数（IPv4 32 位、IPv6 128 位），网段汇总只需要右移取前缀。
+    --allow / --deny 读取每行一个 CIDR 的名单文件（# 开头为注释），构建二进制前缀树(PrefixTrie)，
+    每个 IP 的最长前缀匹配最多走 32 / 128 步，与名单长度无关，不需要逐对比较：
+        - --allow: 白名单中的 IP 不参与统计和输出
+        - --deny: 输出黑名单中每个网段被命中的次数
+        - --group-by / --group-by-v6: 按指定前缀长度汇总（默认 IPv6 为 /64）
 
 正则表达式详解:
-    模式: r'\\b(?:[0-9]{1,3}\\.){3}[0-9]{1,3}\\b'
-    - \\b: 单词边界，确保匹配完整的 IP 地址
-    - (?:[0-9]{1,3}): 非捕获组，匹配1-3位数字
-    - \\.: 匹配点号分隔符
-    - {3}: 重复3次，匹配前三个数字段
-    - [0-9]{1,3}: 匹配最后一个数字段
+    IPv4 模式: \\b(?<![0-9]\\.)[0-9]{1,3}\\.[0-9]{1,3}\\.[0-9]{1,3}\\.[0-9]{1,3}\\b(?!\\.[0-9])
+    - \\b 开头让正则引擎只在单词边界处尝试匹配，比逐字符做断言快得多
+    - 前后的断言保证不会从更长的数字串（如 1.2.3.4.5）中截取一段
+    - 正则只做宽松匹配，再校验每段在 0-255 且没有前导零，999.1.1.1、01.2.3.4 会被丢弃；
+      统计模式下只对去重后的候选校验，代价与不同 IP 的数量成正比
+    IPv6 模式（--ipv6）: 同样先用宽松的模式找出候选，再用 ipaddress 模块校验，
+    11:27:18 这类时间不会被误判为 IPv6 地址
+    - 候选前后不能紧挨字母数字，且至少含一个十六进制数字：Foo::Bar、单独的 :: 不算地址
+    - 允许以点分 IPv4 结尾（::ffff:10.0.0.1）；IPv4 映射地址按其中的 IPv4 地址统计，
+      加上 --ipv6 不会改变 IPv4 的统计结果
+    - 其余地址统一输出为标准写法，2001:DB8::1、2001:0db8:0:0::1 都按 2001:db8::1 统计
 
 IP 地址格式:
     IPv4 地址标准格式: XXX.XXX.XXX.XXX
@@ -28,12 +55,341 @@ IP 地址格式:
     - 总长度: 7-15 个字符
 """
 
-import re
-log_file = './example.txt'
-#读取日志文件
-with open(log_file, 'r') as f:
-    logs = f.read()
-    ip_pattern = re.compile(r'\b(?:[0-9]{1,3}\.){3}[0-9]{1,3}\b')
-    ips = ip_pattern.findall(logs)
-    for ip in ips:
-        print(ip)
\ No newline at end of file
+import re, os, sys, bz2, glob, gzip, lzma, mmap, socket, argparse, ipaddress
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+IPV4 = rb'\b(?<![0-9]\.)[0-9]{1,3}\.[0-9]{1,3}\.[0-9]{1,3}\.[0-9]{1,3}\b(?!\.[0-9])'
+IPV6_CANDIDATE = (rb'(?<![0-9A-Za-z:])(?=[0-9A-Fa-f:.]*[0-9A-Fa-f])'
+                  rb'(?:(?:[0-9A-Fa-f]{0,4}:){2,6}[0-9]{1,3}(?:\.[0-9]{1,3}){3}'
+                  rb'|(?:[0-9A-Fa-f]{0,4}:){2,7}[0-9A-Fa-f]{0,4})'
+                  rb'(?![0-9A-Za-z:]|\.[0-9])')
+
+ipv4_pattern = re.compile(IPV4)
+ip_pattern = re.compile(IPV4 + rb'|' + IPV6_CANDIDATE)
+
+# 每次匹配的块大小
+CHUNK_SIZE = 64 * 1024 * 1024
+
+# COMPRESSED_OPENERS、ROTATION_SUFFIX 和 expand_log_paths 与 nginx-log-analysis.py 中的相同：
+# 每个脚本都要能单独复制到服务器上运行，所以不抽成共享模块，由 tests/test_shared_copies.py 检查两份一致
+COMPRESSED_OPENERS = {
+    '.gz': gzip.open,
+    '.bz2': bz2.open,
+    '.xz': lzma.open,
+}
+
+# 匹配 access.log.30 / access.log.30.gz 中的轮替序号
+ROTATION_SUFFIX = re.compile(r'\.(\d+)(?:\.(?:gz|bz2|xz))?$')
+
+
+def expand_log_paths(spec):
+    """把文件、glob 通配符或目录展开成日志文件列表，按时间从旧到新排序"""
+    if os.path.isdir(spec):
+        paths = [entry.path for entry in os.scandir(spec) if entry.is_file()]
+    else:
+        paths = [p for p in glob.glob(spec) if os.path.isfile(p)]
+
+    def sort_key(path):
+        match = ROTATION_SUFFIX.search(path)
+        # 修改时间相同时，轮替序号越大越旧
+        return os.path.getmtime(path), -int(match.group(1)) if match else 0
+
+    return sorted(paths, key=sort_key)
+
+
+def iter_mmap_chunks(path, chunk_size=CHUNK_SIZE):
+    """把文件映射到内存，产出 (mmap, start, end) 块，块边界对齐到换行符"""
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if hasattr(mm, 'madvise'):
+                mm.madvise(mmap.MADV_SEQUENTIAL)
+            start = 0
+            while start < size:
+                end = min(start + chunk_size, size)
+                if end < size:
+                    nl = mm.find(b'\n', end)
+                    end = size if nl == -1 else nl + 1
+                yield mm, start, end
+                # 已经匹配过的页不会再用到，归还给操作系统
+                if hasattr(mm, 'madvise'):
+                    upto = end - end % mmap.PAGESIZE
+                    released = start - start % mmap.PAGESIZE
+                    if upto > released:
+                        mm.madvise(mmap.MADV_DONTNEED, released, upto - released)
+                start = end
+
+
+def iter_compressed_chunks(path, chunk_size=CHUNK_SIZE):
+    """边解压边产出 (bytes, 0, len) 块，块边界对齐到换行符"""
+    opener = COMPRESSED_OPENERS[os.path.splitext(path)[1]]
+    rest = b''
+    with opener(path, 'rb') as f:
+        while True:
+            data = f.read(chunk_size)
+            if not data:
+                break
+            data = rest + data
+            nl = data.rfind(b'\n')
+            if nl == -1:
+                rest = data
+                continue
+            rest = data[nl + 1:]
+            yield data, 0, nl + 1
+    if rest:
+        yield rest, 0, len(rest)
+
+
+def iter_chunks(path, chunk_size=CHUNK_SIZE):
+    if os.path.splitext(path)[1] in COMPRESSED_OPENERS:
+        return iter_compressed_chunks(path, chunk_size)
+    return iter_mmap_chunks(path, chunk_size)
+
+
+@lru_cache(maxsize=65536)
+def is_valid_ipv4(candidate):
+    # 每段 0-255，且不允许 01 这样的前导零
+    for octet in candidate.split(b'.'):
+        if len(octet) > 1 and (octet[0] == 0x30 or int(octet) > 255):
+            return False
+    return True
+
+
+@lru_cache(maxsize=65536)
+def normalize_ipv6(candidate):
+    """校验 IPv6 候选，不合法时返回 None，否则返回标准写法（小写、压缩零段）；
+    点分形式的 IPv4 映射地址返回其中的 IPv4 地址"""
+    try:
+        address = ipaddress.IPv6Address(candidate.decode('ascii'))
+    except ValueError:
+        return None
+    if b'.' in candidate and address.ipv4_mapped is not None:
+        return str(address.ipv4_mapped).encode('ascii')
+    return str(address).encode('ascii')
+
+
+def normalize_ip(match):
+    """返回用于输出和统计的地址（bytes），不是合法 IP 时返回 None"""
+    if b':' in match:
+        return normalize_ipv6(match)
+    return match if is_valid_ipv4(match) else None
+
+
+def extract_ips(path, ipv6=False):
+    """按出现顺序产出日志文件中的 IP 地址（bytes）"""
+    pattern = ip_pattern if ipv6 else ipv4_pattern
+    for buffer, start, end in iter_chunks(path):
+        for match in pattern.findall(buffer, start, end):
+            ip = normalize_ip(match)
+            if ip is not None:
+                yield ip
+
+
+def count_ips(path, ipv6=False):
+    """统计单个日志文件中每个 IP 出现的次数，返回以 bytes 为键的 Counter"""
+    pattern = ip_pattern if ipv6 else ipv4_pattern
+    counts = Counter()
+    for buffer, start, end in iter_chunks(path):
+        counts.update(pattern.findall(buffer, start, end))
+    # 只对去重后的候选做校验，代价与不同 IP 的数量成正比
+    for candidate in list(counts):
+        ip = normalize_ip(candidate)
+        if ip != candidate:
+            count = counts.pop(candidate)
+            if ip is not None:
+                counts[ip] += count
+    return counts
+
+
+def _count_ips_task(task):
+    # 在子进程中运行，只把计数结果返回给主进程
+    path, ipv6 = task
+    return count_ips(path, ipv6)
+
+
+def count_ips_in_files(log_files, ipv6=False, workers=1):
+    """统计多个日志文件中的 IP，workers 大于 1 时按文件并行"""
+    total = Counter()
+    tasks = [(path, ipv6) for path in log_files]
+    if workers > 1 and len(log_files) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for counts in executor.map(_count_ips_task, tasks):
+                total.update(counts)
+    else:
+        for task in tasks:
+            total.update(_count_ips_task(task))
+    return total
+
+
+ADDRESS_BITS = {4: 32, 6: 128}
+
+
+def ip_to_key(ip):
+    """把 IP（bytes）转换成 (版本, 整数地址, 前缀长度) 形式的键"""
+    if b':' in ip:
+        return 6, int.from_bytes(socket.inet_pton(socket.AF_INET6, ip.decode('ascii')), 'big'), 128
+    return 4, int.from_bytes(socket.inet_aton(ip.decode('ascii')), 'big'), 32
+
+
+def format_key(key):
+    version, address, prefixlen = key
+    network = ipaddress.ip_network((address, prefixlen)) if version == 4 else ipaddress.IPv6Network((address, prefixlen))
+    # 单个地址不带 /32、/128 后缀
+    return str(network.network_address) if prefixlen == ADDRESS_BITS[version] else str(network)
+
+
+def to_key_counts(counts):
+    """把以 IP 字符串为键的计数转换成以 (版本, 整数地址, 前缀长度) 为键的计数"""
+    key_counts = Counter()
+    for ip, count in counts.items():
+        # 同一地址的不同写法会得到相同的键，计数要累加
+        key_counts[ip_to_key(ip)] += count
+    return key_counts
+
+
+def prefix_length(bits):
+    """argparse 类型：0 到 bits 之间的前缀长度"""
+    def parse(value):
+        length = int(value)
+        if not 0 <= length <= bits:
+            raise argparse.ArgumentTypeError(f"prefix length must be between 0 and {bits}: {value}")
+        return length
+    return parse
+
+
+def rollup(key_counts, v4_prefix=24, v6_prefix=64):
+    """按前缀长度汇总到网段"""
+    prefixes = {4: v4_prefix, 6: v6_prefix}
+    result = Counter()
+    for (version, address, prefixlen), count in key_counts.items():
+        target = min(prefixes[version], prefixlen)
+        shift = ADDRESS_BITS[version] - target
+        result[(version, address >> shift << shift, target)] += count
+    return result
+
+
+class PrefixTrie:
+    """IPv4 / IPv6 二进制前缀树，支持最长前缀匹配"""
+
+    def __init__(self):
+        # 每个节点为 [0 分支, 1 分支, 网段键]
+        self.roots = {4: [None, None, None], 6: [None, None, None]}
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def insert(self, cidr):
+        network = ipaddress.ip_network(cidr.strip(), strict=False)
+        version = network.version
+        bits = ADDRESS_BITS[version]
+        address = int(network.network_address)
+        node = self.roots[version]
+        for i in range(network.prefixlen):
+            bit = (address >> (bits - 1 - i)) & 1
+            child = node[bit]
+            if child is None:
+                child = node[bit] = [None, None, None]
+            node = child
+        if node[2] is None:
+            self.size += 1
+        node[2] = (version, address, network.prefixlen)
+
+    @classmethod
+    def from_file(cls, path):
+        """从每行一个 CIDR 的文件构建前缀树，忽略空行和 # 注释"""
+        trie = cls()
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.split('#', 1)[0].strip()
+                if line:
+                    trie.insert(line)
+        return trie
+
+    def lookup(self, version, address):
+        """返回包含该地址的最长前缀（网段键），没有命中时返回 None"""
+        bits = ADDRESS_BITS[version]
+        node = self.roots[version]
+        match = node[2]
+        for i in range(bits - 1, -1, -1):
+            node = node[(address >> i) & 1]
+            if node is None:
+                break
+            if node[2] is not None:
+                match = node[2]
+        return match
+
+    def filter_out(self, key_counts):
+        """批量去掉命中前缀树的地址（白名单过滤）"""
+        lookup = self.lookup
+        return Counter({key: count for key, count in key_counts.items() if lookup(key[0], key[1]) is None})
+
+    def count_hits(self, key_counts):
+        """批量统计前缀树中每个网段命中的次数（黑名单命中统计）"""
+        lookup = self.lookup
+        hits = Counter()
+        for (version, address, _), count in key_counts.items():
+            prefix = lookup(version, address)
+            if prefix is not None:
+                hits[prefix] += count
+        return hits
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Extract IP addresses from log files')
+    parser.add_argument('paths', nargs='*', default=['./example.txt'], help='log files, glob patterns or directories')
+    parser.add_argument('--workers', type=int, default=1, help='process multiple files in parallel')
+    parser.add_argument('--ipv6', action='store_true', help='also extract IPv6 addresses')
+    parser.add_argument('--unique', action='store_true', help='print each distinct IP once')
+    parser.add_argument('--top', type=int, default=None, help='print the N most frequent IPs with counts')
+    parser.add_argument('--min-count', type=int, default=None, help='print IPs seen at least this many times')
+    parser.add_argument('--group-by', type=prefix_length(32), default=None,
+                        help='aggregate IPv4 addresses to this prefix length (0-32)')
+    parser.add_argument('--group-by-v6', type=prefix_length(128), default=64,
+                        help='IPv6 prefix length used with --group-by (0-128)')
+    parser.add_argument('--allow', default=None, help='file of CIDRs to exclude from the results')
+    parser.add_argument('--deny', default=None, help='file of CIDRs; print hit counts per listed prefix')
+    args = parser.parse_args()
+
+    log_files = [path for spec in args.paths for path in expand_log_paths(spec)]
+    out = sys.stdout.buffer
+
+    if args.group_by is not None or args.allow or args.deny:
+        counts = count_ips_in_files(log_files, args.ipv6, args.workers)
+        key_counts = to_key_counts(counts)
+        if args.allow:
+            key_counts = PrefixTrie.from_file(args.allow).filter_out(key_counts)
+        if args.deny:
+            key_counts = PrefixTrie.from_file(args.deny).count_hits(key_counts)
+        elif args.group_by is not None:
+            key_counts = rollup(key_counts, args.group_by, args.group_by_v6)
+        selected = key_counts.most_common(args.top)
+        if args.min_count is not None:
+            selected = [(key, count) for key, count in selected if count >= args.min_count]
+        for key, count in selected:
+            out.write(f"{format_key(key)}\n".encode() if args.unique else f"{format_key(key)} {count}\n".encode())
+        print(f"{len(counts)} distinct IPs, {len(key_counts)} result entries", file=sys.stderr)
+    elif args.unique or args.top is not None or args.min_count is not None:
+        counts = count_ips_in_files(log_files, args.ipv6, args.workers)
+        if args.top is not None:
+            selected = counts.most_common(args.top)
+        else:
+            selected = counts.items()
+        if args.min_count is not None:
+            selected = [(ip, count) for ip, count in selected if count >= args.min_count]
+        for ip, count in selected:
+            if args.unique and args.top is None and args.min_count is None:
+                out.write(ip + b'\n')
+            else:
+                out.write(b'%s %d\n' % (ip, count))
+        print(f"{len(counts)} distinct IPs, {sum(counts.values())} occurrences", file=sys.stderr)
+    else:
+        # 不做统计时按出现顺序流式输出，不在内存中保留任何结果
+        for log_file in log_files:
+            for ip in extract_ips(log_file, args.ipv6):
+                out.write(ip + b'\n')
+    out.flush()
@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+外部进程日志轮替脚本（改名 + 通知重新打开）
+
+功能描述:
+    log-rotate.py 只能轮替 Python 自己写的日志。nginx、tomcat 等外部进程的日志
+    如果用 copytruncate 方式轮替，需要把几 GB 的文件完整复制一遍，I/O 翻倍，
+    并且复制和截断之间写入的日志会丢失。
+    本脚本采用“改名 + 通知重新打开”的方式:
+    1. 把正在写的日志文件改名为 access.log.20250704-143025（同一文件系统内 rename，没有数据复制）
+    2. 通知写日志的进程重新打开日志文件：nginx 读取 pid 文件发送 USR1，
+       其它程序可以指定信号或者一条命令（例如 'nginx -s reopen'）
+    3. 等待所有进程关闭旧文件的文件描述符（扫描 /proc/*/fd），确保不会再有写入
+    4. 在后台进程中把旧文件压缩为 .gz / .xz，并按 --keep 清理更早的分段
+
+技术实现:
+    - os.rename(): 原子改名，进程持有的 fd 仍然指向原 inode，改名期间写入的日志不会丢失
+    - os.kill(pid, signal.SIGUSR1) 或 subprocess.run(command): 通知进程重新打开日志；
+      通知失败时把文件改回原名，避免进程继续写一个已改名的文件
+    - 通过 (st_dev, st_ino) 识别旧文件，os.stat('/proc/<pid>/fd/<n>') 检查是否还有进程打开它
+    - 压缩在 ProcessPoolExecutor 中执行，子进程调低优先级(os.nice)，哪个文件先被关闭就先压缩哪个；
+      先写临时文件再改名，压缩文件保留原文件的修改时间和权限
+    - --detach: 发送信号后 fork 到后台等待和压缩，脚本本身立即返回（适合 cron）
+    - 空文件默认不轮替；超时仍未关闭的文件只改名不压缩，避免压缩过程中丢失写入；
+      没有权限查看其它进程的 fd（非 root 运行）时同样只改名不压缩
+
+用法:
+    python3 rotate-external-logs.py /var/log/nginx/access.log /var/log/nginx/error.log
+    python3 rotate-external-logs.py /var/log/nginx/*.log --pidfile /run/nginx.pid --keep 30 --detach
+    python3 rotate-external-logs.py /data/app/app.log --command 'systemctl kill -s HUP app' --compress-format xz
+    python3 rotate-external-logs.py /data/app/app.log --pid 4321 --signal HUP
+
+"""
+
+import os, sys, time, gzip, lzma, errno, shlex, shutil, signal, argparse, subprocess
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+
+nginx_pidfile = '/run/nginx.pid'
+
+# 压缩格式: (打开函数, 扩展名)
+COMPRESSORS = {
+    'gz': (gzip.open, '.gz'),
+    'xz': (lzma.open, '.xz'),
+}
+
+SUFFIX_FORMAT = '%Y%m%d-%H%M%S'
+
+# 扫描 /proc 时可以忽略的错误：进程或 fd 在扫描过程中消失了
+VANISHED_ERRNOS = (errno.ENOENT, errno.ESRCH)
+
+
+def rotate_file(path, suffix):
+    """把日志改名为带时间戳的分段，返回 (新路径, (设备号, inode))；空文件返回 None"""
+    st = os.stat(path)
+    if st.st_size == 0:
+        return None
+    target = f"{path}.{suffix}"
+    n = 0
+    while os.path.exists(target) or any(os.path.exists(target + ext) for _, ext in COMPRESSORS.values()):
+        n += 1
+        target = f"{path}.{suffix}.{n}"
+    os.rename(path, target)
+    return target, (st.st_dev, st.st_ino)
+
+
+def parse_signal(value):
+    """argparse 类型：USR1、SIGHUP 这样的信号名或信号编号"""
+    name = value.strip().upper().removeprefix('SIG')
+    try:
+        return signal.Signals(int(name)) if name.isdigit() else signal.Signals['SIG' + name]
+    except (KeyError, ValueError):
+        raise argparse.ArgumentTypeError(f"unknown signal: {value}") from None
+
+
+def read_pid(pidfile):
+    with open(pidfile) as f:
+        return int(f.read().strip())
+
+
+def notify_reopen(pid=None, pidfile=None, sig=signal.SIGUSR1, command=None):
+    """通知进程重新打开日志文件：执行命令，或者向 pid / pid 文件中的进程发送信号"""
+    if command:
+        subprocess.run(shlex.split(command), check=True, capture_output=True, text=True)
+        return
+    if pid is None:
+        pid = read_pid(pidfile)
+    os.kill(pid, sig)
+
+
+def open_inodes(targets):
+    """扫描 /proc/*/fd，返回 targets 中仍被某个进程打开的 (设备号, inode) 集合
+
+    只忽略扫描期间退出的进程和关闭的 fd；没有权限查看某个进程的 fd（非 root 运行）时抛出 OSError，
+    这时无法确认写入方已经关闭旧文件，调用方不能压缩或删除它。
+    """
+    found = set()
+    for proc in os.scandir('/proc'):
+        if not proc.name.isdigit():
+            continue
+        try:
+            fds = os.scandir(f'/proc/{proc.name}/fd')
+        except OSError as e:
+            if e.errno in VANISHED_ERRNOS:
+                continue
+            raise
+        with fds:
+            for fd in fds:
+                try:
+                    st = os.stat(fd.path)
+                except OSError as e:
+                    if e.errno in VANISHED_ERRNOS:
+                        continue
+                    raise
+                key = (st.st_dev, st.st_ino)
+                if key in targets:
+                    found.add(key)
+                    if len(found) == len(targets):
+                        return found
+    return found
+
+
+def compress_file(task):
+    """在子进程中压缩单个文件，返回 (原路径, 新路径, 错误信息)"""
+    path, fmt, nice = task
+    if nice:
+        os.nice(nice)
+    opener, ext = COMPRESSORS[fmt]
+    target = path + ext
+    tmp_path = target + '.tmp'
+    try:
+        st = os.stat(path)
+        with open(path, 'rb') as src, opener(tmp_path, 'wb') as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+        os.chmod(tmp_path, st.st_mode & 0o7777)
+        os.utime(tmp_path, ns=(st.st_atime_ns, st.st_mtime_ns))
+        os.replace(tmp_path, target)
+        os.remove(path)
+        return path, target, None
+    except Exception as e:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        return path, None, str(e)
+
+
+def remove_old_segments(path, keep, protected=()):
+    """只保留 path 最新的 keep 个轮替分段（包括已压缩的），按修改时间删除更旧的
+
+    protected 中的分段（可能仍被写入方打开，或无法确认已关闭）不参与清理。
+    """
+    protected = {os.path.abspath(p) for p in protected}
+    directory, name = os.path.split(os.path.abspath(path))
+    prefix = name + '.'
+    segments = []
+    for entry in os.scandir(directory):
+        rest = entry.name[len(prefix):]
+        if entry.path in protected:
+            continue
+        if entry.name.startswith(prefix) and rest[:8].isdigit() and not entry.name.endswith('.tmp'):
+            segments.append((entry.stat().st_mtime, entry.path))
+    segments.sort()
+    for _, old in segments[:max(0, len(segments) - keep)]:
+        try:
+            os.remove(old)
+            print(f"Removed old segment: {old}")
+        except OSError as e:
+            print(f"Error removing {old}: {e}", file=sys.stderr)
+
+
+def wait_and_compress(rotated, fmt='gz', timeout=60.0, poll=0.5, workers=None, nice=10, compress=True):
+    """等待旧文件的 fd 全部关闭，关闭一个就提交压缩一个；返回未能压缩的文件列表"""
+    pending = {key: target for _, target, key in rotated}
+    failed = []
+    deadline = time.monotonic() + timeout
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = []
+        while pending:
+            try:
+                still_open = open_inodes(set(pending))
+            except OSError as e:
+                # 查不到全部进程打开的文件，宁可不压缩，也不能删除可能仍在写入的文件
+                for path in pending.values():
+                    print(f"Cannot check whether {path} is still open ({e}), not compressing", file=sys.stderr)
+                    failed.append(path)
+                break
+            for key in list(pending):
+                if key in still_open:
+                    continue
+                path = pending.pop(key)
+                print(f"Closed by all writers: {path}")
+                if compress:
+                    futures.append(executor.submit(compress_file, (path, fmt, nice)))
+            if not pending:
+                break
+            if time.monotonic() >= deadline:
+                for path in pending.values():
+                    print(f"Still open after {timeout:.0f}s, not compressing: {path}", file=sys.stderr)
+                    failed.append(path)
+                break
+            time.sleep(poll)
+        for future in futures:
+            path, target, error = future.result()
+            if error is not None:
+                print(f"Error compressing {path}: {error}", file=sys.stderr)
+                failed.append(path)
+            else:
+                print(f"Compressed: {path} -> {target}")
+    return failed
+
+
+def rotate(paths, pid=None, pidfile=nginx_pidfile, sig=signal.SIGUSR1, command=None, fmt='gz',
+           timeout=60.0, workers=None, nice=10, keep=None, compress=True, detach=False):
+    suffix = datetime.now().strftime(SUFFIX_FORMAT)
+    rotated = []
+    for path in paths:
+        try:
+            result = rotate_file(path, suffix)
+        except OSError as e:
+            print(f"Error rotating {path}: {e}", file=sys.stderr)
+            continue
+        if result is None:
+            print(f"Skipped empty file: {path}")
+            continue
+        print(f"Renamed: {path} -> {result[0]}")
+        rotated.append((path, *result))
+    if not rotated:
+        return 0
+
+    try:
+        notify_reopen(pid, pidfile, sig, command)
+    except (OSError, ValueError, subprocess.CalledProcessError) as e:
+        # 进程没有收到通知，还在写改名后的文件，改回原名
+        print(f"Failed to notify the writer to reopen logs: {e}", file=sys.stderr)
+        for path, target, _ in rotated:
+            if not os.path.exists(path):
+                os.rename(target, path)
+                print(f"Restored: {target} -> {path}")
+        return 1
+
+    if detach and os.fork() > 0:
+        # 父进程直接返回，等待和压缩在子进程中继续
+        return 0
+    if detach:
+        os.setsid()
+
+    failed = wait_and_compress(rotated, fmt, timeout, workers=workers, nice=nice, compress=compress)
+    if keep is not None:
+        for path, _, _ in rotated:
+            remove_old_segments(path, keep, failed)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Rotate logs written by other processes without copying them')
+    parser.add_argument('paths', nargs='+', help='active log files to rotate')
+    parser.add_argument('--pidfile', default=nginx_pidfile, help=f'pid file of the writer (default: {nginx_pidfile})')
+    parser.add_argument('--pid', type=int, default=None, help='pid of the writer, overrides --pidfile')
+    parser.add_argument('--signal', type=parse_signal, default='USR1', help='signal that makes the writer reopen its logs (default: USR1)')
+    parser.add_argument('--command', default=None, help="command that makes the writer reopen its logs, e.g. 'nginx -s reopen'")
+    parser.add_argument('--timeout', type=float, default=60.0, help='seconds to wait for the old file to be closed')
+    parser.add_argument('--compress-format', default='gz', choices=sorted(COMPRESSORS))
+    parser.add_argument('--no-compress', action='store_true', help='only rename and reopen')
+    parser.add_argument('--workers', type=int, default=None, help='compression processes (default: CPU count)')
+    parser.add_argument('--nice', type=int, default=10, help='niceness increment for compression processes')
+    parser.add_argument('--keep', type=int, default=None, help='rotated segments to keep per log, compressed or not')
+    parser.add_argument('--detach', action='store_true', help='wait and compress in the background and return immediately')
+    args = parser.parse_args()
+
+    sys.exit(rotate(args.paths, args.pid, args.pidfile, args.signal, args.command, args.compress_format, args.timeout,
+                    args.workers, args.nice, args.keep, not args.no_compress, args.detach))
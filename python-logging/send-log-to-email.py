@@ -43,33 +43,347 @@ SMTP配置说明:
     主题: Error log
     内容: 20250704_14:30:25-smtp_logger-ERROR: This is an error message.
     ```
+
+摘要合并的异步邮件处理器:
+    SMTPHandler 每条日志都在调用线程里新建一次 SMTP 连接并同步发送，
+    出现大量错误时应用会被邮件发送阻塞，收件箱也会被刷屏。
+    DigestSMTPHandler 的做法:
+    - emit() 只把记录放入有界队列，调用线程不做任何网络 I/O；队列满时丢弃并计数
+    - 后台线程收到第一条记录后等待 window 秒，把这段时间内的记录合并成一封摘要邮件；
+      累计到 max_batch 条时提前发送
+    - 相同的消息（同一记录器、级别和消息内容）只保留一条，附带出现次数和首次/最后时间
+    - SMTP 连接在多次发送之间复用（只登录一次），断开后自动重连并重发
+    - close() 会发送队列中剩余的记录，flush() 立即发送当前积累的摘要
+
+    LocalSMTPServer 是一个只保存邮件的本地 SMTP 服务器，用来在没有真实邮箱时测试:
+    python3 send-log-to-email.py test --records 5000 --window 1
+
+用法:
+    python3 send-log-to-email.py                      # 原来的演示：每条日志单独发送一封邮件
+    python3 send-log-to-email.py test                 # 用本地 SMTP 服务器测试摘要处理器
+
+    handler = DigestSMTPHandler(('smtp.163.com', 25), 'xxxxxx@163.com', ['xxxxx@qq.com'], 'Error log',
+                                credentials=('user', 'password'), window=60, max_batch=500)
 """
 
-import logging, os
+import logging, os, sys, time, email, queue, smtplib, argparse, threading, socketserver
+import email.policy
+from datetime import datetime
+from email.message import EmailMessage
 from logging.handlers import SMTPHandler
 
-os.chdir('/path/to/python/')
+LOG_FORMAT = '%(asctime)s-%(name)s-%(levelname)s: %(message)s'
+DATE_FORMAT = '%Y%m%d_%H:%M:%S'
+
+
+class DigestSMTPHandler(logging.Handler):
+    """在后台线程中把一段时间内的日志合并成摘要邮件，通过复用的 SMTP 连接发送"""
+
+    _stop = object()
+    _flush = object()
+
+    def __init__(self, mailhost, fromaddr, toaddrs, subject, credentials=None, secure=None, timeout=10.0,
+                 window=60.0, max_batch=500, max_queue=10000):
+        super().__init__()
+        if isinstance(mailhost, (list, tuple)):
+            self.mailhost, self.mailport = mailhost
+        else:
+            self.mailhost, self.mailport = mailhost, None
+        self.fromaddr = fromaddr
+        self.toaddrs = [toaddrs] if isinstance(toaddrs, str) else list(toaddrs)
+        self.subject = subject
+        self.credentials = credentials
+        self.secure = secure
+        self.timeout = timeout
+        self.window = window
+        self.max_batch = max_batch
+        self.queue = queue.Queue(max_queue)
+        self.dropped = 0
+        self._dropped_reported = 0
+        self.sent = 0
+        self.connections = 0
+        self._smtp = None
+        self._flushed = threading.Event()
+        self._worker = threading.Thread(target=self._run, name='digest-smtp', daemon=True)
+        self._worker.start()
+
+    def emit(self, record):
+        # 和 QueueHandler.prepare 一样在调用线程中格式化：参数之后可能被修改，异常上下文也只在这里有效
+        try:
+            entry = (record.name, record.levelno, record.getMessage(), self.format(record), record.created)
+        except Exception:
+            self.handleError(record)
+            return
+        try:
+            self.queue.put_nowait(entry)
+        except queue.Full:
+            # 队列已满说明邮件发送跟不上，丢弃而不是阻塞调用线程
+            self.dropped += 1
+
+    def flush(self):
+        if not self._worker.is_alive():
+            return
+        self._flushed.clear()
+        self.queue.put(self._flush)
+        self._flushed.wait(self.timeout + self.window)
+
+    def close(self):
+        if self._worker.is_alive():
+            self.queue.put(self._stop)
+            self._worker.join()
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._smtp = None
+        super().close()
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is self._stop:
+                return
+            if item is self._flush:
+                self._flushed.set()
+                continue
+            # 第一条记录到达后开始计时，窗口结束或达到 max_batch 时发送
+            batch = {}
+            self._add(batch, item)
+            count = 1
+            deadline = time.monotonic() + self.window
+            stop = flush = False
+            while count < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is self._stop:
+                    stop = True
+                    break
+                if item is self._flush:
+                    flush = True
+                    break
+                self._add(batch, item)
+                count += 1
+            try:
+                self._send_digest(batch, count)
+            finally:
+                # 摘要发送完（或失败）之后才让 flush() 返回
+                if flush:
+                    self._flushed.set()
+            if stop:
+                return
+
+    def _add(self, batch, item):
+        name, levelno, message, text, created = item
+        key = (name, levelno, message)
+        entry = batch.get(key)
+        if entry is None:
+            # [次数, 第一条的格式化文本, 第一次时间, 最后时间]
+            batch[key] = [1, text, created, created]
+        else:
+            entry[0] += 1
+            entry[3] = created
+
+    def format_digest(self, batch, count):
+        lines = [f"{count} log records, {len(batch)} distinct messages", '']
+        for repeat, text, first, last in batch.values():
+            if repeat > 1:
+                first = datetime.fromtimestamp(first).strftime('%H:%M:%S')
+                last = datetime.fromtimestamp(last).strftime('%H:%M:%S')
+                text = f"[x{repeat}, {first} - {last}] {text}"
+            lines.append(text)
+        dropped = self.dropped - self._dropped_reported
+        if dropped:
+            lines.append('')
+            lines.append(f"{dropped} records dropped because the queue was full")
+        return '\n'.join(lines)
+
+    def _connect(self):
+        port = self.mailport or smtplib.SMTP_PORT
+        smtp = smtplib.SMTP(self.mailhost, port, timeout=self.timeout)
+        if self.secure is not None:
+            smtp.ehlo()
+            smtp.starttls(*self.secure)
+            smtp.ehlo()
+        if self.credentials:
+            smtp.login(*self.credentials)
+        self.connections += 1
+        return smtp
+
+    def _send_digest(self, batch, count):
+        msg = EmailMessage()
+        msg['From'] = self.fromaddr
+        msg['To'] = ','.join(self.toaddrs)
+        msg['Subject'] = f"{self.subject} ({count} records)" if count > 1 else self.subject
+        msg['Date'] = datetime.now().astimezone().strftime('%a, %d %b %Y %H:%M:%S %z')
+        dropped = self.dropped
+        msg.set_content(self.format_digest(batch, count))
+        for attempt in range(2):
+            try:
+                if self._smtp is None:
+                    self._smtp = self._connect()
+                self._smtp.send_message(msg)
+                self.sent += 1
+                self._dropped_reported = dropped
+                return
+            except smtplib.SMTPServerDisconnected as e:
+                # 连接被服务器关闭（空闲超时等），重连后再试一次
+                self._smtp = None
+                error = e
+            except smtplib.SMTPException as e:
+                # 收件人被拒绝等错误，重试也不会成功
+                error = e
+                break
+            except OSError as e:
+                self._smtp = None
+                error = e
+        print(f"Failed to send log digest: {error}", file=sys.stderr)
+
+
+class SMTPRequestHandler(socketserver.StreamRequestHandler):
+    """最简单的 SMTP 会话处理：接受所有发件人和收件人，邮件内容保存在 server.messages 中"""
+
+    def reply(self, line):
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.connections += 1
+        self.reply('220 localhost SMTP stand-in')
+        mail_from, rcpt_to = None, []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode('utf-8', 'replace').strip()
+            verb = command[:4].upper()
+            if verb in ('HELO', 'EHLO'):
+                self.reply('250 localhost')
+            elif verb == 'MAIL':
+                mail_from, rcpt_to = command[10:].strip(), []
+                self.reply('250 OK')
+            elif verb == 'RCPT':
+                rcpt_to.append(command[8:].strip())
+                self.reply('250 OK')
+            elif verb == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                data = []
+                for raw in self.rfile:
+                    if raw in (b'.\r\n', b'.\n'):
+                        break
+                    data.append(raw[1:] if raw.startswith(b'..') else raw)
+                with server.lock:
+                    server.messages.append((mail_from, rcpt_to, b''.join(data)))
+                self.reply('250 OK')
+            elif verb in ('NOOP', 'RSET'):
+                self.reply('250 OK')
+            elif verb == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('502 Command not implemented')
+
+
+class LocalSMTPServer(socketserver.ThreadingTCPServer):
+    """本地 SMTP 替身服务器，记录收到的邮件和连接次数"""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address=('127.0.0.1', 0)):
+        super().__init__(address, SMTPRequestHandler)
+        self.lock = threading.Lock()
+        self.messages = []
+        self.connections = 0
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self.server_address
+
+
+def cmd_test(args):
+    server = LocalSMTPServer()
+    host, port = server.start()
+
+    logger = logging.getLogger('digest_logger')
+    logger.setLevel(logging.ERROR)
+    logger.propagate = False
+    handler = DigestSMTPHandler((host, port), 'alert@localhost', ['ops@localhost'], 'Error log',
+                                window=args.window, max_batch=args.max_batch)
+    handler.setFormatter(logging.Formatter(LOG_FORMAT, datefmt=DATE_FORMAT))
+    logger.addHandler(handler)
+
+    # 模拟错误风暴：少量不同的错误反复出现
+    start = time.perf_counter()
+    for i in range(args.records):
+        logger.error('Connection to upstream %s failed', f'10.0.0.{i % args.distinct}')
+    caller = time.perf_counter() - start
+    logger.removeHandler(handler)
+    handler.close()
+    server.shutdown()
+    server.server_close()
+
+    print(f"{args.records} records logged in {caller * 1000:.1f} ms ({args.records / caller:,.0f} rec/s in the caller)")
+    print(f"{len(server.messages)} digest emails over {server.connections} SMTP connection(s), "
+          f"{handler.dropped} dropped")
+    if server.messages:
+        digest = email.message_from_bytes(server.messages[0][2], policy=email.policy.default)
+        print(f"--- first digest: {digest['Subject']} ---")
+        print(digest.get_content().strip()[:1000])
+
+
+def demo():
+    os.chdir('/path/to/python/')
+
+    # 创建一个日志记录器
+    logger = logging.getLogger('smtp_logger')
+    logger.setLevel(logging.ERROR)
+
+    # 创建SMTP处理器,password是发件邮箱的smtp的授权码
+    smtp_handler = SMTPHandler(mailhost=('smtp.163.com', 25),
+                               fromaddr='xxxxxx@163.com',
+                               toaddrs=['xxxxx@qq.com'],
+                               subject="Error log",
+                               credentials=('user','password'),
+                               secure=()
+                               )
+
+    # 创建格式化器
+    formatter = logging.Formatter(LOG_FORMAT, datefmt=DATE_FORMAT)
+    smtp_handler.setFormatter(formatter)
+
+    # 将处理器添加到记录器上
+    logger.addHandler(smtp_handler)
+
+    # 记录日志，每一条日志独立发送
+    logger.error(f'This is an error message.')
+    logger.critical(f'This is an critical message.')
+
 
-# 创建一个日志记录器
-logger = logging.getLogger('smtp_logger')
-logger.setLevel(logging.ERROR)
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description='Send error logs by email')
+    sub = parser.add_subparsers(dest='command')
 
-# 创建SMTP处理器,password是发件邮箱的smtp的授权码
-smtp_handler = SMTPHandler(mailhost=('smtp.163.com', 25),
-                           fromaddr='xxxxxx@163.com',
-                           toaddrs=['xxxxx@qq.com'],
-                           subject="Error log",
-                           credentials=('user','password'),
-                           secure=()
-                           )
+    p = sub.add_parser('test', help='run DigestSMTPHandler against a local SMTP stand-in')
+    p.add_argument('--records', type=int, default=5000, help='error records to log')
+    p.add_argument('--distinct', type=int, default=3, help='number of distinct messages')
+    p.add_argument('--window', type=float, default=1.0, help='seconds to collect records into one digest')
+    p.add_argument('--max-batch', type=int, default=2000, help='send a digest early after this many records')
+    p.set_defaults(func=cmd_test)
 
-# 创建格式化器
-formatter = logging.Formatter('%(asctime)s-%(name)s-%(levelname)s: %(message)s', datefmt='%Y%m%d_%H:%M:%S')
-smtp_handler.setFormatter(formatter)
+    return parser
 
-# 将处理器添加到记录器上
-logger.addHandler(smtp_handler)
 
-# 记录日志，每一条日志独立发送
-logger.error(f'This is an error message.')
-logger.critical(f'This is an critical message.')
\ No newline at end of file
+if __name__ == '__main__':
+    args = build_arg_parser().parse_args()
+    # 不带子命令时保持原来的演示行为
+    if args.command is None:
+        demo()
+    else:
+        args.func(args)
@@ -0,0 +1,47 @@
+import os, time
+
+import pytest
+
+from conftest import load_script
+
+
+@pytest.fixture(scope='module')
+def col():
+    return load_script('clear-old-logs.py')
+
+
+def make_logs(tmp_path, ages):
+    """按给定的小时数创建日志，返回 clean_root 产出的 (修改时间, 大小, 路径, 设备号) 列表"""
+    now = time.time()
+    files = []
+    for name, hours in ages.items():
+        path = tmp_path / name
+        path.write_bytes(b'x' * 100)
+        mtime = now - hours * 3600
+        os.utime(path, (mtime, mtime))
+        files.append((mtime, 100, str(path), os.stat(path).st_dev))
+    return files
+
+
+def test_budget_deletes_oldest_first(col, tmp_path):
+    files = make_logs(tmp_path, {'app.log.3': 72, 'app.log.2': 48, 'app.log.1': 24, 'app.log': 0})
+    summary = col.enforce_budget(files, max_size=250, verbose=False)
+    assert summary['deleted'] == 2
+    assert sorted(os.listdir(tmp_path)) == ['app.log', 'app.log.1']
+
+
+def test_unreachable_budget_keeps_active_and_recent_logs(col, tmp_path, capsys):
+    files = make_logs(tmp_path, {'app.log.2': 48, 'app.log.1': 0.5, 'app.log': 0, 'error.log': 0.1})
+    summary = col.enforce_budget(files, max_size=0, verbose=False, min_mtime=time.time() - 3600)
+    assert summary['deleted'] == 1
+    assert sorted(os.listdir(tmp_path)) == ['app.log', 'app.log.1', 'error.log']
+    assert 'budget not reached' in capsys.readouterr().err
+
+
+def test_keep_newest_per_directory(col, tmp_path):
+    (tmp_path / 'a').mkdir()
+    (tmp_path / 'b').mkdir()
+    files = make_logs(tmp_path, {'a/x.log.1': 30, 'a/x.log': 20, 'b/y.log.1': 40, 'b/y.log': 10})
+    col.enforce_budget(files, max_size=0, verbose=False, keep_newest=1)
+    assert os.listdir(tmp_path / 'a') == ['x.log']
+    assert os.listdir(tmp_path / 'b') == ['y.log']
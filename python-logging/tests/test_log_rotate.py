@@ -0,0 +1,103 @@
+import gzip, logging, logging.handlers, os, re
+
+import pytest
+
+from conftest import load_script
+
+
+@pytest.fixture(scope='module')
+def lr():
+    return load_script('log-rotate.py')
+
+
+def records(count, width=20):
+    return [logging.makeLogRecord({'msg': f'message {i:0{width}d}'}) for i in range(count)]
+
+
+def read_lines(path):
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rb') as f:
+        return f.read().decode().splitlines()
+
+
+def write(handler, batch, one_by_one=False):
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    if one_by_one:
+        for record in batch:
+            handler.emit(record)
+    else:
+        handler.emit_batch(batch)
+    handler.close()
+
+
+def test_batch_handler_rolls_over_like_rotating_file_handler(lr, tmp_path):
+    batch = records(200)
+    (tmp_path / 'stock').mkdir()
+    (tmp_path / 'batch').mkdir()
+    write(logging.handlers.RotatingFileHandler(tmp_path / 'stock' / 'app.log', maxBytes=1000, backupCount=3), batch,
+          one_by_one=True)
+    write(lr.BatchRotatingFileHandler(str(tmp_path / 'batch' / 'app.log'), maxBytes=1000, backupCount=3), batch)
+
+    names = sorted(os.listdir(tmp_path / 'stock'))
+    assert names == ['app.log', 'app.log.1', 'app.log.2', 'app.log.3']
+    assert sorted(os.listdir(tmp_path / 'batch')) == names
+    for name in names:
+        assert read_lines(str(tmp_path / 'batch' / name)) == read_lines(str(tmp_path / 'stock' / name))
+    # 保留的文件里是最后写入的那部分日志，每个文件都不超过 maxBytes
+    kept = [line for name in reversed(names) for line in read_lines(str(tmp_path / 'batch' / name))]
+    assert kept == [r.msg for r in batch[-len(kept):]]
+    assert all(os.path.getsize(tmp_path / 'batch' / name) <= 1000 for name in names)
+
+
+def test_batch_listener_writes_every_record(lr, tmp_path):
+    logger, listener = lr.setup_batch_logging('test_batch_listener', str(tmp_path / 'app.log'), max_bytes=4096,
+                                              backup_count=1000, batch_size=64, fmt='%(message)s')
+    for i in range(1000):
+        logger.debug('message %d', i)
+    listener.stop()
+    listener.handler.close()
+    assert lr.count_lines(str(tmp_path), 'app.log') == (len(os.listdir(tmp_path)), 1000)
+
+
+def segment_order(path):
+    """按分段时间戳和同一秒内的序号排序"""
+    m = re.search(r'\.(\d{8}-\d{6})(?:\.(\d+))?\.gz$', path)
+    return m.group(1), int(m.group(2) or 0)
+
+
+def test_compressing_handler_keeps_every_line_in_order(lr, tmp_path):
+    log = str(tmp_path / 'app.log')
+    batch = records(500)
+    write(lr.CompressingRotatingFileHandler(log, maxBytes=2000), batch)
+
+    segments = sorted((str(p) for p in tmp_path.iterdir() if p.name != 'app.log'), key=segment_order)
+    assert len(segments) > 1
+    assert all(path.endswith('.gz') for path in segments)
+    lines = [line for path in segments for line in read_lines(path)] + read_lines(log)
+    assert lines == [r.msg for r in batch]
+
+
+def test_compressing_handler_retention(lr, tmp_path):
+    log = str(tmp_path / 'app.log')
+    write(lr.CompressingRotatingFileHandler(log, maxBytes=2000, backupCount=3), records(500))
+    segments = [p.name for p in tmp_path.iterdir() if p.name != 'app.log']
+    assert len(segments) == 3
+    assert all(name.endswith('.gz') for name in segments)
+
+
+def test_segment_numbers_are_not_reused_after_pruning(lr, tmp_path, monkeypatch):
+    # 所有轮替都发生在同一秒内
+    monkeypatch.setattr(lr.time, 'time', lambda: 1914391638.0)
+    log = str(tmp_path / 'app.log')
+    handler = lr.CompressingRotatingFileHandler(log, backupCount=1)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    segment = f"{log}.{lr.time.strftime(handler.SEGMENT_FORMAT, lr.time.localtime(1914391638.0))}"
+    for i in range(4):
+        handler.emit(logging.makeLogRecord({'msg': f'rollover {i}'}))
+        handler.doRollover()
+        # 等压缩和清理完成，下一次轮替时更早的分段已经被删除
+        handler.pending.join()
+    handler.close()
+
+    assert sorted(os.listdir(tmp_path)) == ['app.log', os.path.basename(segment) + '.3.gz']
+    assert read_lines(segment + '.3.gz') == ['rollover 3']
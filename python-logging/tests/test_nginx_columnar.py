@@ -0,0 +1,13 @@
+def test_bad_timestamp_keeps_columns_aligned(nla, tmp_path):
+    path = tmp_path / 'access.log'
+    path.write_text(
+        '10.0.0.1 - - [31/Feb/2030:11:27:18 +0800] "GET /bad HTTP/1.1" 200 10 "-" "curl/8.0" "-"\n'
+        '10.0.0.2 - - [30/Aug/2030:11:27:18 +0800] "GET /good HTTP/1.1" 404 20 "-" "curl/8.0" "-"\n')
+    stats = nla.ParseStats()
+    columns = nla.parse_log_columnar(str(path), stats=stats)
+    assert stats.errors == 1
+    assert len(columns) == 1
+    assert len(columns.status) == len(columns.size) == len(columns.time) == len(columns.ip.codes) == 1
+    assert columns.row(0)['IP'] == '10.0.0.2'
+    assert columns.row(0)['status'] == 404
+    assert list(columns.indices_where(status_min=400)) == [0]
@@ -0,0 +1,38 @@
+import pytest
+
+LINE = '{ip} - - [30/Aug/2030:11:{minute:02d}:{second:02d} +0800] "GET {path} HTTP/1.1" {status} 512 "-" "curl/8.0" "-"'
+
+
+@pytest.fixture(scope='module')
+def access_log(tmp_path_factory):
+    path = tmp_path_factory.mktemp('query') / 'access.log'
+    lines = []
+    for i in range(3000):
+        ip = f"10.{i % 3}.{i % 7}.{i % 250 + 1}" if i % 5 else f"192.168.{i % 4}.{i % 9 + 1}"
+        route = ('/api/users/', '/static/app.js', '/api/orders/', '/')[i % 4]
+        status = (200, 304, 404, 500, 502)[i % 5 if i % 11 else 3]
+        lines.append(LINE.format(ip=ip, minute=i // 60 % 60, second=i % 60, path=route + str(i % 13),
+                                 status=status))
+    lines.insert(100, 'malformed line')
+    path.write_text('\n'.join(lines) + '\n')
+    return str(path)
+
+
+@pytest.mark.parametrize('expression', [
+    'ip^=10.',
+    'ip^=10. and ip^=10.1',
+    'ip^=10.1 and ip^=10.',
+    'ip^=10. and ip!=10.1.1.2',
+    'ip=10.1.1.2 and ip^=10.1',
+    'path^=/api/ and path^=/api/users/',
+    'path^=/api/ and path!=/api/orders/1',
+    'status>=500 and status!=502',
+    'status=5xx and status<=500',
+    'ip^=10. and path^=/api/ and status>=400',
+    'ip^=10.2 and path^=/api/orders/ and status=404 and time>=2030-08-30T11:10+08:00',
+])
+def test_pushdown_matches_no_pushdown(nla, access_log, expression):
+    pushed = list(nla.query_log(access_log, expression))
+    parsed = list(nla.query_log(access_log, expression, pushdown=False))
+    assert pushed == parsed
+    assert parsed
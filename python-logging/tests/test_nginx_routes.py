@@ -0,0 +1,50 @@
+import random
+
+import pytest
+
+
+def slug_paths(seed=3, count=3000):
+    rng = random.Random(seed)
+    paths = []
+    for i in range(count):
+        slug = f'post-{rng.randint(0, 400)}'
+        paths.append(rng.choice([f'/blog/{slug}', f'/blog/{slug}/comments', f'/api/users/{i}', '/about']))
+    return paths
+
+
+def test_fanout_collapses_literals_seen_before(nla):
+    normalizer = nla.RouteNormalizer(max_children=3)
+    first = [normalizer.normalize(f'/blog/{slug}') for slug in ('a', 'b', 'c')]
+    assert first == ['/blog/a', '/blog/b', '/blog/c']
+    assert normalizer.normalize('/blog/d') == '/blog/*'
+    assert normalizer.normalize('/blog/a') == '/blog/*'
+    assert [normalizer.canonical(template) for template in first] == ['/blog/*'] * 3
+
+
+def test_templates_and_rules_do_not_count_towards_fanout(nla):
+    normalizer = nla.RouteNormalizer(templates=['/api/users/me'], max_children=1)
+    assert normalizer.normalize('/api/users/42') == '/api/users/:id'
+    assert normalizer.normalize('/api/users/me') == '/api/users/me'
+    assert normalizer.normalize('/api/users/alice') == '/api/users/alice'
+    assert normalizer.normalize('/api/users/bob') == '/api/users/*'
+    assert normalizer.normalize('/api/users/me') == '/api/users/me'
+
+
+@pytest.mark.parametrize('shards', [1, 2, 5])
+def test_templates_do_not_depend_on_order_or_shards(nla, shards):
+    paths = slug_paths()
+    shuffled = list(paths)
+    random.Random(1).shuffle(shuffled)
+
+    def aggregate(paths, shards):
+        total = nla.BandwidthReport(top=1000, normalizer=nla.RouteNormalizer(max_children=50))
+        for i in range(shards):
+            report = nla.BandwidthReport(top=1000, normalizer=nla.RouteNormalizer(max_children=50))
+            for path in paths[i::shards]:
+                report.update({'request': f'GET {path} HTTP/1.1', 'size': '1'})
+            total.merge(report)
+        return {item['key']: item['value'] for item in total.result()}
+
+    expected = aggregate(paths, 1)
+    assert aggregate(shuffled, shards) == expected
+    assert set(expected) == {'/blog/*', '/blog/*/comments', '/api/users/:id', '/about'}
@@ -0,0 +1,39 @@
+import pytest
+
+
+@pytest.mark.parametrize('stamp', [
+    'Aug 30 18:08:01', 'Aug  3 18:08:01', 'Aug 30 18:08', 'Feb 29 00:00:00', 'Dec 31 23:59:59', 'Aug 30 18:08:60',
+    'Feb 30 10:00:00', 'Aug 32 10:00:00', 'Aug  0 10:00:00', 'Aug 30 24:00:00', 'Aug 30 18:60:00', 'Aug 30 18:08:62',
+    'Foo 30 18:08:01',
+])
+def test_rfc3164_decoder_matches_strptime(nla, stamp):
+    expected = actual = 'ValueError'
+    try:
+        expected = nla.make_syslog_time_strptime(2028)(stamp)
+    except ValueError:
+        pass
+    decode = nla.make_rfc3164_time_decoder(lambda month: 2028)
+    try:
+        # 先解码同一小时内的合法时间，确认缓存的快速路径同样做了校验
+        decode(stamp[:10] + '00:00' if stamp[7:9] != '24' else stamp)
+    except ValueError:
+        pass
+    try:
+        actual = decode(stamp)
+    except ValueError:
+        pass
+    assert actual == expected
+
+
+@pytest.mark.parametrize('stamp', [
+    '30/Aug/2030:11:27:18 +0800', '30/Aug/2030:11:27:18 -0530', '29/Feb/2024:23:59:59 +0000',
+    '29/Feb/2023:00:00:00 +0000', '30/Aug/2030:24:00:00 +0800', '30/Aug/2030:11:27:60 +0800', 'garbage',
+])
+def test_nginx_decoder_matches_strptime(nla, stamp):
+    results = []
+    for decode in (nla.nginx_time_to_epoch_strptime, nla.make_nginx_time_decoder()):
+        try:
+            results.append(decode(stamp))
+        except ValueError:
+            results.append('ValueError')
+    assert results[0] == results[1]
@@ -0,0 +1,64 @@
+import pytest
+
+from conftest import load_script
+
+
+@pytest.fixture(scope='module')
+def pil():
+    return load_script('prase-IP-from-logs.py')
+
+
+def count(pil, tmp_path, text, ipv6):
+    path = tmp_path / 'access.log'
+    path.write_bytes(text)
+    return dict(pil.count_ips(str(path), ipv6))
+
+
+@pytest.mark.parametrize('ipv6', [False, True])
+def test_ipv4_mapped_addresses_count_as_ipv4(pil, tmp_path, ipv6):
+    text = (b'::ffff:10.0.0.1 - - [30/Aug/2030:11:27:18 +0800] "GET / HTTP/1.1" 200 1\n'
+            b'10.0.0.1 - - [30/Aug/2030:11:27:19 +0800] "GET / HTTP/1.1" 200 1\n'
+            b'2001:db8::1 - - [30/Aug/2030:11:27:20 +0800] "GET / HTTP/1.1" 200 1\n')
+    counts = count(pil, tmp_path, text, ipv6)
+    assert counts[b'10.0.0.1'] == 2
+    assert (b'2001:db8::1' in counts) == ipv6
+    assert not any(ip.startswith(b'::ffff') for ip in counts)
+
+
+def test_ipv6_mode_keeps_ipv4_totals(pil, tmp_path):
+    text = (b'client ::ffff:192.168.1.20 connected\n'
+            b'from 192.168.1.20 and ::FFFF:192.168.1.21, 64:ff9b::1 at 11:27:18\n')
+    v4 = count(pil, tmp_path, text, False)
+    both = count(pil, tmp_path, text, True)
+    assert {ip: n for ip, n in both.items() if b':' not in ip} == v4
+    assert both[b'64:ff9b::1'] == 1
+
+
+@pytest.mark.parametrize('text', [
+    b'Foo::Bar called twice\n',
+    b'std::vector<int> and Cafe::Bar\n',
+    b'separator :: between words\n',
+    b'bare :: address\n',
+    b'time 11:27:18 and ratio 3:2\n',
+])
+def test_ordinary_text_is_not_ipv6(pil, tmp_path, text):
+    assert count(pil, tmp_path, text, True) == {}
+
+
+def test_extract_ips_normalizes_mapped_addresses(pil, tmp_path):
+    path = tmp_path / 'access.log'
+    path.write_bytes(b'::ffff:10.0.0.1 a\nfe80::1 Foo::Bar ::\n')
+    assert list(pil.extract_ips(str(path), True)) == [b'10.0.0.1', b'fe80::1']
+
+
+def test_key_counts_add_up_spellings_of_one_address(pil):
+    counts = {b'2001:db8::1': 1, b'2001:DB8::1': 1, b'2001:0db8:0:0::1': 1}
+    key_counts = pil.to_key_counts(counts)
+    assert dict(key_counts) == {pil.ip_to_key(b'2001:db8::1'): 3}
+
+
+def test_ipv6_spellings_count_as_one_address(pil, tmp_path):
+    text = b'2001:db8::1 a\n2001:DB8::1 b\n2001:0db8:0:0::1 c\n'
+    assert count(pil, tmp_path, text, True) == {b'2001:db8::1': 3}
+    path = tmp_path / 'access.log'
+    assert list(pil.extract_ips(str(path), True)) == [b'2001:db8::1'] * 3
@@ -0,0 +1,97 @@
+import os, sys, time
+
+import pytest
+
+from conftest import load_script
+
+
+@pytest.fixture(scope='module')
+def rel():
+    return load_script('rotate-external-logs.py')
+
+
+@pytest.fixture
+def own_proc_only(monkeypatch):
+    """/proc 扫描只看当前进程，测试结果不受其它进程和 fd 权限影响"""
+    scandir = os.scandir
+
+    def fake_scandir(path='.'):
+        if path == '/proc':
+            return iter([entry for entry in scandir('/proc') if entry.name == str(os.getpid())])
+        return scandir(path)
+
+    monkeypatch.setattr(os, 'scandir', fake_scandir)
+
+
+def write_log(path, data=b'line\n'):
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_rotate_file_avoids_existing_segments(rel, tmp_path):
+    log = tmp_path / 'access.log'
+    write_log(tmp_path / 'access.log.20300830-112718')
+    write_log(tmp_path / 'access.log.20300830-112718.1.gz')
+    write_log(log)
+    inode = os.stat(log).st_ino
+    target, key = rel.rotate_file(str(log), '20300830-112718')
+    assert target == str(log) + '.20300830-112718.2'
+    assert key[1] == inode
+    assert not log.exists()
+    assert rel.rotate_file(write_log(log, b''), '20300830-112718') is None
+
+
+def test_failed_notification_restores_original_name(rel, tmp_path):
+    log = write_log(tmp_path / 'app.log')
+    rc = rel.rotate([log], command=f'{sys.executable} -c "raise SystemExit(1)"', compress=False)
+    assert rc == 1
+    assert os.listdir(tmp_path) == ['app.log']
+
+
+def test_open_inodes_finds_file_held_open(rel, tmp_path, own_proc_only):
+    log = write_log(tmp_path / 'app.log')
+    st = os.stat(log)
+    key = (st.st_dev, st.st_ino)
+    with open(log, 'ab'):
+        assert rel.open_inodes({key}) == {key}
+    assert rel.open_inodes({key}) == set()
+
+
+def test_wait_and_compress_skips_file_held_open(rel, tmp_path, own_proc_only):
+    log = write_log(tmp_path / 'app.log')
+    with open(log, 'ab'):
+        target, key = rel.rotate_file(log, '20300830-112718')
+        failed = rel.wait_and_compress([(log, target, key)], timeout=0.2, poll=0.05, workers=1)
+    assert failed == [target]
+    assert os.path.exists(target) and not os.path.exists(target + '.gz')
+
+    failed = rel.wait_and_compress([(log, target, key)], timeout=1, poll=0.05, workers=1)
+    assert failed == []
+    assert not os.path.exists(target) and os.path.exists(target + '.gz')
+
+
+def test_wait_and_compress_fails_closed_when_fds_are_unreadable(rel, tmp_path, monkeypatch):
+    def denied(targets):
+        raise PermissionError(13, 'Permission denied', '/proc/1/fd')
+
+    monkeypatch.setattr(rel, 'open_inodes', denied)
+    log = write_log(tmp_path / 'app.log')
+    target, key = rel.rotate_file(log, '20300830-112718')
+    assert rel.wait_and_compress([(log, target, key)], timeout=1, workers=1) == [target]
+    assert os.path.exists(target)
+
+
+def test_remove_old_segments_keeps_newest_and_protected(rel, tmp_path):
+    log = write_log(tmp_path / 'app.log')
+    now = time.time()
+    names = ['app.log.20300827-000000.gz', 'app.log.20300828-000000.gz',
+             'app.log.20300829-000000', 'app.log.20300830-000000.xz']
+    for age, name in enumerate(reversed(names)):
+        path = write_log(tmp_path / name)
+        os.utime(path, (now - age * 86400, now - age * 86400))
+    write_log(tmp_path / 'app.log.20300826-000000.gz.tmp')
+    write_log(tmp_path / 'app.log.old')
+
+    rel.remove_old_segments(log, 2, [str(tmp_path / names[0])])
+    assert sorted(os.listdir(tmp_path)) == sorted(['app.log', 'app.log.old', 'app.log.20300826-000000.gz.tmp',
+                                                   names[0], names[2], names[3]])
@@ -0,0 +1,100 @@
+import email, email.policy, logging, socket
+
+import pytest
+
+from conftest import load_script
+
+
+@pytest.fixture(scope='module')
+def sle():
+    return load_script('send-log-to-email.py')
+
+
+@pytest.fixture
+def server(sle):
+    class DroppingSMTPServer(sle.LocalSMTPServer):
+        """记录客户端连接，测试中可以从服务器一端断开"""
+
+        def get_request(self):
+            sock, address = super().get_request()
+            self.clients.append(sock)
+            return sock, address
+
+        def drop_connections(self):
+            for sock in self.clients:
+                sock.shutdown(socket.SHUT_RDWR)
+            self.clients = []
+
+    server = DroppingSMTPServer()
+    server.clients = []
+    server.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def logger(sle, server):
+    handler = sle.DigestSMTPHandler(server.server_address, 'alert@localhost', ['ops@localhost'], 'Error log',
+                                    window=60, max_batch=1000)
+    handler.setFormatter(logging.Formatter('%(levelname)s: %(message)s'))
+    logger = logging.getLogger('test_digest')
+    logger.propagate = False
+    logger.addHandler(handler)
+    yield logger, handler
+    logger.removeHandler(handler)
+    handler.close()
+
+
+def digest(server, index=-1):
+    message = email.message_from_bytes(server.messages[index][2], policy=email.policy.default)
+    return message['Subject'], message.get_content().splitlines()
+
+
+def test_duplicates_are_merged_with_counts(server, logger):
+    logger, handler = logger
+    for i in range(5):
+        logger.error('upstream %s failed', '10.0.0.1')
+    logger.error('upstream %s failed', '10.0.0.2')
+    logger.error('upstream %s failed', '10.0.0.2')
+    logger.critical('disk full')
+    handler.flush()
+
+    assert len(server.messages) == 1
+    subject, lines = digest(server)
+    assert subject == 'Error log (8 records)'
+    assert lines[0] == '8 log records, 3 distinct messages'
+    body = lines[2:]
+    assert len(body) == 3
+    assert body[0].startswith('[x5, ') and body[0].endswith('] ERROR: upstream 10.0.0.1 failed')
+    assert body[1].startswith('[x2, ') and body[1].endswith('] ERROR: upstream 10.0.0.2 failed')
+    assert body[2] == 'CRITICAL: disk full'
+
+
+def test_flush_sends_pending_digest(server, logger):
+    logger, handler = logger
+    logger.error('only one')
+    # window 为 60 秒，只有 flush() 会让摘要立即发出，并且发送完成后才返回
+    handler.flush()
+    assert len(server.messages) == 1
+    subject, lines = digest(server)
+    assert subject == 'Error log'
+    assert lines[2:] == ['ERROR: only one']
+    handler.flush()
+    assert len(server.messages) == 1
+
+
+def test_reconnects_after_server_drops_connection(server, logger):
+    logger, handler = logger
+    logger.error('first')
+    handler.flush()
+    logger.error('second')
+    handler.flush()
+    assert server.connections == handler.connections == 1
+
+    server.drop_connections()
+    logger.error('third')
+    handler.flush()
+    assert len(server.messages) == 3
+    assert digest(server)[1][2:] == ['ERROR: third']
+    assert server.connections == handler.connections == 2
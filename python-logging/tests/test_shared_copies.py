@@ -0,0 +1,28 @@
+"""python-logging 下的脚本都是单文件、可以单独复制使用的，少量公共函数在脚本间复制了多份，
+这里检查这些副本保持一致"""
+import inspect
+
+import pytest
+
+from conftest import load_script
+
+
+@pytest.fixture(scope='module')
+def pil():
+    return load_script('prase-IP-from-logs.py')
+
+
+def test_log_path_expansion_copies_match(nla, pil):
+    assert inspect.getsource(nla.expand_log_paths) == inspect.getsource(pil.expand_log_paths)
+    assert nla.ROTATION_SUFFIX.pattern == pil.ROTATION_SUFFIX.pattern
+    assert nla.COMPRESSED_OPENERS == pil.COMPRESSED_OPENERS
+
+
+def test_parse_size_copies_match():
+    scripts = [load_script(name) for name in ('clear-old-logs.py', 'log-rotate.py', 'log-parser-benchmark.py')]
+    sources = {inspect.getsource(script.parse_size) for script in scripts}
+    assert len(sources) == 1
+    for script in scripts:
+        assert script.parse_size('200G') == 200 * 1024 ** 3
+        assert script.parse_size('1.5MiB') == 3 * 512 * 1024
+        assert script.parse_size('4096') == 4096
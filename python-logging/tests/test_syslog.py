@@ -0,0 +1,27 @@
+import pytest
+
+
+@pytest.fixture
+def praser(nla):
+    return nla.make_syslog_praser(year=2030)
+
+
+def test_rfc5424_nilvalue_timestamp(praser):
+    record = praser('<34>1 - myhost sshd 1234 ID47 - Accepted password')
+    assert record['timestamp'] is None
+    assert record['hostname'] == 'myhost'
+    assert record['message'] == 'Accepted password'
+
+
+def test_rfc5424_timestamp(praser):
+    assert praser('<34>1 2030-08-30T18:08:01.003Z myhost sshd 1234 ID47 - msg')['timestamp'] == 1914343681
+
+
+def test_rfc5424_invalid_timestamp(praser):
+    with pytest.raises(ValueError):
+        praser('<34>1 2030-02-30T18:08:01Z myhost sshd 1234 ID47 - msg')
+
+
+def test_line_timer_skips_nilvalue(nla):
+    line_time = nla.make_line_timer('syslog')
+    assert line_time(b'<34>1 - myhost sshd 1234 ID47 - msg') is None